@@ -0,0 +1,268 @@
+"""Controle de admissão: limites por cliente e por classe de rota
+
+Poucos clientes baixando mídias em massa ou chamando `/debug` em loop podem
+ocupar todas as threads do worker e derrubar o health check (`/test`). Este
+middleware WSGI decide, antes do Flask, se a requisição entra:
+
+- cada rota pertence a uma classe (health, streaming, events, upload, api,
+  admin);
+- cada IP (o real, atrás de proxies conhecidos) tem um token bucket por
+  classe; sem token a resposta é 429 com Retry-After. Dentro do orçamento
+  do IP, cada X-Device-Id tem um sub-bucket, para um aparelho não esgotar
+  a cota dos outros atrás do mesmo NAT; trocar de X-Device-Id a cada
+  requisição não dá acesso a orçamento novo;
+- cada classe tem um teto de requisições simultâneas no worker; acima dele
+  a resposta é 503 com Retry-After. O slot só é liberado quando o corpo da
+  resposta termina de ser enviado (downloads e SSE ocupam o slot até o fim).
+  Os assinantes SSE (/api/events), que ficam conectados por minutos, têm a
+  própria classe para não esgotarem o teto dos downloads;
+- a classe health não passa por limite nenhum. Com a soma dos tetos menor
+  que o número de threads do worker, sempre sobra thread para `/test`.
+
+Os limites valem por worker (estado em memória).
+"""
+import collections
+import json
+import math
+import threading
+import time
+
+HEALTH = 'health'
+STREAMING = 'streaming'
+EVENTS = 'events'
+UPLOAD = 'upload'
+API = 'api'
+ADMIN = 'admin'
+
+STREAMING_PREFIXES = ('/api/midias/media/', '/api/files/')
+STREAMING_PATHS = ('/api/export',)
+EVENTS_PATHS = ('/api/events',)
+UPLOAD_PATHS = ('/api/midias/upload', '/api/import')
+ADMIN_PREFIXES = ('/api/admin/',)
+ADMIN_PATHS = ('/debug', '/api/db/info')
+
+
+def classify(method, path, health_paths=('/test',)):
+    """Classe de rota da requisição"""
+    if path in health_paths:
+        return HEALTH
+    if path in EVENTS_PATHS:
+        return EVENTS
+    if path.startswith(STREAMING_PREFIXES) or path in STREAMING_PATHS:
+        return STREAMING
+    if method == 'POST' and path in UPLOAD_PATHS:
+        return UPLOAD
+    if path in ADMIN_PATHS or path.startswith(ADMIN_PREFIXES):
+        return ADMIN
+    return API
+
+
+class TokenBuckets:
+    """Token buckets por chave, com descarte LRU acima de `max_keys`"""
+
+    def __init__(self, rate, burst, max_keys=10000):
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self._buckets = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, key, now=None):
+        """Consome um token; retorna 0 se admitido ou os segundos até o próximo token"""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            tokens, updated = self._buckets.pop(key, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated) * self.rate)
+            if tokens >= 1:
+                wait, tokens = 0, tokens - 1
+            else:
+                wait = (1 - tokens) / self.rate
+            self._buckets[key] = (tokens, now)
+            if len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+            return wait
+
+    def refund(self, key):
+        """Devolve o token de um `take` admitido (a requisição não entrou por outro limite)"""
+        with self._lock:
+            if key in self._buckets:
+                tokens, updated = self._buckets[key]
+                self._buckets[key] = (min(self.burst, tokens + 1), updated)
+
+
+class ConcurrencyLimit:
+    """Contador de requisições em andamento com teto (0 = sem teto)"""
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.active = 0
+        self.peak = 0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        with self._lock:
+            if self.limit and self.active >= self.limit:
+                return False
+            self.active += 1
+            self.peak = max(self.peak, self.active)
+            return True
+
+    def release(self):
+        with self._lock:
+            self.active -= 1
+
+
+class _GuardedIterable:
+    """Corpo da resposta que libera o slot ao ser fechado pelo servidor"""
+
+    def __init__(self, iterable, release):
+        self._iterable = iterable
+        self._release = release
+
+    def __iter__(self):
+        return iter(self._iterable)
+
+    def close(self):
+        try:
+            close = getattr(self._iterable, 'close', None)
+            if close:
+                close()
+        finally:
+            self._release()
+
+
+def parse_rate(value, default):
+    """'taxa:rajada' (requisições por segundo) -> (taxa, rajada)"""
+    if not value:
+        return default
+    rate, _, burst = value.partition(':')
+    rate = float(rate)
+    return rate, float(burst) if burst else max(rate, 1.0)
+
+
+class AdmissionMiddleware:
+    """Middleware WSGI que aplica os limites antes de chamar o app"""
+
+    def __init__(self, wsgi_app, rates, concurrency, health_paths=('/test',), proxy_hops=0, retry_after=1,
+                 devices_per_ip=4):
+        self.wsgi_app = wsgi_app
+        self.health_paths = tuple(health_paths)
+        self.proxy_hops = proxy_hops
+        self.retry_after = retry_after
+        # Taxa 0 desliga o rate limit da classe. Cada aparelho (ou cliente sem
+        # X-Device-Id) tem a taxa da classe; o IP inteiro, `devices_per_ip` vezes ela
+        self.buckets = {cls: TokenBuckets(rate, burst) for cls, (rate, burst) in rates.items() if rate > 0}
+        self.ip_buckets = {
+            cls: TokenBuckets(rate * devices_per_ip, burst * devices_per_ip)
+            for cls, (rate, burst) in rates.items() if rate > 0
+        }
+        self.limits = {cls: ConcurrencyLimit(limit) for cls, limit in concurrency.items()}
+        self._stats_lock = threading.Lock()
+        self.stats = collections.defaultdict(lambda: {"admitted": 0, "rate_limited": 0, "overloaded": 0})
+
+    def client_address(self, environ):
+        address = environ.get('REMOTE_ADDR', '')
+        if self.proxy_hops:
+            # Só confia no X-Forwarded-For acrescentado pelos proxies conhecidos
+            forwarded = [a.strip() for a in environ.get('HTTP_X_FORWARDED_FOR', '').split(',') if a.strip()]
+            if len(forwarded) >= self.proxy_hops:
+                address = forwarded[-self.proxy_hops]
+        return address
+
+    def rate_limit_wait(self, route_class, environ):
+        """0 se a requisição cabe no sub-bucket do aparelho e no bucket do IP"""
+        buckets = self.buckets.get(route_class)
+        if not buckets:
+            return 0
+        address = self.client_address(environ)
+        device_id = environ.get('HTTP_X_DEVICE_ID', '')[:128]
+        device_key = f"{address}|{device_id}"
+        wait = buckets.take(device_key)
+        if wait:
+            return wait
+        wait = self.ip_buckets[route_class].take(address)
+        if wait:
+            # Recusada pelo IP: o token do aparelho não foi usado
+            buckets.refund(device_key)
+        return wait
+
+    def _count(self, route_class, outcome):
+        with self._stats_lock:
+            self.stats[route_class][outcome] += 1
+
+    def _reject(self, start_response, status, message, retry_after):
+        body = json.dumps({"error": message}).encode()
+        start_response(status, [
+            ('Content-Type', 'application/json'),
+            ('Content-Length', str(len(body))),
+            ('Retry-After', str(max(1, math.ceil(retry_after)))),
+            ('Access-Control-Allow-Origin', '*'),
+        ])
+        return [body]
+
+    def __call__(self, environ, start_response):
+        method = environ.get('REQUEST_METHOD', 'GET')
+        route_class = classify(method, environ.get('PATH_INFO', ''), self.health_paths)
+        if route_class == HEALTH or method == 'OPTIONS':
+            return self.wsgi_app(environ, start_response)
+
+        wait = self.rate_limit_wait(route_class, environ)
+        if wait:
+            self._count(route_class, "rate_limited")
+            return self._reject(start_response, '429 Too Many Requests',
+                                "Limite de requisições excedido", wait)
+
+        limit = self.limits.get(route_class)
+        if limit is None:
+            self._count(route_class, "admitted")
+            return self.wsgi_app(environ, start_response)
+        if not limit.acquire():
+            self._count(route_class, "overloaded")
+            return self._reject(start_response, '503 Service Unavailable',
+                                "Servidor ocupado, tente novamente", self.retry_after)
+
+        self._count(route_class, "admitted")
+        try:
+            result = self.wsgi_app(environ, start_response)
+        except BaseException:
+            limit.release()
+            raise
+
+        file_wrapper = environ.get('wsgi.file_wrapper')
+        if file_wrapper and isinstance(file_wrapper, type) and isinstance(result, file_wrapper):
+            # Mantém o objeto do servidor (sendfile) e só encadeia a liberação no close
+            original_close = getattr(result, 'close', None)
+
+            def close():
+                try:
+                    if original_close:
+                        original_close()
+                finally:
+                    limit.release()
+            try:
+                result.close = close
+                return result
+            except AttributeError:
+                pass
+        return _GuardedIterable(result, limit.release)
+
+    def snapshot(self):
+        """Estado atual para o endpoint de administração"""
+        with self._stats_lock:
+            stats = {cls: dict(values) for cls, values in self.stats.items()}
+        return {
+            "classes": {
+                cls: {
+                    "max_concurrent": limit.limit,
+                    "active": limit.active,
+                    "peak": limit.peak,
+                    **stats.get(cls, {"admitted": 0, "rate_limited": 0, "overloaded": 0}),
+                }
+                for cls, limit in self.limits.items()
+            },
+            "rates": {
+                cls: {"rate": b.rate, "burst": b.burst,
+                      "ip_rate": self.ip_buckets[cls].rate, "ip_burst": self.ip_buckets[cls].burst}
+                for cls, b in self.buckets.items()
+            },
+        }
@@ -1,14 +1,38 @@
-from flask import Flask, jsonify, request, send_from_directory
+from flask import Flask, jsonify, request, send_from_directory, redirect, Response, stream_with_context
 from flask_cors import CORS
-from flasgger import Swagger, swag_from
 import sqlite3
+from sqlalchemy.exc import SQLAlchemyError
 import os
+from concurrent.futures import TimeoutError as FuturesTimeoutError
+from contextlib import contextmanager
 from datetime import datetime
 import base64
+import heapq
+import hmac
+import mimetypes
+import tempfile
+import time
 import uuid
+import zlib
+from reclaim import canonical_media_uri, media_filename, media_uris
+from media_layout import is_safe_filename, start_background_migration
+from storage import create_storage, LocalStorage
+from play_buffer import PartialFlushError, PlayBuffer
+from admission import AdmissionMiddleware, parse_rate
+from database import MidiaStore, create_db_engine, sqlite_url
+from backup import BackupScheduler, backup_database, list_snapshots, restore_latest, snapshot_stem
+from fingerprint import audio_fingerprint
+from hot_cache import HotMediaCache
+from events import EventHub, create_events_schema, record_event
+from library_archive import ArchiveError, export_archive, import_archive
+from singleflight import SingleFlight
+from waveform import (Waveform, WaveformError, WaveformJobs, WaveformStore, DEFAULT_POINTS as DEFAULT_WAVEFORM_POINTS,
+                      ESTIMATED_SOURCES as ESTIMATED_WAVEFORM_SOURCES, FAILURE_TTL as DEFAULT_WAVEFORM_FAILURE_TTL)
+from static_bundle import build_bundle, STATIC_FOLDER, DEFAULT_CACHE_DIR as DEFAULT_STATIC_CACHE_DIR
 
 app = Flask(__name__)
-CORS(app)
+# Headers próprios que o JavaScript de outra origem precisa ler (ex.: peaks.js)
+CORS(app, expose_headers=['X-Waveform-Source', 'X-Waveform-Estimated'])
 
 # Configuração do Swagger
 swagger_config = {
@@ -50,29 +74,145 @@ swagger_template = {
         {
             "name": "Estatísticas",
             "description": "Estatísticas da base de dados"
+        },
+        {
+            "name": "Dispositivos",
+            "description": "Mídias separadas por dispositivo"
+        },
+        {
+            "name": "Playlists",
+            "description": "Playlists ordenadas de mídias"
+        },
+        {
+            "name": "Biblioteca",
+            "description": "Exportação e importação da biblioteca"
+        },
+        {
+            "name": "Administração",
+            "description": "Backups e controle de admissão (exigem ADMIN_TOKEN)"
         }
     ]
 }
 
-swagger = Swagger(app, config=swagger_config, template=swagger_template) 
+# Modo lazy (SWAGGER_LAZY=1): usa o snapshot gerado por build_apispec.py e só
+# importa o flasgger no primeiro acesso a /docs, reduzindo o cold start
+SWAGGER_LAZY = os.environ.get('SWAGGER_LAZY', '0') == '1'
+APISPEC_FILE = os.environ.get('APISPEC_FILE', os.path.join(os.path.dirname(os.path.abspath(__file__)), "apispec.json"))
+
+if SWAGGER_LAZY and os.path.exists(APISPEC_FILE):
+    from lazy_docs import LazySwaggerMiddleware
+    app.wsgi_app = LazySwaggerMiddleware(app.wsgi_app, APISPEC_FILE, swagger_config)
+    swagger = None
+else:
+    if SWAGGER_LAZY:
+        print(f"SWAGGER_LAZY=1 mas {APISPEC_FILE} não existe; inicializando o Swagger normalmente")
+    from flasgger import Swagger
+    swagger = Swagger(app, config=swagger_config, template=swagger_template)
+
+# Página de teste e assets da Swagger UI servidos pré-comprimidos, com ETag e
+# Cache-Control, direto no WSGI (ver static_bundle.py)
+STATIC_MAX_AGE = int(os.environ.get('STATIC_MAX_AGE', 86400))
+STATIC_CACHE_DIR = os.environ.get('STATIC_CACHE_DIR', DEFAULT_STATIC_CACHE_DIR)
+
+if os.environ.get('STATIC_BUNDLE', '1') == '1':
+    try:
+        app.wsgi_app = build_bundle(app.wsgi_app, STATIC_CACHE_DIR, STATIC_MAX_AGE, swagger_config['static_url_path'])
+    except OSError as e:
+        print(f"Bundle estático desativado: {e}")
+
+# Controle de admissão (ver admission.py): token bucket por cliente e teto de
+# requisições simultâneas por classe de rota, com 429/503 + Retry-After. O
+# health check (/test) não é limitado; mantenha a soma dos tetos abaixo do
+# número de threads do worker (--threads no render.yaml)
+ADMISSION_RATES = {
+    'streaming': parse_rate(os.environ.get('ADMISSION_RATE_STREAMING'), (20, 60)),
+    'events': parse_rate(os.environ.get('ADMISSION_RATE_EVENTS'), (1, 5)),
+    'upload': parse_rate(os.environ.get('ADMISSION_RATE_UPLOAD'), (1, 5)),
+    'api': parse_rate(os.environ.get('ADMISSION_RATE_API'), (20, 40)),
+    'admin': parse_rate(os.environ.get('ADMISSION_RATE_ADMIN'), (0.5, 3)),
+}
+ADMISSION_MAX_CONCURRENT = {
+    'streaming': int(os.environ.get('ADMISSION_MAX_STREAMING', 12)),
+    # Cada assinante de /api/events ocupa uma thread enquanto está conectado
+    'events': int(os.environ.get('ADMISSION_MAX_EVENTS', 16)),
+    'upload': int(os.environ.get('ADMISSION_MAX_UPLOAD', 4)),
+    'api': int(os.environ.get('ADMISSION_MAX_API', 12)),
+    'admin': int(os.environ.get('ADMISSION_MAX_ADMIN', 2)),
+}
+
+if os.environ.get('ADMISSION_CONTROL', '1') == '1':
+    admission = AdmissionMiddleware(
+        app.wsgi_app, ADMISSION_RATES, ADMISSION_MAX_CONCURRENT,
+        proxy_hops=int(os.environ.get('ADMISSION_PROXY_HOPS', 0)),
+        devices_per_ip=float(os.environ.get('ADMISSION_DEVICES_PER_IP', 4))
+    )
+    app.wsgi_app = admission
+else:
+    admission = None
 
-DB_FILE = "midias.db"
-MEDIA_FOLDER = "media"
+# Caminhos configuráveis por variável de ambiente (usado pelos benchmarks)
+DB_FILE = os.environ.get('DB_FILE', "midias.db")
+MEDIA_FOLDER = os.environ.get('MEDIA_FOLDER', "media")
 
 # Create media folder if it doesn't exist
 if not os.path.exists(MEDIA_FOLDER):
     os.makedirs(MEDIA_FOLDER)
 
+# Backend de armazenamento dos arquivos (disco local ou S3, ver storage.py)
+storage = create_storage(MEDIA_FOLDER)
+STORAGE_REDIRECT = os.environ.get('STORAGE_REDIRECT', '0') == '1'
+S3_PRESIGN_EXPIRES = int(os.environ.get('S3_PRESIGN_EXPIRES', 3600))
+
+# Upload de um áudio que já está na biblioteca: 'allow' grava e informa
+# duplicateOf; 'reject' responde 409 (também pelo campo onDuplicate do form)
+DUPLICATE_UPLOADS = os.environ.get('DUPLICATE_UPLOADS', 'allow')
+
+# Cache dos arquivos mais tocados (ver hot_cache.py); MEDIA_CACHE_MB=0 desliga
+media_cache = HotMediaCache(
+    int(float(os.environ.get('MEDIA_CACHE_MB', 128)) * 1024 * 1024),
+    int(float(os.environ.get('MEDIA_CACHE_MAX_OBJECT_MB', 32)) * 1024 * 1024),
+    admit_after=int(os.environ.get('MEDIA_CACHE_ADMIT_AFTER', 2)),
+    remote_ttl=float(os.environ.get('MEDIA_CACHE_REMOTE_TTL', 60))
+)
+# Arquivo regravado ou removido (upload, importação, limpeza) sai do cache
+storage.add_listener(media_cache.invalidate)
+
 # ============================================================
 # FUNÇÕES DO BANCO DE DADOS
 # ============================================================
 
-def init_db():
-    """Inicializa o banco de dados SQLite"""
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
-    
-    cursor.execute('''
+# A tabela de mídias é acessada via SQLAlchemy Core (ver database.py): por
+# padrão, SQLite com um pool de conexões por base; com DATABASE_URL, um
+# servidor (PostgreSQL), sem o lock de escrita único do SQLite. Playlists,
+# eventos e o mapa de bases dedicadas continuam no SQLite local (DB_FILE),
+# então a API continua sendo uma única instância (com vários workers).
+DATABASE_URL = os.environ.get('DATABASE_URL', '')
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 10))
+DB_MAX_OVERFLOW = int(os.environ.get('DB_MAX_OVERFLOW', 20))
+DB_POOL_RECYCLE = int(os.environ.get('DB_POOL_RECYCLE', 1800))
+
+def open_midia_store(url):
+    return MidiaStore(create_db_engine(url, DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_RECYCLE))
+
+server_store = open_midia_store(DATABASE_URL) if DATABASE_URL else None
+sqlite_stores = {}   # arquivo da base -> MidiaStore
+
+def midia_store(db_file):
+    """Store da base SQLite `db_file` ou, com DATABASE_URL, o do servidor"""
+    if server_store:
+        return server_store
+    store = sqlite_stores.get(db_file)
+    if store is None:
+        store = sqlite_stores.setdefault(db_file, open_midia_store(sqlite_url(db_file)))
+    return store
+
+def midia_stores():
+    """Stores de todas as bases de mídias (base principal e dedicadas)"""
+    if server_store:
+        return [server_store]
+    return [midia_store(db_file) for db_file in all_db_files()]
+
+MIDIAS_SCHEMA = '''
     CREATE TABLE IF NOT EXISTS midias (
         id INTEGER PRIMARY KEY AUTOINCREMENT,
         name TEXT NOT NULL,
@@ -85,105 +225,974 @@ def init_db():
         dateAdded TEXT DEFAULT (datetime('now')),
         lastAccessed TEXT DEFAULT (datetime('now')),
         deviceId TEXT,
-        deviceName TEXT
+        deviceName TEXT,
+        playCount INTEGER DEFAULT 0,
+        audioFingerprint TEXT,
+        lastPlayed TEXT
+    )
+'''
+
+def add_missing_columns(cursor):
+    """Adiciona em bases antigas as colunas criadas depois da primeira versão"""
+    cursor.execute('PRAGMA table_info(midias)')
+    columns = {col[1] for col in cursor.fetchall()}
+    for name, definition in (('playCount', 'INTEGER DEFAULT 0'), ('audioFingerprint', 'TEXT'),
+                             ('lastPlayed', 'TEXT')):
+        if name in columns:
+            continue
+        try:
+            cursor.execute(f'ALTER TABLE midias ADD COLUMN {name} {definition}')
+        except sqlite3.OperationalError as e:
+            # Outro worker pode ter adicionado a coluna ao mesmo tempo
+            if 'duplicate column' not in str(e):
+                raise
+        if name == 'lastPlayed':
+            # Até aqui o último play só ficava em lastAccessed
+            cursor.execute('UPDATE midias SET lastPlayed = lastAccessed WHERE playCount > 0')
+
+def create_schema(cursor):
+    """Cria a tabela de mídias e seus índices (base principal ou de dispositivo)"""
+    # Só tem efeito em bases novas; permite compactar com incremental_vacuum
+    cursor.execute('PRAGMA auto_vacuum = INCREMENTAL')
+    
+    cursor.execute(MIDIAS_SCHEMA)
+    add_missing_columns(cursor)
+    
+    # Índice usado na contagem de referências dos arquivos de mídia
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_midias_uri ON midias(uri)')
+    
+    # Índice da listagem por dispositivo (/api/devices/<deviceId>/midias)
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_midias_device_date ON midias(deviceId, dateAdded)')
+    
+    # Índices parciais de "tocadas recentemente" e "mais tocadas"; o antigo
+    # idx_midias_recent_plays (sobre lastAccessed) foi trocado por lastPlayed
+    cursor.execute('DROP INDEX IF EXISTS idx_midias_recent_plays')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_midias_last_played ON midias(lastPlayed)
+        WHERE playCount > 0
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_midias_play_count ON midias(playCount)
+        WHERE playCount > 0
+    ''')
+    
+    # Busca de duplicatas pela impressão digital do áudio (ver fingerprint.py)
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_midias_fingerprint ON midias(audioFingerprint)
+        WHERE audioFingerprint IS NOT NULL
+    ''')
+
+def init_db():
+    """Inicializa o banco de dados SQLite"""
+    conn = sqlite3.connect(DB_FILE)
+    cursor = conn.cursor()
+    
+    create_schema(cursor)
+    create_playlist_schema(cursor)
+    create_events_schema(cursor)
+    
+    # Dispositivos com base de dados própria (ver PARTICIONAMENTO POR DISPOSITIVO)
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS device_shards (
+        deviceId TEXT PRIMARY KEY,
+        shard INTEGER NOT NULL UNIQUE,
+        dbFile TEXT NOT NULL
     )
 ''')
     
     conn.commit()
     conn.close()
 
+def row_to_midia(row):
+    """Converte uma linha de `SELECT * FROM midias` em dicionário"""
+    # Tratar casos onde a linha pode ter menos colunas
+    return {
+        "id": row[0] if len(row) > 0 else None,
+        "name": row[1] if len(row) > 1 else "",
+        "uri": row[2] if len(row) > 2 else "",
+        "mimeType": row[3] if len(row) > 3 else "",
+        "cover": row[4] if len(row) > 4 else None,
+        "isFavorite": bool(row[5]) if len(row) > 5 else False,
+        "duration": row[6] if len(row) > 6 else 0,
+        "fileSize": row[7] if len(row) > 7 else 0,
+        "dateAdded": row[8] if len(row) > 8 else None,
+        "lastAccessed": row[9] if len(row) > 9 else None,
+        "deviceId": row[10] if len(row) > 10 else None,
+        "deviceName": row[11] if len(row) > 11 else None,
+        "playCount": row[12] if len(row) > 12 and row[12] is not None else 0,
+        "audioFingerprint": row[13] if len(row) > 13 else None,
+        "lastPlayed": row[14] if len(row) > 14 else None
+    }
+
 def get_all_midias():
-    """Busca todas as mídias"""
-    try:
-        # Garantir que o banco existe
-        init_db()
-        
-        conn = sqlite3.connect(DB_FILE)
-        cursor = conn.cursor()
-        
-        cursor.execute('SELECT * FROM midias ORDER BY dateAdded DESC')
-        rows = cursor.fetchall()
-        
-        midias = []
-        for row in rows:
-            # Tratar casos onde a linha pode ter menos colunas
-            midia = {
-                "id": row[0] if len(row) > 0 else None,
-                "name": row[1] if len(row) > 1 else "",
-                "uri": row[2] if len(row) > 2 else "",
-                "mimeType": row[3] if len(row) > 3 else "",
-                "cover": row[4] if len(row) > 4 else None,
-                "isFavorite": bool(row[5]) if len(row) > 5 else False,
-                "duration": row[6] if len(row) > 6 else 0,
-                "fileSize": row[7] if len(row) > 7 else 0,
-                "dateAdded": row[8] if len(row) > 8 else None,
-                "lastAccessed": row[9] if len(row) > 9 else None,
-                "deviceId": row[10] if len(row) > 10 else None,
-                "deviceName": row[11] if len(row) > 11 else None
-            }
-            midias.append(midia)
-        
-        conn.close()
-        return midias
-    except Exception as e:
-        # Se houver erro, inicializar o banco e retornar lista vazia
-        try:
-            init_db()
-            return []
-        except:
-            raise e
+    """Busca todas as mídias
+
+    O schema é criado uma vez, na inicialização (init_db): aqui só a leitura,
+    e um erro dela chega à rota em vez de virar uma biblioteca vazia.
+    """
+    per_db = [[row_to_midia(row) for row in store.list_midias()] for store in midia_stores()]
+    
+    if len(per_db) == 1:
+        return per_db[0]
+    
+    # Bases de dispositivos dedicados: intercala mantendo a ordem por data
+    return list(heapq.merge(*per_db, key=lambda m: m['dateAdded'] or '', reverse=True))
 
 def add_midia(data):
     """Adiciona uma nova mídia"""
+    midia_id = midia_store(db_file_for_device(data.get('deviceId'))).insert_midia(data)
+    
+    emit_midia_event('midia.created', midia_id, data.get('deviceId'), {
+        "id": midia_id,
+        "name": data.get('name'),
+        "uri": canonical_media_uri(data.get('uri')),
+        "mimeType": data.get('mimeType'),
+        "isFavorite": bool(data.get('isFavorite')),
+        "fileSize": data.get('fileSize', 0),
+        "deviceName": data.get('deviceName')
+    })
+    
+    return midia_id
+
+def update_midia(midia_id, data, event_type='midia.updated'):
+    """Atualiza uma mídia"""
+    updated, device_id = midia_store(db_file_for_id(midia_id)).update_midia(
+        midia_id, data.get('name'), data.get('isFavorite')
+    )
+    
+    if updated:
+        emit_midia_event(event_type, midia_id, device_id, {
+            "id": midia_id,
+            "name": data.get('name'),
+            "isFavorite": bool(data.get('isFavorite'))
+        })
+
+def delete_midia(midia_id):
+    """Deleta uma mídia e o arquivo dela, se nenhuma outra mídia o referenciar"""
+    row = midia_store(db_file_for_id(midia_id)).delete_midia(midia_id)
+    
+    # Itens de playlist ficam sempre na base principal
+    conn = sqlite3.connect(DB_FILE)
+    conn.execute('DELETE FROM playlist_items WHERE midiaId = ?', (midia_id,))
+    conn.commit()
+    conn.close()
+    
+    if row:
+        emit_midia_event('midia.deleted', midia_id, row[1], {"id": midia_id})
+    
+    # Contagem de referências restantes para o mesmo arquivo, em todas as bases
+    filename = media_filename(row[0]) if row else None
+    if filename and count_media_references(filename) == 0:
+        remove_media_file(filename)
+
+def find_by_fingerprint(fingerprint):
+    """Mídias com o mesmo áudio, em todas as bases (busca pelo índice)"""
+    midias = []
+    for store in midia_stores():
+        midias.extend(row_to_midia(row) for row in store.find_by_fingerprint(fingerprint))
+    return midias
+
+def get_duplicate_groups():
+    """Grupos de mídias com o mesmo áudio e o espaço que remover as cópias liberaria"""
+    counts = {}
+    for store in midia_stores():
+        for fingerprint, count in store.fingerprint_counts():
+            counts[fingerprint] = counts.get(fingerprint, 0) + count
+    
+    groups = []
+    for fingerprint in sorted(f for f, count in counts.items() if count > 1):
+        midias = find_by_fingerprint(fingerprint)
+        # Cada arquivo distinto conta uma vez; o primeiro é o que fica
+        sizes = {}
+        for midia in midias:
+            sizes.setdefault(media_filename(midia['uri']) or midia['uri'], midia['fileSize'] or 0)
+        groups.append({
+            "audioFingerprint": fingerprint,
+            "count": len(midias),
+            "reclaimableBytes": sum(sizes.values()) - next(iter(sizes.values()), 0),
+            "midias": midias
+        })
+    groups.sort(key=lambda g: g["reclaimableBytes"], reverse=True)
+    return groups
+
+def count_media_references(filename):
+    """Quantas mídias (em todas as bases) apontam para o arquivo"""
+    return sum(store.count_uri_references(media_uris(filename)) for store in midia_stores())
+
+def remove_media_file(filename):
+    """Remove um arquivo do armazenamento, ignorando se já não existir"""
+    if is_safe_filename(filename):
+        media_cache.invalidate(filename)
+        storage.delete(filename)
+        waveform_store.delete(filename)
+
+# ============================================================
+# PARTICIONAMENTO POR DISPOSITIVO
+# ============================================================
+
+# Dispositivos muito grandes podem ganhar uma base SQLite própria, para que
+# as escritas deles não disputem o lock da base principal. Os ids dessas
+# bases começam em `shard << SHARD_ID_BITS`, então o id já indica a base
+# (sem consulta extra) e continua único em toda a API.
+DEVICE_DB_FOLDER = os.environ.get('DEVICE_DB_FOLDER', "devices")
+DEDICATED_DEVICES = [d.strip() for d in os.environ.get('DEDICATED_DEVICES', '').split(',') if d.strip()]
+SHARD_ID_BITS = 40
+
+device_db_files = {}   # deviceId -> arquivo da base dedicada
+shard_db_files = {}    # número do shard -> arquivo da base dedicada
+
+def load_device_shards():
+    """Carrega da base principal o mapa de dispositivos dedicados"""
     conn = sqlite3.connect(DB_FILE)
     cursor = conn.cursor()
+    cursor.execute('SELECT deviceId, shard, dbFile FROM device_shards')
+    rows = cursor.fetchall()
+    conn.close()
     
+    device_db_files.clear()
+    shard_db_files.clear()
+    for device_id, shard, db_name in rows:
+        db_file = os.path.join(DEVICE_DB_FOLDER, db_name)
+        device_db_files[device_id] = db_file
+        shard_db_files[shard] = db_file
+
+def register_dedicated_device(device_id):
+    """Cria (se preciso) a base dedicada de um dispositivo
+
+    Vale para as novas mídias do dispositivo; as já existentes continuam na
+    base principal e a listagem por dispositivo consulta as duas.
+    """
+    conn = sqlite3.connect(DB_FILE)
+    cursor = conn.cursor()
+    # Número do shard atribuído numa única instrução (seguro entre workers)
     cursor.execute('''
-        INSERT INTO midias (name, uri, mimeType, cover, isFavorite, duration, fileSize, dateAdded, lastAccessed)
-        VALUES (?, ?, ?, ?, ?, ?, ?, datetime('now'), datetime('now'))
-    ''', (
-        data.get('name'),
-        data.get('uri'),
-        data.get('mimeType'),
-        data.get('cover'),
-        1 if data.get('isFavorite') else 0,
-        data.get('duration', 0),
-        data.get('fileSize', 0)
-    ))
+        INSERT OR IGNORE INTO device_shards (deviceId, shard, dbFile)
+        SELECT ?, COALESCE(MAX(shard), 0) + 1, 'device-' || (COALESCE(MAX(shard), 0) + 1) || '.db'
+        FROM device_shards
+    ''', (device_id,))
+    conn.commit()
+    cursor.execute('SELECT shard, dbFile FROM device_shards WHERE deviceId = ?', (device_id,))
+    shard, db_name = cursor.fetchone()
+    conn.close()
     
-    midia_id = cursor.lastrowid
+    os.makedirs(DEVICE_DB_FOLDER, exist_ok=True)
+    conn = sqlite3.connect(os.path.join(DEVICE_DB_FOLDER, db_name))
+    cursor = conn.cursor()
+    create_schema(cursor)
+    # Os eventos das mídias do dispositivo ficam na base dele (ver EVENTOS)
+    create_events_schema(cursor)
+    cursor.execute('''
+        INSERT INTO sqlite_sequence (name, seq)
+        SELECT 'midias', ? WHERE NOT EXISTS (SELECT 1 FROM sqlite_sequence WHERE name = 'midias')
+    ''', (shard << SHARD_ID_BITS,))
     conn.commit()
     conn.close()
+
+def db_file_for_device(device_id):
+    """Base onde as novas mídias do dispositivo são gravadas"""
+    return device_db_files.get(device_id, DB_FILE) if device_id else DB_FILE
+
+def db_file_for_id(midia_id):
+    """Base que contém a mídia, derivada do próprio id"""
+    shard = midia_id >> SHARD_ID_BITS
+    if shard == 0:
+        return DB_FILE
+    if shard not in shard_db_files:
+        load_device_shards()
+    return shard_db_files.get(shard, DB_FILE)
+
+def all_db_files():
+    """Base principal seguida das bases dedicadas"""
+    return [DB_FILE] + sorted(set(shard_db_files.values()))
+
+def device_stores(device_id):
+    """Base principal e, se houver, a base dedicada do dispositivo"""
+    if server_store:
+        return [server_store]
+    stores = [midia_store(DB_FILE)]
+    if device_id in device_db_files:
+        stores.append(midia_store(device_db_files[device_id]))
+    return stores
+
+def get_device_midias(device_id, limit=50, cursor_token=None):
+    """Página de mídias de um dispositivo, da mais nova para a mais antiga
+
+    Paginação por chave (dateAdded, id) sobre o índice (deviceId, dateAdded):
+    o custo de cada página não depende do tamanho da biblioteca.
+    """
+    before = None
+    if cursor_token:
+        before_date, before_id = cursor_token.rsplit('|', 1)
+        before = (before_date, int(before_id))
     
-    return midia_id
+    per_db = [
+        [row_to_midia(row) for row in store.device_midias(device_id, limit + 1, before)]
+        for store in device_stores(device_id)
+    ]
+    
+    rows = list(heapq.merge(*per_db, key=lambda m: (m['dateAdded'] or '', m['id']), reverse=True))
+    page = rows[:limit]
+    next_cursor = None
+    if len(rows) > limit:
+        last = page[-1]
+        next_cursor = f"{last['dateAdded']}|{last['id']}"
+    return page, next_cursor
 
-def update_midia(midia_id, data):
-    """Atualiza uma mídia"""
+def get_devices():
+    """Dispositivos com mídias cadastradas e a quantidade de cada um"""
+    devices = {}
+    for store in midia_stores():
+        for device_id, device_name, count in store.devices():
+            entry = devices.setdefault(device_id, {
+                "deviceId": device_id,
+                "deviceName": device_name,
+                "count": 0,
+                "dedicated": device_id in device_db_files
+            })
+            entry["count"] += count
+    return sorted(devices.values(), key=lambda d: d["deviceId"])
+
+# ============================================================
+# REPRODUÇÕES (WRITE-BEHIND)
+# ============================================================
+
+PLAY_FLUSH_INTERVAL_MS = int(os.environ.get('PLAY_FLUSH_INTERVAL_MS', 1000))
+PLAY_FLUSH_MAX_EVENTS = int(os.environ.get('PLAY_FLUSH_MAX_EVENTS', 500))
+
+def flush_play_events(updates):
+    """Grava em lote os plays acumulados, uma transação por base
+
+    Se alguma base falhar, as outras continuam gravadas e só os plays da que
+    falhou voltam para o buffer (PartialFlushError).
+    """
+    by_store = {}
+    for midia_id, (plays, last_played) in updates.items():
+        by_store.setdefault(midia_store(db_file_for_id(midia_id)), []).append((plays, last_played, midia_id))
+    
+    failed = {}
+    error = None
+    for store, rows in by_store.items():
+        try:
+            store.record_plays(rows)
+        except Exception as e:
+            error = e
+            failed.update((midia_id, (plays, last_played)) for plays, last_played, midia_id in rows)
+    if failed:
+        raise PartialFlushError(failed, error)
+
+play_buffer = PlayBuffer(
+    flush_play_events,
+    interval=PLAY_FLUSH_INTERVAL_MS / 1000,
+    max_events=PLAY_FLUSH_MAX_EVENTS
+)
+
+def warm_next_playlist_item(playlist_id, midia_id):
+    """Pede readahead (ou pré-carga, no S3) do arquivo do próximo item da playlist"""
     conn = sqlite3.connect(DB_FILE)
     cursor = conn.cursor()
+    cursor.execute('''
+        SELECT next.midiaId FROM playlist_items AS current
+        JOIN playlist_items AS next
+          ON next.playlistId = current.playlistId AND next.position > current.position
+        WHERE current.playlistId = ? AND current.midiaId = ?
+        ORDER BY current.position, next.position
+        LIMIT 1
+    ''', (playlist_id, midia_id))
+    row = cursor.fetchone()
+    conn.close()
+    if not row:
+        return
+    
+    uri = midia_store(db_file_for_id(row[0])).get_uri(row[0])
+    filename = media_filename(uri) if uri else None
+    if not filename or not is_safe_filename(filename):
+        return
+    file_path = storage.local_path(filename)
+    if file_path:
+        media_cache.warm(filename, path=file_path)
+    elif not isinstance(storage, LocalStorage):
+        media_cache.warm(filename, loader=lambda: fetch_for_cache(filename))
+
+def fetch_for_cache(filename):
+    """Conteúdo de um objeto remoto, se couber no cache"""
+    if not media_cache.fits(storage.size(filename)):
+        return None
+    return b''.join(storage.get(filename))
+
+def get_played_midias(order_by, limit):
+    """Mídias já tocadas, ordenadas pelo índice parcial correspondente"""
+    index = {
+        'lastPlayed': 'idx_midias_last_played',
+        'playCount': 'idx_midias_play_count'
+    }[order_by]
+    # A ordenação sai pronta do índice parcial, sem ordenar em memória
+    per_db = [
+        [row_to_midia(row) for row in store.played_midias(order_by, limit, index)]
+        for store in midia_stores()
+    ]
     
+    key = {
+        'lastPlayed': lambda m: m['lastPlayed'] or '',
+        'playCount': lambda m: m['playCount']
+    }[order_by]
+    return list(heapq.merge(*per_db, key=key, reverse=True))[:limit]
+
+# ============================================================
+# PLAYLISTS
+# ============================================================
+
+# A ordem dos itens é dada por chaves inteiras espaçadas: inserir ou mover um
+# item calcula o ponto médio entre os vizinhos e altera só aquela linha. Só
+# quando não sobra espaço entre dois vizinhos a playlist é renumerada.
+PLAYLIST_POSITION_STEP = 1 << 32
+
+def create_playlist_schema(cursor):
+    """Cria as tabelas de playlists na base principal"""
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS playlists (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name TEXT NOT NULL,
+        deviceId TEXT,
+        dateCreated TEXT DEFAULT (datetime('now')),
+        dateModified TEXT DEFAULT (datetime('now'))
+    )
+''')
     cursor.execute('''
-        UPDATE midias 
-        SET name = ?, isFavorite = ?, lastAccessed = datetime('now')
-        WHERE id = ?
-    ''', (
-        data.get('name'),
-        1 if data.get('isFavorite') else 0,
-        midia_id
-    ))
+    CREATE TABLE IF NOT EXISTS playlist_items (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        playlistId INTEGER NOT NULL REFERENCES playlists(id) ON DELETE CASCADE,
+        midiaId INTEGER NOT NULL,
+        position INTEGER NOT NULL,
+        dateAdded TEXT DEFAULT (datetime('now'))
+    )
+''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_playlist_items_order ON playlist_items(playlistId, position)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_playlist_items_midia ON playlist_items(midiaId)')
+
+def connect_for_write(db_file):
+    """Conexão com transação IMMEDIATE: leitura dos vizinhos e escrita atômicas"""
+    conn = sqlite3.connect(db_file, isolation_level=None)
+    conn.execute('PRAGMA foreign_keys = ON')
+    conn.execute('BEGIN IMMEDIATE')
+    return conn
+
+def playlist_to_dict(row):
+    return {
+        "id": row[0],
+        "name": row[1],
+        "deviceId": row[2],
+        "dateCreated": row[3],
+        "dateModified": row[4],
+        "itemCount": row[5]
+    }
+
+PLAYLIST_SELECT = '''
+    SELECT p.id, p.name, p.deviceId, p.dateCreated, p.dateModified,
+           (SELECT COUNT(*) FROM playlist_items i WHERE i.playlistId = p.id)
+    FROM playlists p
+'''
+
+def list_playlists(device_id=None):
+    """Lista as playlists (opcionalmente de um dispositivo)"""
+    conn = sqlite3.connect(DB_FILE)
+    cursor = conn.cursor()
+    if device_id:
+        cursor.execute(PLAYLIST_SELECT + ' WHERE p.deviceId = ? ORDER BY p.id', (device_id,))
+    else:
+        cursor.execute(PLAYLIST_SELECT + ' ORDER BY p.id')
+    playlists = [playlist_to_dict(row) for row in cursor.fetchall()]
+    conn.close()
+    return playlists
+
+def get_playlist(playlist_id):
+    """Busca uma playlist por ID (ou None)"""
+    conn = sqlite3.connect(DB_FILE)
+    cursor = conn.cursor()
+    cursor.execute(PLAYLIST_SELECT + ' WHERE p.id = ?', (playlist_id,))
+    row = cursor.fetchone()
+    conn.close()
+    return playlist_to_dict(row) if row else None
+
+def missing_midia_ids(midia_ids):
+    """IDs da lista que não existem em nenhuma base"""
+    by_store = {}
+    for midia_id in set(midia_ids):
+        by_store.setdefault(midia_store(db_file_for_id(midia_id)), []).append(midia_id)
+    
+    missing = set()
+    for store, ids in by_store.items():
+        missing.update(set(ids) - store.existing_ids(ids))
+    return sorted(missing)
+
+def validate_midia_ids(midia_ids):
+    if not isinstance(midia_ids, list) or not all(isinstance(i, int) for i in midia_ids):
+        raise ValueError("midiaIds deve ser uma lista de inteiros")
+    missing = missing_midia_ids(midia_ids)
+    if missing:
+        raise ValueError(f"Mídias não encontradas: {missing[:20]}")
+
+def insert_playlist_items(cursor, playlist_id, midia_ids, start=PLAYLIST_POSITION_STEP):
+    """Insere os itens em lote, na ordem dada"""
+    cursor.executemany(
+        'INSERT INTO playlist_items (playlistId, midiaId, position) VALUES (?, ?, ?)',
+        ((playlist_id, midia_id, start + i * PLAYLIST_POSITION_STEP) for i, midia_id in enumerate(midia_ids))
+    )
+
+def create_playlist(name, device_id=None, midia_ids=None):
+    """Cria uma playlist, já com os itens (importação em uma transação)"""
+    midia_ids = midia_ids or []
+    validate_midia_ids(midia_ids)
+    
+    conn = connect_for_write(DB_FILE)
+    try:
+        cursor = conn.cursor()
+        cursor.execute('INSERT INTO playlists (name, deviceId) VALUES (?, ?)', (name, device_id))
+        playlist_id = cursor.lastrowid
+        insert_playlist_items(cursor, playlist_id, midia_ids)
+        conn.execute('COMMIT')
+    except Exception:
+        conn.execute('ROLLBACK')
+        raise
+    finally:
+        conn.close()
+    return playlist_id
+
+def replace_playlist_items(playlist_id, midia_ids):
+    """Substitui todo o conteúdo da playlist em uma transação"""
+    validate_midia_ids(midia_ids)
     
+    conn = connect_for_write(DB_FILE)
+    try:
+        cursor = conn.cursor()
+        cursor.execute('SELECT 1 FROM playlists WHERE id = ?', (playlist_id,))
+        if not cursor.fetchone():
+            conn.execute('ROLLBACK')
+            return False
+        cursor.execute('DELETE FROM playlist_items WHERE playlistId = ?', (playlist_id,))
+        insert_playlist_items(cursor, playlist_id, midia_ids)
+        cursor.execute("UPDATE playlists SET dateModified = datetime('now') WHERE id = ?", (playlist_id,))
+        conn.execute('COMMIT')
+    except Exception:
+        conn.execute('ROLLBACK')
+        raise
+    finally:
+        conn.close()
+    return True
+
+def update_playlist(playlist_id, name):
+    """Renomeia uma playlist"""
+    conn = sqlite3.connect(DB_FILE)
+    cursor = conn.cursor()
+    cursor.execute(
+        "UPDATE playlists SET name = ?, dateModified = datetime('now') WHERE id = ?",
+        (name, playlist_id)
+    )
+    updated = cursor.rowcount > 0
     conn.commit()
     conn.close()
+    return updated
 
-def delete_midia(midia_id):
-    """Deleta uma mídia"""
+def delete_playlist(playlist_id):
+    """Remove a playlist e seus itens"""
+    conn = sqlite3.connect(DB_FILE)
+    conn.execute('PRAGMA foreign_keys = ON')
+    cursor = conn.cursor()
+    cursor.execute('DELETE FROM playlist_items WHERE playlistId = ?', (playlist_id,))
+    cursor.execute('DELETE FROM playlists WHERE id = ?', (playlist_id,))
+    deleted = cursor.rowcount > 0
+    conn.commit()
+    conn.close()
+    return deleted
+
+def get_playlist_items(playlist_id, limit=100, cursor_token=None):
+    """Página de itens da playlist, já com os dados das mídias (JOIN)"""
+    params = [playlist_id]
+    where = 'i.playlistId = ?'
+    if cursor_token:
+        after_position, after_id = cursor_token.split('|', 1)
+        where += ' AND (i.position > ? OR (i.position = ? AND i.id > ?))'
+        params += [int(after_position), int(after_position), int(after_id)]
+    
     conn = sqlite3.connect(DB_FILE)
     cursor = conn.cursor()
+    cursor.execute(f'''
+        SELECT i.id, i.position, i.midiaId, m.*
+        FROM playlist_items i
+        LEFT JOIN midias m ON m.id = i.midiaId
+        WHERE {where}
+        ORDER BY i.position, i.id
+        LIMIT ?
+    ''', params + [limit + 1])
+    rows = cursor.fetchall()
+    conn.close()
+    
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    
+    # Mídias de bases dedicadas (ou do servidor, com DATABASE_URL) não entram
+    # no JOIN: busca por base
+    remote = {}
+    for item_id, position, midia_id, *midia in rows:
+        if server_store or (midia[0] is None and midia_id >> SHARD_ID_BITS):
+            remote.setdefault(midia_store(db_file_for_id(midia_id)), []).append(midia_id)
+    fetched = {}
+    for store, ids in remote.items():
+        fetched.update((row[0], row_to_midia(row)) for row in store.get_midias(ids))
+    
+    items = []
+    for item_id, position, midia_id, *midia in rows:
+        if midia[0] is not None and not server_store:
+            midia_dict = row_to_midia(midia)
+        else:
+            midia_dict = fetched.get(midia_id)
+        if midia_dict:
+            items.append({"itemId": item_id, "midia": midia_dict})
     
-    cursor.execute('DELETE FROM midias WHERE id = ?', (midia_id,))
+    next_cursor = f"{rows[-1][1]}|{rows[-1][0]}" if has_more else None
+    return items, next_cursor
+
+def playlist_neighbours(data):
+    """(after, before) do corpo da requisição: itemIds inteiros ou None"""
+    neighbours = []
+    for key in ('after', 'before'):
+        value = data.get(key)
+        if value is not None and (not isinstance(value, int) or isinstance(value, bool)):
+            raise ValueError(f"'{key}' deve ser um itemId inteiro")
+        neighbours.append(value)
+    return tuple(neighbours)
+
+def item_position(cursor, playlist_id, item_id):
+    cursor.execute('SELECT position FROM playlist_items WHERE id = ? AND playlistId = ?', (item_id, playlist_id))
+    row = cursor.fetchone()
+    if not row:
+        raise ValueError(f"Item {item_id} não pertence à playlist")
+    return row[0]
+
+def position_between(cursor, playlist_id, after_item=None, before_item=None, moving_item=None):
+    """Chave de ordenação para um item logo após `after_item` / antes de `before_item`
+
+    Sem nenhum dos dois, o item vai para o final. Retorna None se não houver
+    espaço entre os vizinhos (a playlist precisa ser renumerada).
+    """
+    exclude = moving_item if moving_item is not None else -1
+    if after_item is not None:
+        low = item_position(cursor, playlist_id, after_item)
+        cursor.execute('''
+            SELECT position FROM playlist_items
+            WHERE playlistId = ? AND position > ? AND id != ?
+            ORDER BY position LIMIT 1
+        ''', (playlist_id, low, exclude))
+        row = cursor.fetchone()
+        high = row[0] if row else None
+    elif before_item is not None:
+        high = item_position(cursor, playlist_id, before_item)
+        cursor.execute('''
+            SELECT position FROM playlist_items
+            WHERE playlistId = ? AND position < ? AND id != ?
+            ORDER BY position DESC LIMIT 1
+        ''', (playlist_id, high, exclude))
+        row = cursor.fetchone()
+        low = row[0] if row else None
+    else:
+        cursor.execute('''
+            SELECT MAX(position) FROM playlist_items WHERE playlistId = ? AND id != ?
+        ''', (playlist_id, exclude))
+        low = cursor.fetchone()[0]
+        high = None
     
+    if low is None and high is None:
+        return PLAYLIST_POSITION_STEP
+    if high is None:
+        return low + PLAYLIST_POSITION_STEP
+    if low is None:
+        return high - PLAYLIST_POSITION_STEP
+    if high - low >= 2:
+        return (low + high) // 2
+    return None
+
+def renumber_playlist(cursor, playlist_id):
+    """Redistribui as chaves da playlist com o espaçamento padrão (raro)"""
+    cursor.execute(
+        'SELECT id FROM playlist_items WHERE playlistId = ? ORDER BY position, id',
+        (playlist_id,)
+    )
+    ids = [row[0] for row in cursor.fetchall()]
+    cursor.executemany(
+        'UPDATE playlist_items SET position = ? WHERE id = ?',
+        (((i + 1) * PLAYLIST_POSITION_STEP, item_id) for i, item_id in enumerate(ids))
+    )
+
+def place_playlist_item(playlist_id, midia_id=None, item_id=None, after_item=None, before_item=None):
+    """Insere (midia_id) ou move (item_id) um item, alterando uma única linha"""
+    conn = connect_for_write(DB_FILE)
+    try:
+        cursor = conn.cursor()
+        cursor.execute('SELECT 1 FROM playlists WHERE id = ?', (playlist_id,))
+        if not cursor.fetchone():
+            conn.execute('ROLLBACK')
+            return None
+        if item_id is not None:
+            item_position(cursor, playlist_id, item_id)
+            if item_id in (after_item, before_item):
+                raise ValueError("Um item não pode ser posicionado relativo a si mesmo")
+        
+        position = position_between(cursor, playlist_id, after_item, before_item, item_id)
+        if position is None:
+            renumber_playlist(cursor, playlist_id)
+            position = position_between(cursor, playlist_id, after_item, before_item, item_id)
+        
+        if item_id is None:
+            cursor.execute(
+                'INSERT INTO playlist_items (playlistId, midiaId, position) VALUES (?, ?, ?)',
+                (playlist_id, midia_id, position)
+            )
+            item_id = cursor.lastrowid
+        else:
+            cursor.execute('UPDATE playlist_items SET position = ? WHERE id = ?', (position, item_id))
+        cursor.execute("UPDATE playlists SET dateModified = datetime('now') WHERE id = ?", (playlist_id,))
+        conn.execute('COMMIT')
+    except Exception:
+        conn.execute('ROLLBACK')
+        raise
+    finally:
+        conn.close()
+    return item_id
+
+def remove_playlist_item(playlist_id, item_id):
+    """Remove um item da playlist"""
+    conn = sqlite3.connect(DB_FILE)
+    cursor = conn.cursor()
+    cursor.execute('DELETE FROM playlist_items WHERE id = ? AND playlistId = ?', (item_id, playlist_id))
+    deleted = cursor.rowcount > 0
+    if deleted:
+        cursor.execute("UPDATE playlists SET dateModified = datetime('now') WHERE id = ?", (playlist_id,))
     conn.commit()
     conn.close()
+    return deleted
+
+# ============================================================
+# BACKUP
+# ============================================================
+
+# Snapshots online das bases (ver backup.py). Em disco efêmero, aponte
+# BACKUP_DIR para um disco persistente para que o restore na inicialização
+# encontre os snapshots depois de um novo deploy.
+BACKUP_DIR = os.environ.get('BACKUP_DIR', "backups")
+BACKUP_INTERVAL_MINUTES = float(os.environ.get('BACKUP_INTERVAL_MINUTES', 0))
+BACKUP_KEEP = int(os.environ.get('BACKUP_KEEP', 7))
+BACKUP_PAGES = int(os.environ.get('BACKUP_PAGES', 256))
+BACKUP_PAUSE_MS = float(os.environ.get('BACKUP_PAUSE_MS', 5))
+ADMIN_TOKEN = os.environ.get('ADMIN_TOKEN', '')
+
+backup_scheduler = BackupScheduler(
+    all_db_files, BACKUP_DIR, BACKUP_INTERVAL_MINUTES * 60,
+    keep=BACKUP_KEEP, pages=BACKUP_PAGES, pause=BACKUP_PAUSE_MS / 1000
+)
+
+def restore_missing_databases(db_files):
+    """Restaura do snapshot mais recente as bases que não existem em disco"""
+    restored = []
+    for db_file in db_files:
+        name = restore_latest(db_file, BACKUP_DIR)
+        if name:
+            restored.append(name)
+    return restored
+
+def is_admin_request():
+    """Confere o token de administração (X-Admin-Token ou Authorization: Bearer)"""
+    if not ADMIN_TOKEN:
+        return False
+    token = request.headers.get('X-Admin-Token', '')
+    auth = request.headers.get('Authorization', '')
+    if not token and auth.startswith('Bearer '):
+        token = auth[len('Bearer '):]
+    return hmac.compare_digest(token.encode(), ADMIN_TOKEN.encode())
+
+def admin_denied():
+    if not ADMIN_TOKEN:
+        return jsonify({"error": "Administração desativada (defina ADMIN_TOKEN)"}), 403
+    return jsonify({"error": "Token de administração inválido"}), 401
+
+# ============================================================
+# EXPORTAÇÃO / IMPORTAÇÃO
+# ============================================================
+
+# Mídias por lote do arquivo exportado (e por transação na importação)
+EXPORT_BATCH_SIZE = int(os.environ.get('EXPORT_BATCH_SIZE', 500))
+
+def iter_midia_batches(device_id=None, batch_size=EXPORT_BATCH_SIZE):
+    """Lotes de mídias em ordem de id, base por base
+
+    Cada lote abre e fecha a própria conexão, para não manter uma transação
+    de leitura aberta enquanto o arquivo é enviado ao cliente.
+    """
+    stores = device_stores(device_id) if device_id else midia_stores()
+    for store in stores:
+        last_id = 0
+        while True:
+            batch = [row_to_midia(row) for row in store.midias_after(last_id, batch_size, device_id)]
+            if not batch:
+                break
+            yield batch
+            last_id = batch[-1]['id']
+
+def import_midia_rows(midias):
+    """Grava um lote importado, uma transação por base
+
+    Ids novos são atribuídos pela base de destino. URIs de arquivos servidos
+    pela API voltam ao formato relativo; mídias com a mesma URI no mesmo
+    dispositivo já cadastradas são ignoradas. Retorna (inseridas, ignoradas).
+    """
+    by_store = {}
+    skipped = 0
+    for midia in midias:
+        if not isinstance(midia, dict) or not midia.get('name') or not midia.get('uri') or not midia.get('mimeType'):
+            skipped += 1
+            continue
+        by_store.setdefault(midia_store(db_file_for_device(midia.get('deviceId'))), []).append({
+            'name': midia['name'],
+            'uri': canonical_media_uri(midia['uri']),
+            'mimeType': midia['mimeType'],
+            'cover': midia.get('cover'),
+            'isFavorite': 1 if midia.get('isFavorite') else 0,
+            'duration': midia.get('duration') or 0,
+            'fileSize': midia.get('fileSize') or 0,
+            'dateAdded': midia.get('dateAdded'),
+            'lastAccessed': midia.get('lastAccessed'),
+            'deviceId': midia.get('deviceId'),
+            'deviceName': midia.get('deviceName'),
+            'playCount': midia.get('playCount') or 0,
+            'audioFingerprint': midia.get('audioFingerprint'),
+            'lastPlayed': midia.get('lastPlayed')
+        })
+
+    inserted = 0
+    for store, rows in by_store.items():
+        store_inserted, store_skipped = store.import_midias(rows)
+        inserted += store_inserted
+        skipped += store_skipped
+    return inserted, skipped
+
+# ============================================================
+# EVENTOS (SSE)
+# ============================================================
+
+# Alterações da biblioteca publicadas em /api/events (ver events.py), para
+# os clientes não precisarem consultar /api/midias periodicamente
+EVENTS_POLL_MS = int(os.environ.get('EVENTS_POLL_MS', 500))
+EVENTS_HEARTBEAT_SECONDS = float(os.environ.get('EVENTS_HEARTBEAT_SECONDS', 15))
+EVENTS_MAX_STREAM_SECONDS = float(os.environ.get('EVENTS_MAX_STREAM_SECONDS', 300))
+# Cada assinante ocupa uma thread do worker: o padrão acompanha o teto da
+# classe events do controle de admissão (que já recusa acima dele)
+EVENTS_MAX_SUBSCRIBERS = int(os.environ.get('EVENTS_MAX_SUBSCRIBERS', ADMISSION_MAX_CONCURRENT['events']))
+EVENTS_RETENTION = int(os.environ.get('EVENTS_RETENTION', 10000))
+
+def event_sources():
+    """Bases com tabela de eventos, por shard: a principal (0) e as dedicadas"""
+    if server_store:
+        return {0: DB_FILE}
+    return {0: DB_FILE, **shard_db_files}
+
+event_hub = EventHub(event_sources, EVENTS_POLL_MS / 1000, retention=EVENTS_RETENTION)
+
+def emit_midia_event(event_type, midia_id=None, device_id=None, payload=None):
+    """Publica um evento; uma falha aqui não desfaz a alteração já gravada
+
+    O evento vai para a mesma base da mídia alterada: alterações de um
+    dispositivo dedicado não disputam o lock de escrita da base principal.
+    """
+    # Leituras iniciadas antes desta alteração não são compartilhadas com as novas
+    coalescer.invalidate()
+    db_file = DB_FILE if server_store or midia_id is None else db_file_for_id(midia_id)
+    try:
+        record_event(db_file, event_type, midia_id, device_id, payload)
+    except sqlite3.Error as e:
+        print(f"Erro ao registrar evento {event_type}: {e}")
+
+# ============================================================
+# LEITURAS COALESCIDAS
+# ============================================================
+
+# Requisições simultâneas de /api/midias e /api/stats compartilham uma única
+# consulta e o mesmo JSON serializado (ver singleflight.py)
+coalescer = SingleFlight()
+
+def json_body(data):
+    """Serializa como o jsonify, para os bytes serem reaproveitados"""
+    return app.json.response(data).get_data()
+
+def coalesced_response(body, shared):
+    response = app.response_class(body, mimetype='application/json')
+    response.headers['X-Coalesced'] = '1' if shared else '0'
+    return response
+
+def get_library_stats():
+    """Estatísticas somadas da base principal e das bases dedicadas"""
+    total = 0
+    favorites = 0
+    by_type = {}
+    total_size = 0
+    total_duration = 0
+    
+    # Soma as estatísticas da base principal e das bases dedicadas
+    for store in midia_stores():
+        stats = store.library_stats()
+        total += stats["total"]
+        favorites += stats["favorites"]
+        total_size += stats["total_size"]
+        total_duration += stats["total_duration"]
+        for mime_type, count in stats["by_type"].items():
+            by_type[mime_type] = by_type.get(mime_type, 0) + count
+    
+    return {
+        "total_midias": total,
+        "total_favorites": favorites,
+        "by_mime_type": by_type,
+        "total_file_size": total_size,
+        "total_duration": total_duration,
+        "total_duration_formatted": f"{total_duration // 60} minutos" if total_duration > 0 else "0 minutos"
+    }
+
+# ============================================================
+# FORMA DE ONDA
+# ============================================================
+
+# Picos mín./máx. pré-calculados para o scrubber do player (ver waveform.py),
+# gerados em segundo plano no upload ou no primeiro pedido
+WAVEFORM_FOLDER = os.environ.get('WAVEFORM_FOLDER', "waveforms")
+WAVEFORM_POINTS = int(os.environ.get('WAVEFORM_POINTS', DEFAULT_WAVEFORM_POINTS))
+WAVEFORM_ON_UPLOAD = os.environ.get('WAVEFORM_ON_UPLOAD', '1') == '1'
+WAVEFORM_WAIT_SECONDS = float(os.environ.get('WAVEFORM_WAIT_SECONDS', 10))
+WAVEFORM_MAX_AGE = int(os.environ.get('WAVEFORM_MAX_AGE', 7 * 86400))
+WAVEFORM_FAILURE_TTL = int(os.environ.get('WAVEFORM_FAILURE_TTL', DEFAULT_WAVEFORM_FAILURE_TTL))
+
+@contextmanager
+def media_local_copy(filename):
+    """Caminho no disco do arquivo; no backend remoto, uma cópia temporária"""
+    file_path = storage.local_path(filename)
+    if file_path:
+        yield file_path
+        return
+    if isinstance(storage, LocalStorage):
+        raise FileNotFoundError(filename)
+    with tempfile.NamedTemporaryFile(suffix=os.path.splitext(filename)[1]) as tmp:
+        for chunk in storage.get(filename):
+            tmp.write(chunk)
+        tmp.flush()
+        yield tmp.name
+
+waveform_store = WaveformStore(WAVEFORM_FOLDER)
+waveform_jobs = WaveformJobs(waveform_store, media_local_copy, WAVEFORM_POINTS,
+                             failure_ttl=WAVEFORM_FAILURE_TTL)
+# Arquivo regravado (ex.: importação) pode ter áudio válido agora
+storage.add_listener(waveform_jobs.forget)
+
+def get_midia_filename(midia_id):
+    """Nome do arquivo da mídia; None se a mídia não existir"""
+    uri = midia_store(db_file_for_id(midia_id)).get_uri(midia_id)
+    if uri is None:
+        return None
+    return media_filename(uri) or ''
 
 # ============================================================
 # ROTAS DA API
@@ -201,7 +1210,9 @@ def index():
             "api_midias": "/api/midias",
             "stats": "/api/stats",
             "db_info": "/api/db/info",
-            "favorites": "/api/midias/favorites"
+            "favorites": "/api/midias/favorites",
+            "devices": "/api/devices",
+            "playlists": "/api/playlists"
         },
         "documentation": {
             "swagger": "Acesse /docs para documentação Swagger/OpenAPI",
@@ -282,14 +1293,22 @@ def get_midias():
               deviceName:
                 type: string
                 nullable: true
+              playCount:
+                type: integer
+                example: 12
+              audioFingerprint:
+                type: string
+                nullable: true
+              lastPlayed:
+                type: string
+                nullable: true
+                example: "2024-01-01 12:00:00"
       500:
         description: Erro ao buscar mídias
     """
     try:
-        # Garantir que o banco está inicializado
-        init_db()
-        midias = get_all_midias()
-        return jsonify(midias), 200
+        body, shared = coalescer.do('midias', lambda: json_body(get_all_midias()))
+        return coalesced_response(body, shared)
     except Exception as e:
         import traceback
         error_details = traceback.format_exc()
@@ -338,6 +1357,12 @@ def create_midia():
             fileSize:
               type: integer
               example: 5242880
+            deviceId:
+              type: string
+              nullable: true
+            deviceName:
+              type: string
+              nullable: true
     responses:
       201:
         description: Mídia criada com sucesso
@@ -370,12 +1395,14 @@ def create_midia():
         new_midia = {
             "id": midia_id,
             "name": data.get('name'),
-            "uri": data.get('uri'),
+            "uri": canonical_media_uri(data.get('uri')),
             "mimeType": data.get('mimeType'),
             "cover": data.get('cover'),
             "isFavorite": data.get('isFavorite', False),
             "duration": data.get('duration', 0),
             "fileSize": data.get('fileSize', 0),
+            "deviceId": data.get('deviceId'),
+            "deviceName": data.get('deviceName'),
             "dateAdded": datetime.now().isoformat()
         }
         
@@ -430,7 +1457,7 @@ def toggle_favorite(midia_id):
         
         # Inverte o status de favorito
         new_status = not midia['isFavorite']
-        update_midia(midia_id, {'name': midia['name'], 'isFavorite': new_status})
+        update_midia(midia_id, {'name': midia['name'], 'isFavorite': new_status}, 'midia.favorite')
         
         return jsonify({"isFavorite": new_status}), 200
         
@@ -459,11 +1486,20 @@ def upload_midia():
         if file.filename == '':
             return jsonify({"error": "Nome de arquivo inválido"}), 400
             
+        # Impressão digital do áudio (sem tags): o upload já está num arquivo
+        # temporário do Werkzeug, então dá para ler antes de gravar
+        fingerprint = None
+        if file.stream.seekable():
+            fingerprint = audio_fingerprint(file.stream)
+            file.stream.seek(0)
+        duplicates = find_by_fingerprint(fingerprint) if fingerprint else []
+        if duplicates and request.form.get('onDuplicate', DUPLICATE_UPLOADS) == 'reject':
+            return jsonify({"error": "Mídia já existe na biblioteca", "duplicateOf": duplicates}), 409
+        
         # Save file
         file_extension = os.path.splitext(file.filename)[1] if file.filename else ''
         filename = str(uuid.uuid4()) + file_extension
-        file_path = os.path.join(MEDIA_FOLDER, filename)
-        file.save(file_path)
+        file_size = storage.put(filename, file.stream, mimeType)
         
         # Save to database
         data = {
@@ -472,10 +1508,21 @@ def upload_midia():
             'mimeType': mimeType,
             'deviceId': deviceId,
             'deviceName': deviceName,
-            'isFavorite': isFavorite
+            'isFavorite': isFavorite,
+            'fileSize': file_size,
+            'audioFingerprint': fingerprint
         }
         
-        midia_id = add_midia(data)
+        try:
+            midia_id = add_midia(data)
+        except Exception:
+            # Não deixar arquivo órfão se o INSERT falhar
+            remove_media_file(filename)
+            raise
+        
+        # Forma de onda gerada em segundo plano, antes do primeiro pedido
+        if WAVEFORM_ON_UPLOAD and mimeType.startswith(('audio/', 'video/')):
+            waveform_jobs.submit(filename)
         
         new_midia = {
             "id": midia_id,
@@ -485,7 +1532,9 @@ def upload_midia():
             "deviceId": deviceId,
             "deviceName": deviceName,
             "isFavorite": isFavorite,
-            "dateAdded": datetime.now().isoformat()
+            "dateAdded": datetime.now().isoformat(),
+            "audioFingerprint": fingerprint,
+            "duplicateOf": [m['id'] for m in duplicates]
         }
         
         return jsonify(new_midia), 201
@@ -498,10 +1547,110 @@ def upload_midia():
 def serve_media(filename):
     """Servir arquivo de mídia"""
     try:
-        return send_from_directory(MEDIA_FOLDER, filename)
+        if not is_safe_filename(filename):
+            return jsonify({"error": "Arquivo não encontrado"}), 404
+        
+        # Arquivos populares saem do cache em memória, sem abrir o arquivo
+        cached = media_cache.get(filename)
+        if cached:
+            return cached_media_response(cached)
+        
+        # Disco local: caminho calculado a partir do filename, sem consulta à base
+        file_path = storage.local_path(filename)
+        if file_path:
+            if media_cache.should_admit(filename):
+                cached = media_cache.admit_file(filename, file_path)
+                if cached:
+                    return cached_media_response(cached)
+            return send_from_directory(os.path.abspath(os.path.dirname(file_path)), filename)
+        if isinstance(storage, LocalStorage):
+            return jsonify({"error": "Arquivo não encontrado"}), 404
+        
+        # Armazenamento remoto: redireciona para URL pré-assinada...
+        if STORAGE_REDIRECT:
+            return redirect(storage.url(filename, S3_PRESIGN_EXPIRES), code=302)
+        
+        # ...ou faz proxy em streaming, respeitando o cabeçalho Range
+        return stream_media(filename)
     except Exception as e:
         return jsonify({"error": "Arquivo não encontrado"}), 404
 
+def stream_media(filename):
+    """Faz streaming de um arquivo do backend remoto, com suporte a Range"""
+    size = storage.size(filename)
+    if size is None:
+        return jsonify({"error": "Arquivo não encontrado"}), 404
+    
+    if media_cache.should_admit(filename) and media_cache.fits(size):
+        cached = media_cache.admit_bytes(filename, b''.join(storage.get(filename)))
+        if cached:
+            return cached_media_response(cached)
+    
+    headers = {"Accept-Ranges": "bytes"}
+    mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+    byte_range = request.range.range_for_length(size) if request.range else None
+    
+    if byte_range:
+        start, stop = byte_range
+        headers["Content-Range"] = f"bytes {start}-{stop - 1}/{size}"
+        headers["Content-Length"] = str(stop - start)
+        body = storage.get(filename, start, stop)
+        return Response(stream_with_context(body), 206, headers=headers, mimetype=mimetype)
+    
+    headers["Content-Length"] = str(size)
+    return Response(stream_with_context(storage.get(filename)), 200, headers=headers, mimetype=mimetype)
+
+def cached_media_response(cached):
+    """Resposta de serve_media a partir do cache, com suporte a Range
+
+    A reserva de leitura de `cached` passa para o corpo da resposta (fechado
+    pelo servidor); se a resposta não chegar a ser montada, é liberada aqui,
+    senão o mmap de um item já despejado nunca seria fechado.
+    """
+    body = None
+    leased = True
+    try:
+        size = cached.size
+        mimetype = mimetypes.guess_type(cached.filename)[0] or 'application/octet-stream'
+        headers = {"Accept-Ranges": "bytes"}
+        etag = None
+        if cached.path:
+            # Mesmo ETag do send_from_directory: o cliente não percebe a troca de caminho
+            etag = f"{cached.mtime}-{size}-{zlib.adler32(cached.path.encode()) & 0xFFFFFFFF}"
+        
+        if_range = request.headers.get('If-Range')
+        use_range = request.range is not None and (not if_range or (etag and if_range.strip('"') == etag))
+        if use_range:
+            byte_range = request.range.range_for_length(size)
+            if byte_range is None:
+                leased = False
+                cached.release()
+                return Response(status=416, headers={"Content-Range": f"bytes */{size}"})
+            start, stop = byte_range
+            headers["Content-Range"] = f"bytes {start}-{stop - 1}/{size}"
+            status = 206
+        else:
+            start, stop, status = 0, size, 200
+        
+        body = cached.chunks(start, stop)
+        response = Response(body, status, headers=headers, mimetype=mimetype)
+        response.content_length = stop - start
+        if cached.path:
+            response.headers['Content-Disposition'] = f"inline; filename={cached.filename}"
+            response.set_etag(etag)
+            response.last_modified = cached.mtime
+            response.cache_control.no_cache = True
+            response = response.make_conditional(request)
+        if response.status_code != 304:
+            media_cache.record_bytes(stop - start)
+        return response
+    except BaseException:
+        if body is not None:
+            body.close()
+        elif leased:
+            cached.release()
+        raise
+
 @app.route('/debug')
 def debug():
     """Debug route to check data"""
@@ -539,6 +1688,657 @@ def get_favorites():
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+@app.route('/api/midias/duplicates', methods=['GET'])
+def get_duplicates():
+    """
+    Lista mídias com o mesmo áudio
+    ---
+    tags:
+      - Mídias
+    description: >
+      Agrupa as mídias pela impressão digital do áudio (ignorando tags ID3 e
+      metadados MP4), do grupo que libera mais espaço para o que libera menos.
+    responses:
+      200:
+        description: Grupos de duplicatas e bytes recuperáveis
+    """
+    try:
+        groups = get_duplicate_groups()
+        return jsonify({
+            "groups": groups,
+            "count": len(groups),
+            "reclaimableBytes": sum(g["reclaimableBytes"] for g in groups)
+        }), 200
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/midias/<int:midia_id>/waveform', methods=['GET'])
+def get_waveform(midia_id):
+    """
+    Forma de onda (picos mín./máx.) de uma mídia
+    ---
+    tags:
+      - Mídias
+    description: >
+      Cerca de 2000 pares mín./máx. em 8 bits, no formato binário `.dat` do
+      audiowaveform (lido pelo peaks.js) ou em JSON com `format=json`. Se
+      ainda não foi gerada, é calculada na hora; se demorar mais que
+      WAVEFORM_WAIT_SECONDS, responde 202 e o cliente tenta de novo. A origem
+      dos picos vem no header X-Waveform-Source (e em `source` no JSON):
+      `pcm`/`ffmpeg` são áudio decodificado; `mp3-gain`/`mp4-frames` são um
+      envelope estimado (X-Waveform-Estimated: 1, `estimated: true`).
+    parameters:
+      - in: path
+        name: midia_id
+        type: integer
+        required: true
+      - in: query
+        name: format
+        type: string
+        enum: [dat, json]
+        default: dat
+    produces:
+      - application/octet-stream
+      - application/json
+    responses:
+      200:
+        description: Forma de onda
+        headers:
+          X-Waveform-Source:
+            type: string
+            description: pcm, ffmpeg, mp3-gain ou mp4-frames (ausente se desconhecida)
+          X-Waveform-Estimated:
+            type: string
+            description: 1 se os picos são um envelope estimado, sem decodificar o áudio
+      202:
+        description: Em processamento (ver Retry-After)
+      404:
+        description: Mídia ou arquivo não encontrado
+      422:
+        description: Arquivo sem áudio reconhecível
+    """
+    try:
+        filename = get_midia_filename(midia_id)
+        if filename is None:
+            return jsonify({"error": "Mídia não encontrada"}), 404
+        if not is_safe_filename(filename):
+            return jsonify({"error": "Arquivo não encontrado"}), 404
+        
+        stored = waveform_store.get(filename)
+        if stored is None:
+            try:
+                stored = waveform_jobs.submit(filename).result(timeout=WAVEFORM_WAIT_SECONDS)
+            except FuturesTimeoutError:
+                response = jsonify({"status": "pending"})
+                response.status_code = 202
+                response.headers['Retry-After'] = '2'
+                return response
+            except FileNotFoundError:
+                return jsonify({"error": "Arquivo não encontrado"}), 404
+            except WaveformError as e:
+                return jsonify({"error": str(e)}), 422
+        
+        payload, source = stored
+        if request.args.get('format') == 'json':
+            response = jsonify(Waveform.from_bytes(payload, source).to_json())
+        else:
+            response = app.response_class(payload, mimetype='application/octet-stream')
+        # O .dat não tem campo para a origem: sem ffmpeg, MP3 e MP4 têm um
+        # envelope estimado, não picos do áudio decodificado
+        if source:
+            response.headers['X-Waveform-Source'] = source
+            response.headers['X-Waveform-Estimated'] = '1' if source in ESTIMATED_WAVEFORM_SOURCES else '0'
+        # O arquivo de um upload nunca é reescrito, então o cache pode ser longo;
+        # depois de WAVEFORM_MAX_AGE, o ETag evita baixar de novo
+        response.set_etag(f"{filename}-{zlib.adler32(payload):08x}")
+        response.cache_control.public = True
+        response.cache_control.max_age = WAVEFORM_MAX_AGE
+        return response.make_conditional(request)
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/midias/<int:midia_id>/play', methods=['POST'])
+def record_play(midia_id):
+    """
+    Registra uma reprodução da mídia
+    ---
+    tags:
+      - Mídias
+    description: >
+      O evento entra num buffer em memória e é gravado em lote (playCount e
+      lastPlayed) em até PLAY_FLUSH_INTERVAL_MS milissegundos. Com
+      playlistId, o arquivo do próximo item da playlist é pré-carregado.
+    parameters:
+      - in: path
+        name: midia_id
+        type: integer
+        required: true
+      - in: body
+        name: body
+        required: false
+        schema:
+          type: object
+          properties:
+            playlistId:
+              type: integer
+    responses:
+      202:
+        description: Reprodução registrada
+      400:
+        description: playlistId inválido
+      404:
+        description: Mídia não encontrada
+    """
+    try:
+        data = request.get_json(silent=True) or {}
+        if not isinstance(data, dict):
+            return jsonify({"error": "Dados inválidos"}), 400
+        playlist_id = data.get('playlistId')
+        if playlist_id is not None and (not isinstance(playlist_id, int) or isinstance(playlist_id, bool)):
+            return jsonify({"error": "playlistId deve ser um inteiro"}), 400
+        # Um play de id inexistente iria para o buffer e para o UPDATE do lote
+        if not midia_store(db_file_for_id(midia_id)).existing_ids([midia_id]):
+            return jsonify({"error": "Mídia não encontrada"}), 404
+        
+        play_buffer.record(midia_id, time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime()))
+        
+        # Tocando dentro de uma playlist: o próximo item é previsível
+        if playlist_id is not None:
+            try:
+                warm_next_playlist_item(playlist_id, midia_id)
+            except (sqlite3.Error, SQLAlchemyError) as e:
+                print(f"Erro ao aquecer o próximo item da playlist: {e}")
+        
+        return jsonify({"queued": True}), 202
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/midias/recent', methods=['GET'])
+def get_recently_played():
+    """
+    Lista as mídias tocadas recentemente
+    ---
+    tags:
+      - Mídias
+    parameters:
+      - in: query
+        name: limit
+        type: integer
+        default: 50
+    responses:
+      200:
+        description: Mídias ordenadas pela última reprodução
+    """
+    try:
+        limit = min(max(int(request.args.get('limit', 50)), 1), 500)
+        midias = get_played_midias('lastPlayed', limit)
+        return jsonify({
+            "midias": midias,
+            "count": len(midias)
+        }), 200
+    except ValueError:
+        return jsonify({"error": "Parâmetros inválidos"}), 400
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/midias/most-played', methods=['GET'])
+def get_most_played():
+    """
+    Lista as mídias mais tocadas
+    ---
+    tags:
+      - Mídias
+    parameters:
+      - in: query
+        name: limit
+        type: integer
+        default: 50
+    responses:
+      200:
+        description: Mídias ordenadas por playCount
+    """
+    try:
+        limit = min(max(int(request.args.get('limit', 50)), 1), 500)
+        midias = get_played_midias('playCount', limit)
+        return jsonify({
+            "midias": midias,
+            "count": len(midias)
+        }), 200
+    except ValueError:
+        return jsonify({"error": "Parâmetros inválidos"}), 400
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/devices', methods=['GET'])
+def list_devices():
+    """
+    Lista os dispositivos com mídias cadastradas
+    ---
+    tags:
+      - Dispositivos
+    responses:
+      200:
+        description: Dispositivos e quantidade de mídias de cada um
+        schema:
+          type: object
+          properties:
+            devices:
+              type: array
+              items:
+                type: object
+                properties:
+                  deviceId:
+                    type: string
+                  deviceName:
+                    type: string
+                  count:
+                    type: integer
+                  dedicated:
+                    type: boolean
+            count:
+              type: integer
+    """
+    try:
+        devices = get_devices()
+        return jsonify({
+            "devices": devices,
+            "count": len(devices)
+        }), 200
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/devices/<device_id>/midias', methods=['GET'])
+def list_device_midias(device_id):
+    """
+    Lista as mídias de um dispositivo (paginado, mais novas primeiro)
+    ---
+    tags:
+      - Dispositivos
+    parameters:
+      - in: path
+        name: device_id
+        type: string
+        required: true
+      - in: query
+        name: limit
+        type: integer
+        default: 50
+        description: Itens por página (máximo 500)
+      - in: query
+        name: cursor
+        type: string
+        description: Valor de `next` da página anterior
+    responses:
+      200:
+        description: Página de mídias do dispositivo
+        schema:
+          type: object
+          properties:
+            deviceId:
+              type: string
+            midias:
+              type: array
+              items:
+                type: object
+            count:
+              type: integer
+            next:
+              type: string
+              nullable: true
+      400:
+        description: Parâmetros inválidos
+    """
+    try:
+        limit = min(max(int(request.args.get('limit', 50)), 1), 500)
+        cursor_token = request.args.get('cursor')
+        if cursor_token and '|' not in cursor_token:
+            return jsonify({"error": "Cursor inválido"}), 400
+        
+        midias, next_cursor = get_device_midias(device_id, limit, cursor_token)
+        return jsonify({
+            "deviceId": device_id,
+            "midias": midias,
+            "count": len(midias),
+            "next": next_cursor
+        }), 200
+    except ValueError:
+        return jsonify({"error": "Parâmetros inválidos"}), 400
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/playlists', methods=['GET'])
+def get_playlists():
+    """
+    Lista as playlists
+    ---
+    tags:
+      - Playlists
+    parameters:
+      - in: query
+        name: deviceId
+        type: string
+        required: false
+    responses:
+      200:
+        description: Playlists com a quantidade de itens
+    """
+    try:
+        playlists = list_playlists(request.args.get('deviceId'))
+        return jsonify({
+            "playlists": playlists,
+            "count": len(playlists)
+        }), 200
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/playlists', methods=['POST'])
+def create_playlist_route():
+    """
+    Cria uma playlist, opcionalmente importando todos os itens de uma vez
+    ---
+    tags:
+      - Playlists
+    parameters:
+      - in: body
+        name: body
+        required: true
+        schema:
+          type: object
+          required:
+            - name
+          properties:
+            name:
+              type: string
+              example: "Favoritas da Semana"
+            deviceId:
+              type: string
+              nullable: true
+            midiaIds:
+              type: array
+              items:
+                type: integer
+              example: [3, 1, 2]
+    responses:
+      201:
+        description: Playlist criada
+      400:
+        description: Dados inválidos ou mídias inexistentes
+    """
+    try:
+        data = request.json
+        if not data or not data.get('name'):
+            return jsonify({"error": "Dados inválidos"}), 400
+        
+        playlist_id = create_playlist(data['name'], data.get('deviceId'), data.get('midiaIds'))
+        return jsonify(get_playlist(playlist_id)), 201
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/playlists/<int:playlist_id>', methods=['GET'])
+def get_playlist_route(playlist_id):
+    """Busca uma playlist por ID"""
+    try:
+        playlist = get_playlist(playlist_id)
+        if not playlist:
+            return jsonify({"error": "Playlist não encontrada"}), 404
+        return jsonify(playlist), 200
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/playlists/<int:playlist_id>', methods=['PUT'])
+def update_playlist_route(playlist_id):
+    """Renomeia uma playlist"""
+    try:
+        data = request.json
+        if not data or not data.get('name'):
+            return jsonify({"error": "Dados inválidos"}), 400
+        
+        if not update_playlist(playlist_id, data['name']):
+            return jsonify({"error": "Playlist não encontrada"}), 404
+        return jsonify(get_playlist(playlist_id)), 200
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/playlists/<int:playlist_id>', methods=['DELETE'])
+def delete_playlist_route(playlist_id):
+    """Remove uma playlist"""
+    try:
+        if not delete_playlist(playlist_id):
+            return jsonify({"error": "Playlist não encontrada"}), 404
+        return jsonify({"message": "Playlist removida"}), 200
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/playlists/<int:playlist_id>/items', methods=['GET'])
+def get_playlist_items_route(playlist_id):
+    """
+    Lista os itens da playlist, em ordem, com os dados das mídias
+    ---
+    tags:
+      - Playlists
+    parameters:
+      - in: path
+        name: playlist_id
+        type: integer
+        required: true
+      - in: query
+        name: limit
+        type: integer
+        default: 100
+        description: Itens por página (máximo 1000)
+      - in: query
+        name: cursor
+        type: string
+        description: Valor de `next` da página anterior
+    responses:
+      200:
+        description: Página de itens
+        schema:
+          type: object
+          properties:
+            items:
+              type: array
+              items:
+                type: object
+                properties:
+                  itemId:
+                    type: integer
+                  midia:
+                    type: object
+            count:
+              type: integer
+            next:
+              type: string
+              nullable: true
+      404:
+        description: Playlist não encontrada
+    """
+    try:
+        if not get_playlist(playlist_id):
+            return jsonify({"error": "Playlist não encontrada"}), 404
+        
+        limit = min(max(int(request.args.get('limit', 100)), 1), 1000)
+        cursor_token = request.args.get('cursor')
+        if cursor_token and '|' not in cursor_token:
+            return jsonify({"error": "Cursor inválido"}), 400
+        
+        items, next_cursor = get_playlist_items(playlist_id, limit, cursor_token)
+        return jsonify({
+            "items": items,
+            "count": len(items),
+            "next": next_cursor
+        }), 200
+    except ValueError:
+        return jsonify({"error": "Parâmetros inválidos"}), 400
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/playlists/<int:playlist_id>/items', methods=['POST'])
+def add_playlist_item_route(playlist_id):
+    """
+    Adiciona uma mídia à playlist
+    ---
+    tags:
+      - Playlists
+    description: >
+      Sem `after`/`before` o item vai para o final. Só a linha do novo item
+      é escrita.
+    parameters:
+      - in: path
+        name: playlist_id
+        type: integer
+        required: true
+      - in: body
+        name: body
+        required: true
+        schema:
+          type: object
+          required:
+            - midiaId
+          properties:
+            midiaId:
+              type: integer
+            after:
+              type: integer
+              description: itemId que ficará antes do novo item
+            before:
+              type: integer
+              description: itemId que ficará depois do novo item
+    responses:
+      201:
+        description: Item adicionado
+      400:
+        description: Dados inválidos
+      404:
+        description: Playlist não encontrada
+    """
+    try:
+        data = request.json
+        if not isinstance(data, dict) or not isinstance(data.get('midiaId'), int):
+            return jsonify({"error": "Dados inválidos"}), 400
+        after_item, before_item = playlist_neighbours(data)
+        validate_midia_ids([data['midiaId']])
+        
+        item_id = place_playlist_item(
+            playlist_id, midia_id=data['midiaId'],
+            after_item=after_item, before_item=before_item
+        )
+        if item_id is None:
+            return jsonify({"error": "Playlist não encontrada"}), 404
+        return jsonify({"itemId": item_id, "midiaId": data['midiaId']}), 201
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/playlists/<int:playlist_id>/items', methods=['PUT'])
+def replace_playlist_items_route(playlist_id):
+    """
+    Substitui todo o conteúdo da playlist (importação em uma transação)
+    ---
+    tags:
+      - Playlists
+    parameters:
+      - in: path
+        name: playlist_id
+        type: integer
+        required: true
+      - in: body
+        name: body
+        required: true
+        schema:
+          type: object
+          required:
+            - midiaIds
+          properties:
+            midiaIds:
+              type: array
+              items:
+                type: integer
+    responses:
+      200:
+        description: Conteúdo substituído
+      400:
+        description: Dados inválidos ou mídias inexistentes
+      404:
+        description: Playlist não encontrada
+    """
+    try:
+        data = request.json
+        if not data or 'midiaIds' not in data:
+            return jsonify({"error": "Dados inválidos"}), 400
+        
+        if not replace_playlist_items(playlist_id, data['midiaIds']):
+            return jsonify({"error": "Playlist não encontrada"}), 404
+        return jsonify(get_playlist(playlist_id)), 200
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/playlists/<int:playlist_id>/items/<int:item_id>', methods=['PUT'])
+def move_playlist_item_route(playlist_id, item_id):
+    """
+    Move um item da playlist
+    ---
+    tags:
+      - Playlists
+    description: >
+      Informe `after` ou `before` (itemId vizinho); sem nenhum dos dois o item
+      vai para o final. Só a linha do item movido é escrita.
+    parameters:
+      - in: path
+        name: playlist_id
+        type: integer
+        required: true
+      - in: path
+        name: item_id
+        type: integer
+        required: true
+      - in: body
+        name: body
+        required: true
+        schema:
+          type: object
+          properties:
+            after:
+              type: integer
+            before:
+              type: integer
+    responses:
+      200:
+        description: Item movido
+      400:
+        description: Dados inválidos
+      404:
+        description: Playlist não encontrada
+    """
+    try:
+        data = request.json or {}
+        if not isinstance(data, dict):
+            return jsonify({"error": "Dados inválidos"}), 400
+        after_item, before_item = playlist_neighbours(data)
+        if place_playlist_item(playlist_id, item_id=item_id,
+                               after_item=after_item, before_item=before_item) is None:
+            return jsonify({"error": "Playlist não encontrada"}), 404
+        return jsonify({"itemId": item_id}), 200
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/playlists/<int:playlist_id>/items/<int:item_id>', methods=['DELETE'])
+def remove_playlist_item_route(playlist_id, item_id):
+    """Remove um item da playlist"""
+    try:
+        if not remove_playlist_item(playlist_id, item_id):
+            return jsonify({"error": "Item não encontrado"}), 404
+        return jsonify({"message": "Item removido"}), 200
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
 @app.route('/api/stats', methods=['GET'])
 def get_stats():
     """
@@ -576,39 +2376,8 @@ def get_stats():
         description: Erro ao buscar estatísticas
     """
     try:
-        conn = sqlite3.connect(DB_FILE)
-        cursor = conn.cursor()
-        
-        # Total de mídias
-        cursor.execute('SELECT COUNT(*) FROM midias')
-        total = cursor.fetchone()[0]
-        
-        # Total de favoritos
-        cursor.execute('SELECT COUNT(*) FROM midias WHERE isFavorite = 1')
-        favorites = cursor.fetchone()[0]
-        
-        # Total por tipo de mídia
-        cursor.execute('SELECT mimeType, COUNT(*) FROM midias GROUP BY mimeType')
-        by_type = {row[0]: row[1] for row in cursor.fetchall()}
-        
-        # Tamanho total dos arquivos
-        cursor.execute('SELECT SUM(fileSize) FROM midias')
-        total_size = cursor.fetchone()[0] or 0
-        
-        # Duração total
-        cursor.execute('SELECT SUM(duration) FROM midias')
-        total_duration = cursor.fetchone()[0] or 0
-        
-        conn.close()
-        
-        return jsonify({
-            "total_midias": total,
-            "total_favorites": favorites,
-            "by_mime_type": by_type,
-            "total_file_size": total_size,
-            "total_duration": total_duration,
-            "total_duration_formatted": f"{total_duration // 60} minutos" if total_duration > 0 else "0 minutos"
-        }), 200
+        body, shared = coalescer.do('stats', lambda: json_body(get_library_stats()))
+        return coalesced_response(body, shared)
         
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -617,32 +2386,25 @@ def get_stats():
 def get_db_info():
     """Retorna informações sobre a estrutura da base de dados"""
     try:
-        conn = sqlite3.connect(DB_FILE)
-        cursor = conn.cursor()
-        
         # Informações da tabela
-        cursor.execute("PRAGMA table_info(midias)")
-        columns = cursor.fetchall()
+        store = midia_store(DB_FILE)
+        column_info = store.columns()
         
-        column_info = []
-        for col in columns:
-            column_info.append({
-                "id": col[0],
-                "name": col[1],
-                "type": col[2],
-                "not_null": bool(col[3]),
-                "default_value": col[4],
-                "primary_key": bool(col[5])
-            })
+        if server_store:
+            return jsonify({
+                "table_name": "midias",
+                "columns": column_info,
+                "database_backend": store.engine.dialect.name,
+                "database_url": store.display_url
+            }), 200
         
         # Tamanho do arquivo da base de dados
         db_size = os.path.getsize(DB_FILE) if os.path.exists(DB_FILE) else 0
         
-        conn.close()
-        
         return jsonify({
             "table_name": "midias",
             "columns": column_info,
+            "database_backend": "sqlite",
             "database_file": DB_FILE,
             "database_size_bytes": db_size,
             "database_size_formatted": f"{db_size / 1024:.2f} KB" if db_size > 0 else "0 KB"
@@ -651,425 +2413,359 @@ def get_db_info():
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+@app.route('/api/events', methods=['GET'])
+def stream_events():
+    """
+    Stream de alterações da biblioteca (Server-Sent Events)
+    ---
+    tags:
+      - Mídias
+    description: >
+      Eventos midia.created, midia.updated, midia.favorite, midia.deleted e
+      library.imported no formato text/event-stream. O id de cada evento é
+      um cursor (0:120,1:35) válido em qualquer worker; reconectar com
+      Last-Event-ID (ou ?lastEventId=) entrega o que foi perdido. Um evento
+      reset indica que a lacuna é maior que a retenção e a biblioteca deve
+      ser recarregada. A conexão é encerrada após EVENTS_MAX_STREAM_SECONDS
+      e o EventSource reconecta. Cada assinante ocupa uma thread do worker;
+      o limite por worker é o menor entre ADMISSION_MAX_EVENTS e
+      EVENTS_MAX_SUBSCRIBERS.
+    produces:
+      - text/event-stream
+    parameters:
+      - in: header
+        name: Last-Event-ID
+        type: string
+      - in: query
+        name: lastEventId
+        type: string
+      - in: query
+        name: deviceId
+        type: string
+        description: Apenas eventos deste dispositivo (e de mídias sem dispositivo)
+    responses:
+      200:
+        description: Stream de eventos
+      503:
+        description: Limite de assinantes do worker atingido
+    """
+    try:
+        last_event_id = request.headers.get('Last-Event-ID') or request.args.get('lastEventId')
+        device_id = request.args.get('deviceId')
+        
+        if event_hub.subscribers >= EVENTS_MAX_SUBSCRIBERS:
+            response = jsonify({"error": "Limite de assinantes atingido"})
+            response.headers['Retry-After'] = '5'
+            return response, 503
+        
+        event_hub.start()
+        cursor = event_hub.cursor_from(last_event_id)
+        stream = event_hub.stream(cursor, device_id, EVENTS_HEARTBEAT_SECONDS, EVENTS_MAX_STREAM_SECONDS)
+        return Response(stream, mimetype='text/event-stream', headers={
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no"
+        })
+    except ValueError:
+        return jsonify({"error": "Last-Event-ID inválido"}), 400
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/export', methods=['GET'])
+def export_library():
+    """
+    Exporta a biblioteca como um arquivo tar
+    ---
+    tags:
+      - Biblioteca
+    description: >
+      O tar é gerado durante o envio (memória constante, sem arquivo
+      temporário), com os metadados em lotes NDJSON (metadata/*.ndjson)
+      precedidos dos arquivos de mídia que eles referenciam (media/*).
+      Exige o header X-Admin-Token.
+    parameters:
+      - in: header
+        name: X-Admin-Token
+        type: string
+        required: true
+      - in: query
+        name: deviceId
+        type: string
+        description: Exporta apenas as mídias deste dispositivo
+      - in: query
+        name: media
+        type: integer
+        default: 1
+        description: 0 para exportar só os metadados
+    produces:
+      - application/x-tar
+    responses:
+      200:
+        description: Arquivo tar
+      401:
+        description: Token inválido
+    """
+    if not is_admin_request():
+        return admin_denied()
+    try:
+        device_id = request.args.get('deviceId')
+        include_media = request.args.get('media', '1') != '0'
+        archive = export_archive(iter_midia_batches(device_id), storage, include_media)
+        
+        stamp = time.strftime('%Y%m%dT%H%M%S', time.gmtime())
+        name = f"midias-{device_id}-{stamp}.tar" if device_id else f"midias-{stamp}.tar"
+        return Response(archive, mimetype='application/x-tar', headers={
+            "Content-Disposition": f'attachment; filename="{name}"',
+            "Cache-Control": "no-store"
+        })
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/import', methods=['POST'])
+def import_library():
+    """
+    Importa um arquivo gerado por /api/export
+    ---
+    tags:
+      - Biblioteca
+    description: >
+      O corpo da requisição é o tar (ou tar.gz), lido em streaming. Cada lote
+      de metadados é gravado numa transação; arquivos de mídia que já
+      existem nunca são sobrescritos. Exige o header X-Admin-Token.
+    consumes:
+      - application/x-tar
+    parameters:
+      - in: header
+        name: X-Admin-Token
+        type: string
+        required: true
+      - in: body
+        name: body
+        required: true
+        schema:
+          type: string
+          format: binary
+    responses:
+      200:
+        description: Contagem de mídias e arquivos importados
+      400:
+        description: Arquivo inválido
+      401:
+        description: Token inválido
+    """
+    if not is_admin_request():
+        return admin_denied()
+    try:
+        if request.mimetype == 'multipart/form-data':
+            if 'file' not in request.files:
+                return jsonify({"error": "Nenhum arquivo enviado"}), 400
+            stream = request.files['file'].stream
+        else:
+            stream = request.stream
+        
+        stats = import_archive(stream, storage, import_midia_rows)
+        if stats["midias"]:
+            # Um único evento: os clientes recarregam a lista em vez de receber N eventos
+            emit_midia_event('library.imported', payload=stats)
+        return jsonify(stats), 200
+    except ArchiveError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/admin/backup', methods=['GET'])
+def download_backup():
+    """
+    Baixa um snapshot consistente da base
+    ---
+    tags:
+      - Administração
+    description: >
+      Copia a base com a API de backup online do SQLite (sem bloquear as
+      escritas) e transmite a cópia. Exige o header X-Admin-Token.
+    parameters:
+      - in: header
+        name: X-Admin-Token
+        type: string
+        required: true
+      - in: query
+        name: db
+        type: string
+        description: Nome da base (midias, device-1, ...); padrão é a base principal
+    produces:
+      - application/x-sqlite3
+    responses:
+      200:
+        description: Arquivo SQLite
+      401:
+        description: Token inválido
+      404:
+        description: Base não encontrada
+    """
+    if not is_admin_request():
+        return admin_denied()
+    try:
+        databases = {snapshot_stem(f): f for f in all_db_files()}
+        stem = request.args.get('db', snapshot_stem(DB_FILE))
+        if stem not in databases:
+            return jsonify({"error": "Base não encontrada"}), 404
+
+        fd, tmp_path = tempfile.mkstemp(prefix='.snapshot-', suffix='.db')
+        os.close(fd)
+        try:
+            backup_database(databases[stem], tmp_path, BACKUP_PAGES, BACKUP_PAUSE_MS / 1000)
+            f = open(tmp_path, 'rb')
+        finally:
+            # O arquivo aberto continua legível depois de removido do diretório
+            os.remove(tmp_path)
+        size = os.fstat(f.fileno()).st_size
+
+        def generate():
+            with f:
+                while True:
+                    chunk = f.read(64 * 1024)
+                    if not chunk:
+                        break
+                    yield chunk
+
+        stamp = time.strftime('%Y%m%dT%H%M%S', time.gmtime())
+        return Response(generate(), mimetype='application/x-sqlite3', headers={
+            "Content-Length": str(size),
+            "Content-Disposition": f'attachment; filename="{stem}-{stamp}.db"',
+            "Cache-Control": "no-store"
+        })
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/admin/backups', methods=['GET'])
+def get_backups():
+    """
+    Lista os snapshots agendados
+    ---
+    tags:
+      - Administração
+    parameters:
+      - in: header
+        name: X-Admin-Token
+        type: string
+        required: true
+    responses:
+      200:
+        description: Snapshots do mais recente para o mais antigo
+    """
+    if not is_admin_request():
+        return admin_denied()
+    try:
+        snapshots = [{k: v for k, v in s.items() if k != 'path'} for s in list_snapshots(BACKUP_DIR)]
+        return jsonify({
+            "snapshots": snapshots,
+            "count": len(snapshots),
+            "interval_minutes": BACKUP_INTERVAL_MINUTES,
+            "keep": BACKUP_KEEP,
+            "last_run": backup_scheduler.last_run,
+            "last_error": backup_scheduler.last_error
+        }), 200
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/admin/backups', methods=['POST'])
+def create_backup():
+    """
+    Grava agora um snapshot de todas as bases
+    ---
+    tags:
+      - Administração
+    parameters:
+      - in: header
+        name: X-Admin-Token
+        type: string
+        required: true
+    responses:
+      201:
+        description: Snapshots gravados em BACKUP_DIR
+    """
+    if not is_admin_request():
+        return admin_denied()
+    try:
+        results = backup_scheduler.run_once()
+        return jsonify({"snapshots": results, "count": len(results)}), 201
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/admin/admission', methods=['GET'])
+def get_admission_stats():
+    """
+    Estado do controle de admissão neste worker
+    ---
+    tags:
+      - Administração
+    parameters:
+      - in: header
+        name: X-Admin-Token
+        type: string
+        required: true
+    responses:
+      200:
+        description: Requisições admitidas, limitadas (429) e recusadas (503) por classe de rota
+    """
+    if not is_admin_request():
+        return admin_denied()
+    if admission is None:
+        return jsonify({"enabled": False}), 200
+    return jsonify(dict(admission.snapshot(), enabled=True)), 200
+
+@app.route('/api/admin/coalescing', methods=['GET'])
+def get_coalescing_stats():
+    """
+    Contadores da coalescência de leituras neste worker
+    ---
+    tags:
+      - Administração
+    parameters:
+      - in: header
+        name: X-Admin-Token
+        type: string
+        required: true
+    responses:
+      200:
+        description: Requisições, execuções e requisições deduplicadas por endpoint
+    """
+    if not is_admin_request():
+        return admin_denied()
+    return jsonify(coalescer.snapshot()), 200
+
+@app.route('/api/admin/media-cache', methods=['GET'])
+def get_media_cache_stats():
+    """
+    Estado do cache de arquivos de mídia neste worker
+    ---
+    tags:
+      - Administração
+    parameters:
+      - in: header
+        name: X-Admin-Token
+        type: string
+        required: true
+    responses:
+      200:
+        description: Acertos, erros, taxa de acerto e bytes em cache
+    """
+    if not is_admin_request():
+        return admin_denied()
+    return jsonify(media_cache.snapshot()), 200
+
 @app.route('/test-page')
 def test_page():
     """Página HTML para testar a API"""
-    html = """
-    <!DOCTYPE html>
-    <html lang="pt-BR">
-    <head>
-        <meta charset="UTF-8">
-        <meta name="viewport" content="width=device-width, initial-scale=1.0">
-        <title>Teste da API - Mídia Player</title>
-        <style>
-            * {
-                margin: 0;
-                padding: 0;
-                box-sizing: border-box;
-            }
-            body {
-                font-family: 'Segoe UI', Tahoma, Geneva, Verdana, sans-serif;
-                background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
-                padding: 20px;
-                min-height: 100vh;
-            }
-            .container {
-                max-width: 1200px;
-                margin: 0 auto;
-                background: white;
-                border-radius: 10px;
-                padding: 30px;
-                box-shadow: 0 10px 30px rgba(0,0,0,0.3);
-            }
-            h1 {
-                color: #333;
-                margin-bottom: 10px;
-                text-align: center;
-            }
-            .subtitle {
-                text-align: center;
-                color: #666;
-                margin-bottom: 30px;
-            }
-            .endpoints {
-                display: grid;
-                grid-template-columns: repeat(auto-fit, minmax(300px, 1fr));
-                gap: 20px;
-                margin-bottom: 30px;
-            }
-            .endpoint-card {
-                background: #f8f9fa;
-                border: 2px solid #e9ecef;
-                border-radius: 8px;
-                padding: 20px;
-                transition: all 0.3s;
-            }
-            .endpoint-card:hover {
-                border-color: #667eea;
-                transform: translateY(-2px);
-                box-shadow: 0 4px 12px rgba(102, 126, 234, 0.2);
-            }
-            .method {
-                display: inline-block;
-                padding: 4px 12px;
-                border-radius: 4px;
-                font-weight: bold;
-                font-size: 12px;
-                margin-right: 10px;
-            }
-            .method.get { background: #28a745; color: white; }
-            .method.post { background: #007bff; color: white; }
-            .method.put { background: #ffc107; color: black; }
-            .method.delete { background: #dc3545; color: white; }
-            .endpoint-path {
-                font-family: 'Courier New', monospace;
-                color: #495057;
-                margin: 10px 0;
-                word-break: break-all;
-            }
-            .description {
-                color: #6c757d;
-                font-size: 14px;
-                margin-bottom: 15px;
-            }
-            button {
-                background: #667eea;
-                color: white;
-                border: none;
-                padding: 10px 20px;
-                border-radius: 5px;
-                cursor: pointer;
-                font-size: 14px;
-                transition: background 0.3s;
-                width: 100%;
-            }
-            button:hover {
-                background: #5568d3;
-            }
-            .response {
-                margin-top: 20px;
-                padding: 15px;
-                background: #f8f9fa;
-                border-radius: 5px;
-                border-left: 4px solid #667eea;
-                max-height: 400px;
-                overflow-y: auto;
-            }
-            .response pre {
-                white-space: pre-wrap;
-                word-wrap: break-word;
-                font-size: 12px;
-                color: #333;
-            }
-            .loading {
-                color: #667eea;
-                font-style: italic;
-            }
-            .error {
-                color: #dc3545;
-            }
-            .success {
-                color: #28a745;
-            }
-            .endpoint-list {
-                background: #f8f9fa;
-                padding: 20px;
-                border-radius: 8px;
-                margin-top: 30px;
-            }
-            .endpoint-list h2 {
-                color: #333;
-                margin-bottom: 15px;
-            }
-            .endpoint-item {
-                padding: 10px;
-                margin: 5px 0;
-                background: white;
-                border-radius: 5px;
-                border-left: 3px solid #667eea;
-            }
-            .api-config {
-                background: #e7f3ff;
-                padding: 20px;
-                border-radius: 8px;
-                margin-bottom: 30px;
-                border: 2px solid #667eea;
-            }
-            .api-config h3 {
-                color: #333;
-                margin-bottom: 15px;
-            }
-            .api-input-group {
-                display: flex;
-                gap: 10px;
-                margin-bottom: 10px;
-            }
-            .api-input-group input {
-                flex: 1;
-                padding: 10px;
-                border: 2px solid #ddd;
-                border-radius: 5px;
-                font-size: 14px;
-                font-family: 'Courier New', monospace;
-            }
-            .api-input-group input:focus {
-                outline: none;
-                border-color: #667eea;
-            }
-            .api-input-group button {
-                padding: 10px 20px;
-                width: auto;
-            }
-            .current-url {
-                margin-top: 10px;
-                padding: 10px;
-                background: white;
-                border-radius: 5px;
-                font-size: 12px;
-                color: #666;
-            }
-            .current-url strong {
-                color: #333;
-            }
-            .url-examples {
-                margin-top: 15px;
-                padding: 10px;
-                background: white;
-                border-radius: 5px;
-                font-size: 12px;
-            }
-            .url-examples code {
-                display: block;
-                margin: 5px 0;
-                padding: 5px;
-                background: #f8f9fa;
-                border-radius: 3px;
-            }
-        </style>
-    </head>
-    <body>
-        <div class="container">
-            <h1>🎵 Teste da API - Mídia Player</h1>
-            <p class="subtitle">Teste todos os endpoints da sua API diretamente no navegador</p>
-            
-            <div class="api-config">
-                <h3>⚙️ Configuração da API</h3>
-                <div class="api-input-group">
-                    <input type="text" id="api-url" placeholder="https://sua-api.onrender.com" />
-                    <button onclick="setApiUrl()">Definir URL</button>
-                </div>
-                <div class="current-url">
-                    <strong>URL Atual:</strong> <span id="current-url">Detectando automaticamente...</span>
-                </div>
-                <div class="url-examples">
-                    <strong>Exemplos de URLs:</strong>
-                    <code>https://sua-api.onrender.com</code>
-                    <code>https://midia-player-api.onrender.com</code>
-                    <code>http://localhost:5003</code>
-                </div>
-            </div>
-            
-            <div class="endpoints">
-                <div class="endpoint-card">
-                    <span class="method get">GET</span>
-                    <div class="endpoint-path">/test</div>
-                    <div class="description">Testa se a API está funcionando</div>
-                    <button onclick="testEndpoint('/test', 'GET')">Testar</button>
-                </div>
-                
-                <div class="endpoint-card">
-                    <span class="method get">GET</span>
-                    <div class="endpoint-path">/api/midias</div>
-                    <div class="description">Lista todas as mídias</div>
-                    <button onclick="testEndpoint('/api/midias', 'GET')">Testar</button>
-                </div>
-                
-                <div class="endpoint-card">
-                    <span class="method get">GET</span>
-                    <div class="endpoint-path">/api/stats</div>
-                    <div class="description">Estatísticas da base de dados</div>
-                    <button onclick="testEndpoint('/api/stats', 'GET')">Testar</button>
-                </div>
-                
-                <div class="endpoint-card">
-                    <span class="method get">GET</span>
-                    <div class="endpoint-path">/api/db/info</div>
-                    <div class="description">Informações da estrutura da BD</div>
-                    <button onclick="testEndpoint('/api/db/info', 'GET')">Testar</button>
-                </div>
-                
-                <div class="endpoint-card">
-                    <span class="method get">GET</span>
-                    <div class="endpoint-path">/api/midias/favorites</div>
-                    <div class="description">Lista mídias favoritas</div>
-                    <button onclick="testEndpoint('/api/midias/favorites', 'GET')">Testar</button>
-                </div>
-                
-                <div class="endpoint-card">
-                    <span class="method get">GET</span>
-                    <div class="endpoint-path">/debug</div>
-                    <div class="description">Debug - ver todas as mídias</div>
-                    <button onclick="testEndpoint('/debug', 'GET')">Testar</button>
-                </div>
-            </div>
-            
-            <div id="response" class="response" style="display: none;">
-                <strong>Resposta:</strong>
-                <pre id="response-content"></pre>
-            </div>
-            
-            <div class="endpoint-list">
-                <h2>📋 Lista Completa de Endpoints</h2>
-                <div class="endpoint-item">
-                    <strong>GET</strong> <code>/test</code> - Testa se a API está funcionando
-                </div>
-                <div class="endpoint-item">
-                    <strong>GET</strong> <code>/api/midias</code> - Lista todas as mídias
-                </div>
-                <div class="endpoint-item">
-                    <strong>GET</strong> <code>/api/midias/{id}</code> - Busca uma mídia por ID
-                </div>
-                <div class="endpoint-item">
-                    <strong>GET</strong> <code>/api/midias/favorites</code> - Lista mídias favoritas
-                </div>
-                <div class="endpoint-item">
-                    <strong>GET</strong> <code>/api/stats</code> - Estatísticas da base de dados
-                </div>
-                <div class="endpoint-item">
-                    <strong>GET</strong> <code>/api/db/info</code> - Informações da estrutura da BD
-                </div>
-                <div class="endpoint-item">
-                    <strong>GET</strong> <code>/debug</code> - Debug - ver todas as mídias
-                </div>
-                <div class="endpoint-item">
-                    <strong>POST</strong> <code>/api/midias</code> - Adiciona uma nova mídia (JSON)
-                </div>
-                <div class="endpoint-item">
-                    <strong>POST</strong> <code>/api/midias/upload</code> - Upload de arquivo de mídia
-                </div>
-                <div class="endpoint-item">
-                    <strong>PUT</strong> <code>/api/midias/{id}</code> - Atualiza uma mídia
-                </div>
-                <div class="endpoint-item">
-                    <strong>DELETE</strong> <code>/api/midias/{id}</code> - Remove uma mídia
-                </div>
-                <div class="endpoint-item">
-                    <strong>POST</strong> <code>/api/midias/{id}/favorite</code> - Alterna favorito
-                </div>
-                <div class="endpoint-item">
-                    <strong>GET</strong> <code>/api/midias/media/{filename}</code> - Serve arquivo de mídia
-                </div>
-            </div>
-        </div>
-        
-        <script>
-            let API_BASE = window.location.origin;
-            
-            // Carregar URL salva no localStorage ou usar a atual
-            window.addEventListener('load', () => {
-                const savedUrl = localStorage.getItem('api_url');
-                if (savedUrl) {
-                    API_BASE = savedUrl;
-                    document.getElementById('api-url').value = savedUrl;
-                }
-                updateCurrentUrl();
-                testEndpoint('/test', 'GET');
-            });
-            
-            function setApiUrl() {
-                const input = document.getElementById('api-url');
-                let url = input.value.trim();
-                
-                // Remover barra final se existir
-                if (url.endsWith('/')) {
-                    url = url.slice(0, -1);
-                }
-                
-                // Validar URL
-                if (url && (url.startsWith('http://') || url.startsWith('https://'))) {
-                    API_BASE = url;
-                    localStorage.setItem('api_url', url);
-                    updateCurrentUrl();
-                    alert('URL da API atualizada com sucesso!');
-                    // Testar a nova URL
-                    testEndpoint('/test', 'GET');
-                } else if (url) {
-                    alert('Por favor, insira uma URL válida (deve começar com http:// ou https://)');
-                } else {
-                    // Se vazio, usar a URL atual
-                    API_BASE = window.location.origin;
-                    localStorage.removeItem('api_url');
-                    updateCurrentUrl();
-                    alert('Usando URL atual da página');
-                    testEndpoint('/test', 'GET');
-                }
-            }
-            
-            function updateCurrentUrl() {
-                document.getElementById('current-url').textContent = API_BASE;
-            }
-            
-            // Permitir Enter no input
-            document.addEventListener('DOMContentLoaded', () => {
-                const input = document.getElementById('api-url');
-                if (input) {
-                    input.addEventListener('keypress', (e) => {
-                        if (e.key === 'Enter') {
-                            setApiUrl();
-                        }
-                    });
-                }
-            });
-            
-            async function testEndpoint(endpoint, method = 'GET') {
-                const responseDiv = document.getElementById('response');
-                const responseContent = document.getElementById('response-content');
-                
-                responseDiv.style.display = 'block';
-                responseContent.innerHTML = '<span class="loading">Carregando...</span>';
-                
-                try {
-                    const response = await fetch(API_BASE + endpoint, {
-                        method: method,
-                        headers: {
-                            'Content-Type': 'application/json'
-                        }
-                    });
-                    
-                    const data = await response.json();
-                    
-                    const statusClass = response.ok ? 'success' : 'error';
-                    responseContent.innerHTML = `
-                        <span class="${statusClass}"><strong>Status:</strong> ${response.status} ${response.statusText}</span>
-                        <pre>${JSON.stringify(data, null, 2)}</pre>
-                    `;
-                } catch (error) {
-                    responseContent.innerHTML = `
-                        <span class="error"><strong>Erro:</strong> ${error.message}</span>
-                    `;
-                }
-            }
-            
-        </script>
-    </body>
-    </html>
-    """
-    return html
+    # Normalmente atendida pelo StaticBundleMiddleware (pré-comprimida, com ETag);
+    # esta rota é o fallback quando o bundle está desativado
+    return send_from_directory(STATIC_FOLDER, 'test-page.html', max_age=STATIC_MAX_AGE)
 
 def update_existing_media_uris():
     """Atualiza URIs de mídias existentes para o novo formato"""
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
-    
-    # Update URIs that point to /api/files/ to use /api/midias/media/
-    cursor.execute("""
-        UPDATE midias 
-        SET uri = REPLACE(uri, '/api/files/', '/api/midias/media/')
-        WHERE uri LIKE '%/api/files/%'
-    """)
-    
-    conn.commit()
-    conn.close()
+    for store in midia_stores():
+        # URIs absolutas e /api/files/ passam a /api/midias/media/<filename>,
+        # a forma que a contagem de referências dos arquivos procura
+        store.normalize_media_uris()
 
 # ============================================================
 # INICIALIZAÇÃO
@@ -1078,12 +2774,54 @@ def update_existing_media_uris():
 # Inicializar banco de dados quando o módulo carregar
 # Isso funciona tanto para desenvolvimento quanto para produção (Gunicorn)
 try:
+    # Base ausente (disco efêmero recriado): restaura o último snapshot antes
+    # do init_db criar uma base vazia; as bases dedicadas vêm em seguida
+    restored = restore_missing_databases([DB_FILE])
     init_db()
+    if server_store:
+        # Cria a tabela e os índices no servidor, se ainda não existirem
+        server_store.create_schema()
+    load_device_shards()
+    restored += restore_missing_databases(all_db_files()[1:])
+    for name in restored:
+        print(f"Base restaurada do snapshot {name}")
+    if not server_store:
+        for device_id in DEDICATED_DEVICES:
+            register_dedicated_device(device_id)
+    elif DEDICATED_DEVICES:
+        print("DEDICATED_DEVICES ignorado: com DATABASE_URL todas as mídias ficam no servidor")
+    load_device_shards()
+    if not server_store:
+        # Bases dedicadas criadas antes de os eventos irem para a base da mídia
+        for db_file in all_db_files()[1:]:
+            conn = sqlite3.connect(db_file)
+            create_events_schema(conn.cursor())
+            conn.commit()
+            conn.close()
     update_existing_media_uris()
     print("Banco de dados inicializado com sucesso!")
 except Exception as e:
     print(f"Erro ao inicializar banco de dados: {e}")
 
+# Snapshots periódicos (BACKUP_INTERVAL_MINUTES > 0), num único worker
+backup_scheduler.start()
+if DATABASE_URL:
+    print("Backup: DATABASE_URL definido, os snapshots cobrem só o SQLite local; "
+          "as mídias no servidor precisam do backup do próprio banco")
+
+# Thread que acompanha a tabela de eventos para os assinantes de /api/events
+try:
+    event_hub.start()
+except sqlite3.Error as e:
+    print(f"Stream de eventos indisponível: {e}")
+
+# Gravação em lote das reproduções (flush final no encerramento do processo)
+play_buffer.start()
+
+# Migração online dos arquivos para o layout particionado (ab/cd/<filename>)
+if isinstance(storage, LocalStorage) and os.environ.get('MEDIA_SHARD_MIGRATION', '1') == '1':
+    start_background_migration(MEDIA_FOLDER)
+
 if __name__ == '__main__':
     # Usa PORT do Render ou 5003 para localhost
     port = int(os.environ.get('PORT', 5003))
@@ -0,0 +1,241 @@
+"""Backup online das bases SQLite sem bloquear as escritas
+
+Copiar o arquivo `midias.db` durante uma escrita pode gerar uma cópia
+corrompida. Aqui a cópia usa a API de backup online do SQLite, em passos de
+`pages` páginas com uma pausa entre eles, para que as requisições continuem
+escrevendo. Se a base for alterada por outra conexão no meio da cópia o
+SQLite reinicia o backup; depois de `max_restarts` reinícios a cópia é
+feita num único passo (lock de leitura curto) para garantir que termina.
+
+Snapshots ficam em BACKUP_DIR como `<base>-<AAAAMMDDTHHMMSSffffff>.db`
+(horário UTC com microssegundos, para dois snapshots no mesmo segundo não
+colidirem; nomes antigos sem microssegundos continuam reconhecidos), com
+retenção dos N mais recentes. Na inicialização, uma base ausente é
+restaurada do snapshot mais recente.
+
+Só bases SQLite são copiadas. Com DATABASE_URL definido, a tabela de mídias
+fica no servidor e precisa do backup dele (pg_dump etc.); aqui entram só o
+SQLite local (playlists, eventos, mapa de dispositivos) e as bases dedicadas.
+
+Uso:
+    python backup.py snapshot --db midias.db --dir backups
+    python backup.py list --dir backups
+    python backup.py restore --db midias.db --dir backups
+"""
+import argparse
+import json
+import os
+import re
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+SNAPSHOT_PATTERN = re.compile(r'^(?P<stem>.+)-(?P<stamp>\d{8}T\d{6}(?:\d{6})?)\.db$')
+
+
+class _Restarted(Exception):
+    """Interrompe um backup que reiniciou vezes demais"""
+
+
+def backup_database(src_file, dest_file, pages=256, pause=0.005, max_restarts=5):
+    """Copia `src_file` para `dest_file` com a API de backup online
+
+    Retorna um dicionário com o número de passos e reinícios.
+    """
+    stats = {"steps": 0, "restarts": 0, "single_step": False}
+    last_remaining = [None]
+
+    def progress(status, remaining, total):
+        stats["steps"] += 1
+        if last_remaining[0] is not None and remaining > last_remaining[0]:
+            stats["restarts"] += 1
+            if stats["restarts"] > max_restarts:
+                raise _Restarted()
+        last_remaining[0] = remaining
+        # Devolve o lock entre os passos para os handlers de requisição
+        if pause and remaining:
+            time.sleep(pause)
+
+    src = sqlite3.connect(src_file)
+    try:
+        dest = sqlite3.connect(dest_file)
+        try:
+            try:
+                src.backup(dest, pages=pages, progress=progress)
+            except _Restarted:
+                stats["single_step"] = True
+                src.backup(dest, pages=-1)
+        finally:
+            dest.close()
+    finally:
+        src.close()
+    return stats
+
+
+def snapshot_stem(db_file):
+    return os.path.splitext(os.path.basename(db_file))[0]
+
+
+def list_snapshots(backup_dir, stem=None):
+    """Snapshots do diretório, do mais recente para o mais antigo"""
+    snapshots = []
+    try:
+        names = os.listdir(backup_dir)
+    except FileNotFoundError:
+        return snapshots
+    for name in names:
+        match = SNAPSHOT_PATTERN.match(name)
+        if not match or (stem and match.group('stem') != stem):
+            continue
+        path = os.path.join(backup_dir, name)
+        snapshots.append({
+            "name": name,
+            "database": match.group('stem'),
+            "created": match.group('stamp'),
+            "size": os.path.getsize(path),
+            "path": path,
+        })
+    snapshots.sort(key=lambda s: s["created"], reverse=True)
+    return snapshots
+
+
+def create_snapshot(db_file, backup_dir, keep=7, pages=256, pause=0.005):
+    """Grava um snapshot consistente de `db_file` e aplica a retenção"""
+    os.makedirs(backup_dir, exist_ok=True)
+    stamp = datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%S%f')
+    name = f"{snapshot_stem(db_file)}-{stamp}.db"
+    tmp_path = os.path.join(backup_dir, f".{name}.tmp")
+    try:
+        stats = backup_database(db_file, tmp_path, pages, pause)
+        # O snapshot só aparece com o nome final quando está completo
+        os.replace(tmp_path, os.path.join(backup_dir, name))
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+    removed = prune_snapshots(backup_dir, snapshot_stem(db_file), keep)
+    return dict(stats, name=name, removed=removed)
+
+
+def prune_snapshots(backup_dir, stem, keep):
+    """Mantém apenas os `keep` snapshots mais recentes da base"""
+    removed = []
+    if keep <= 0:
+        return removed
+    for snapshot in list_snapshots(backup_dir, stem)[keep:]:
+        try:
+            os.remove(snapshot["path"])
+            removed.append(snapshot["name"])
+        except FileNotFoundError:
+            pass
+    return removed
+
+
+def restore_latest(db_file, backup_dir):
+    """Restaura o snapshot mais recente se `db_file` não existir
+
+    Retorna o nome do snapshot restaurado ou None.
+    """
+    if os.path.exists(db_file):
+        return None
+    snapshots = list_snapshots(backup_dir, snapshot_stem(db_file))
+    if not snapshots:
+        return None
+    folder = os.path.dirname(os.path.abspath(db_file))
+    os.makedirs(folder, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=folder, prefix='.restore-')
+    os.close(fd)
+    try:
+        shutil.copyfile(snapshots[0]["path"], tmp_path)
+        os.replace(tmp_path, db_file)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return snapshots[0]["name"]
+
+
+class BackupScheduler:
+    """Snapshots periódicos numa thread daemon
+
+    Com vários workers do gunicorn, apenas o que obtiver o lock de arquivo
+    em `backup_dir` agenda os snapshots.
+    """
+
+    def __init__(self, db_files_fn, backup_dir, interval, keep=7, pages=256, pause=0.005):
+        self.db_files_fn = db_files_fn
+        self.backup_dir = backup_dir
+        self.interval = interval
+        self.keep = keep
+        self.pages = pages
+        self.pause = pause
+        self.last_run = None
+        self.last_error = None
+        self._lock_file = None
+        self._stop = threading.Event()
+
+    def start(self):
+        if self.interval <= 0:
+            return False
+        os.makedirs(self.backup_dir, exist_ok=True)
+        if fcntl:
+            self._lock_file = open(os.path.join(self.backup_dir, '.scheduler.lock'), 'w')
+            try:
+                fcntl.flock(self._lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                self._lock_file.close()
+                self._lock_file = None
+                return False
+        threading.Thread(target=self._run, name='backup-scheduler', daemon=True).start()
+        return True
+
+    def run_once(self):
+        results = []
+        for db_file in self.db_files_fn():
+            if os.path.exists(db_file):
+                results.append(create_snapshot(db_file, self.backup_dir, self.keep, self.pages, self.pause))
+        self.last_run = datetime.now(timezone.utc).isoformat()
+        return results
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.run_once()
+                self.last_error = None
+            except Exception as e:
+                self.last_error = str(e)
+
+    def stop(self):
+        self._stop.set()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Backup online das bases SQLite")
+    parser.add_argument('command', choices=['snapshot', 'list', 'restore'])
+    parser.add_argument('--db', default=os.environ.get('DB_FILE', 'midias.db'))
+    parser.add_argument('--dir', default=os.environ.get('BACKUP_DIR', 'backups'))
+    parser.add_argument('--keep', type=int, default=int(os.environ.get('BACKUP_KEEP', 7)))
+    parser.add_argument('--pages', type=int, default=256, help="Páginas copiadas por passo")
+    parser.add_argument('--pause', type=float, default=0.005, help="Segundos entre os passos")
+    args = parser.parse_args()
+
+    if args.command == 'snapshot':
+        result = create_snapshot(args.db, args.dir, args.keep, args.pages, args.pause)
+    elif args.command == 'list':
+        result = list_snapshots(args.dir)
+    else:
+        result = {"restored": restore_latest(args.db, args.dir)}
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,353 @@
+"""Benchmark reprodutível dos caminhos principais da API
+
+Cria um ambiente isolado (base de dados + pasta de mídias temporárias),
+popula com uma biblioteca sintética e mede latência/vazão de cada cenário
+usando o test client do Flask ou um gunicorn local. O resultado é emitido
+em JSON para acompanhar regressões ao longo do tempo.
+
+Exemplos:
+    python benchmarks/bench_api.py --sizes 100 1000 10000
+    python benchmarks/bench_api.py --server gunicorn --workers 2 --concurrency 8
+    python benchmarks/bench_api.py --output bench_output.json
+"""
+import argparse
+import contextlib
+import http.client
+import io
+import json
+import os
+import platform
+import random
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from seed import seed_library  # noqa: E402
+
+SCENARIOS = ["list", "get_by_id", "favorite_toggle", "stats", "upload", "ranged_download"]
+
+
+# ============================================================
+# TRANSPORTES
+# ============================================================
+
+class FlaskTransport:
+    """Executa as requisições no processo usando o test client do Flask"""
+
+    name = "flask"
+
+    def __init__(self):
+        # O app lê DB_FILE/MEDIA_FOLDER do ambiente na importação
+        sys.path.insert(0, ROOT)
+        # Mensagens de inicialização do app não podem poluir o JSON no stdout
+        with contextlib.redirect_stdout(sys.stderr):
+            import app as app_module
+        self.app = app_module.app
+        self._local = threading.local()
+
+    def _client(self):
+        if not hasattr(self._local, 'client'):
+            self._local.client = self.app.test_client()
+        return self._local.client
+
+    def request(self, method, path, headers=None, body=None, content_type=None):
+        response = self._client().open(path, method=method, headers=headers or {},
+                                       data=body, content_type=content_type)
+        size = len(response.get_data())
+        response.close()
+        return response.status_code, size
+
+    def close(self):
+        pass
+
+
+class HttpTransport:
+    """Executa as requisições via HTTP com uma conexão keep-alive por thread"""
+
+    name = "http"
+
+    def __init__(self, host, port, process=None):
+        self.host = host
+        self.port = port
+        self.process = process
+        self._local = threading.local()
+
+    def _connection(self):
+        if not hasattr(self._local, 'conn'):
+            self._local.conn = http.client.HTTPConnection(self.host, self.port, timeout=60)
+        return self._local.conn
+
+    def request(self, method, path, headers=None, body=None, content_type=None):
+        headers = dict(headers or {})
+        if content_type:
+            headers['Content-Type'] = content_type
+        conn = self._connection()
+        try:
+            conn.request(method, path, body=body, headers=headers)
+            response = conn.getresponse()
+        except (http.client.HTTPException, OSError):
+            # Conexão descartada pelo servidor: reabre e tenta de novo
+            conn.close()
+            del self._local.conn
+            conn = self._connection()
+            conn.request(method, path, body=body, headers=headers)
+            response = conn.getresponse()
+        size = len(response.read())
+        return response.status, size
+
+    def close(self):
+        if self.process:
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def start_gunicorn(env, workers, threads):
+    """Sobe um gunicorn local apontando para o ambiente isolado"""
+    port = free_port()
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '--bind', f'127.0.0.1:{port}',
+         '--workers', str(workers), '--threads', str(threads), 'app:app'],
+        cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    transport = HttpTransport('127.0.0.1', port, process)
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            status, _ = transport.request('GET', '/test')
+            if status == 200:
+                return transport
+        except OSError:
+            pass
+        if process.poll() is not None:
+            break
+        time.sleep(0.2)
+    transport.close()
+    raise RuntimeError("gunicorn não respondeu em /test")
+
+
+# ============================================================
+# CENÁRIOS
+# ============================================================
+
+def multipart_body(fields, file_field, filename, payload):
+    """Monta um corpo multipart/form-data sem dependências externas"""
+    boundary = uuid.uuid4().hex
+    buf = io.BytesIO()
+    for key, value in fields.items():
+        buf.write(f'--{boundary}\r\nContent-Disposition: form-data; name="{key}"\r\n\r\n{value}\r\n'.encode())
+    buf.write(f'--{boundary}\r\nContent-Disposition: form-data; name="{file_field}"; '
+              f'filename="{filename}"\r\nContent-Type: application/octet-stream\r\n\r\n'.encode())
+    buf.write(payload)
+    buf.write(f'\r\n--{boundary}--\r\n'.encode())
+    return buf.getvalue(), f'multipart/form-data; boundary={boundary}'
+
+
+def build_scenarios(size, filenames, file_size, upload_size, rng):
+    """Retorna {nome: função que gera (method, path, headers, body, content_type)}"""
+    upload_payload = rng.randbytes(upload_size)
+    upload_body, upload_type = multipart_body(
+        {'name': 'Benchmark Upload', 'mimeType': 'audio/mpeg'}, 'file', 'bench.mp3', upload_payload
+    )
+    chunk = min(64 * 1024, file_size)
+
+    def random_id():
+        return rng.randint(1, size)
+
+    def ranged():
+        start = rng.randint(0, max(0, file_size - chunk))
+        return ('GET', f'/api/midias/media/{rng.choice(filenames)}',
+                {'Range': f'bytes={start}-{start + chunk - 1}'}, None, None)
+
+    return {
+        "list": lambda: ('GET', '/api/midias', None, None, None),
+        "get_by_id": lambda: ('GET', f'/api/midias/{random_id()}', None, None, None),
+        "favorite_toggle": lambda: ('POST', f'/api/midias/{random_id()}/favorite', None, None, None),
+        "stats": lambda: ('GET', '/api/stats', None, None, None),
+        "upload": lambda: ('POST', '/api/midias/upload', None, upload_body, upload_type),
+        "ranged_download": ranged,
+    }
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return None
+    k = (len(sorted_values) - 1) * pct / 100
+    lower = int(k)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (k - lower)
+
+
+def run_scenario(transport, make_request, requests_count, concurrency, warmup):
+    """Executa um cenário e devolve as métricas de latência (ms) e vazão"""
+    for _ in range(warmup):
+        transport.request(*make_request())
+
+    latencies = []
+    errors = 0
+    bytes_received = 0
+    lock = threading.Lock()
+
+    def one(_):
+        nonlocal errors, bytes_received
+        method, path, headers, body, content_type = make_request()
+        start = time.perf_counter()
+        try:
+            status, size = transport.request(method, path, headers, body, content_type)
+            ok = status < 400
+        except Exception:
+            size, ok = 0, False
+        elapsed = (time.perf_counter() - start) * 1000
+        with lock:
+            latencies.append(elapsed)
+            bytes_received += size
+            if not ok:
+                errors += 1
+
+    started = time.perf_counter()
+    if concurrency > 1:
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            list(pool.map(one, range(requests_count)))
+    else:
+        for i in range(requests_count):
+            one(i)
+    wall = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        "requests": requests_count,
+        "errors": errors,
+        "wall_seconds": round(wall, 4),
+        "throughput_rps": round(requests_count / wall, 2) if wall > 0 else None,
+        "bytes_received": bytes_received,
+        "latency_ms": {
+            "min": round(latencies[0], 3),
+            "mean": round(statistics.fmean(latencies), 3),
+            "p50": round(percentile(latencies, 50), 3),
+            "p90": round(percentile(latencies, 90), 3),
+            "p99": round(percentile(latencies, 99), 3),
+            "max": round(latencies[-1], 3),
+        },
+    }
+
+
+# ============================================================
+# EXECUÇÃO
+# ============================================================
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=ROOT,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except Exception:
+        return None
+
+
+def run(args):
+    rng = random.Random(args.seed)
+    workdir = tempfile.mkdtemp(prefix='midias-bench-')
+    results = []
+    try:
+        for size in args.sizes:
+            # Cada tamanho de biblioteca usa um ambiente novo
+            env_dir = os.path.join(workdir, f'lib-{size}')
+            os.makedirs(env_dir)
+            db_file = os.path.join(env_dir, 'midias.db')
+            media_folder = os.path.join(env_dir, 'media')
+            filenames = seed_library(db_file, media_folder, size, args.files, args.file_size, seed=args.seed)
+
+            # Sem controle de admissão: o benchmark mede a capacidade, não os limites
+            admission = os.environ.get('ADMISSION_CONTROL', '0')
+            env = dict(os.environ, DB_FILE=db_file, MEDIA_FOLDER=media_folder, ADMISSION_CONTROL=admission)
+            if args.server == 'gunicorn':
+                transport = start_gunicorn(env, args.workers, args.threads)
+            else:
+                os.environ.update(DB_FILE=db_file, MEDIA_FOLDER=media_folder, ADMISSION_CONTROL=admission)
+                sys.modules.pop('app', None)
+                transport = FlaskTransport()
+
+            try:
+                scenarios = build_scenarios(size, filenames, args.file_size, args.upload_size, rng)
+                for name in args.scenarios:
+                    metrics = run_scenario(transport, scenarios[name], args.requests,
+                                           args.concurrency, args.warmup)
+                    results.append(dict(scenario=name, library_size=size, **metrics))
+                    print(f"[{size:>8}] {name:<16} p50={metrics['latency_ms']['p50']:>9.3f}ms "
+                          f"rps={metrics['throughput_rps']}", file=sys.stderr)
+            finally:
+                transport.close()
+    finally:
+        if args.keep:
+            print(f"Ambiente mantido em {workdir}", file=sys.stderr)
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    return {
+        "meta": {
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "git_commit": git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "server": args.server,
+            "workers": args.workers if args.server == 'gunicorn' else None,
+            "threads": args.threads if args.server == 'gunicorn' else None,
+            "concurrency": args.concurrency,
+            "requests_per_scenario": args.requests,
+            "warmup": args.warmup,
+            "file_size": args.file_size,
+            "upload_size": args.upload_size,
+            "seed": args.seed,
+        },
+        "results": results,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark da API Mídia Player")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100, 1000],
+                        help="Tamanhos de biblioteca a testar")
+    parser.add_argument('--scenarios', nargs='+', default=SCENARIOS, choices=SCENARIOS)
+    parser.add_argument('--requests', type=int, default=200, help="Requisições por cenário")
+    parser.add_argument('--warmup', type=int, default=10)
+    parser.add_argument('--concurrency', type=int, default=1)
+    parser.add_argument('--server', choices=['flask', 'gunicorn'], default='flask')
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--threads', type=int, default=1)
+    parser.add_argument('--files', type=int, default=20, help="Arquivos reais de mídia")
+    parser.add_argument('--file-size', type=int, default=256 * 1024)
+    parser.add_argument('--upload-size', type=int, default=128 * 1024)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', help="Arquivo JSON de saída (padrão: stdout)")
+    parser.add_argument('--keep', action='store_true', help="Não apaga o ambiente temporário")
+    args = parser.parse_args()
+
+    report = run(args)
+    data = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(data + '\n')
+    else:
+        print(data)
+
+
+if __name__ == '__main__':
+    main()
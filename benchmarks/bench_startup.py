@@ -0,0 +1,149 @@
+"""Benchmark de cold start: da importação do app até a primeira resposta
+
+Cada medição roda num processo Python novo, comparando o modo padrão (Swagger
+montado na importação) com o modo SWAGGER_LAZY=1 (snapshot apispec.json).
+Mede também, em processo novo, o custo do primeiro acesso a /docs e, com
+--gunicorn, o tempo entre subir o gunicorn e o primeiro 200 em /test.
+
+Exemplos:
+    python benchmarks/bench_startup.py --runs 10
+    python benchmarks/bench_startup.py --gunicorn --output startup.json
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from bench_api import ROOT, HttpTransport, free_port, git_commit  # noqa: E402
+
+# Executado num processo novo; imprime as medições em JSON na última linha
+PROBE = r'''
+import json, sys, time
+t0 = time.perf_counter()
+sys.path.insert(0, {root!r})
+import app
+t1 = time.perf_counter()
+client = app.app.test_client()
+assert client.get('/test').status_code == 200
+t2 = time.perf_counter()
+result = {{"import_ms": (t1 - t0) * 1000, "first_response_ms": (t2 - t0) * 1000}}
+if {docs!r}:
+    t3 = time.perf_counter()
+    assert client.get('/docs').status_code == 200
+    result["first_docs_ms"] = (time.perf_counter() - t3) * 1000
+print(json.dumps(result))
+'''
+
+
+def summarize(values):
+    values = sorted(values)
+    return {
+        "min": round(values[0], 2),
+        "median": round(statistics.median(values), 2),
+        "mean": round(statistics.fmean(values), 2),
+        "max": round(values[-1], 2),
+    }
+
+
+def run_probe(env, docs):
+    output = subprocess.check_output(
+        [sys.executable, '-c', PROBE.format(root=ROOT, docs=docs)],
+        env=env, cwd=env['BENCH_WORKDIR'], stderr=subprocess.DEVNULL
+    )
+    return json.loads(output.decode().strip().splitlines()[-1])
+
+
+def run_gunicorn(env):
+    """Tempo entre iniciar o gunicorn e o primeiro 200 em /test (ms)"""
+    port = free_port()
+    started = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '--bind', f'127.0.0.1:{port}', '--workers', '1', 'app:app'],
+        cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    transport = HttpTransport('127.0.0.1', port, process)
+    try:
+        while time.perf_counter() - started < 30:
+            try:
+                if transport.request('GET', '/test')[0] == 200:
+                    return (time.perf_counter() - started) * 1000
+            except OSError:
+                time.sleep(0.005)
+        raise RuntimeError("gunicorn não respondeu em /test")
+    finally:
+        transport.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de cold start da API")
+    parser.add_argument('--runs', type=int, default=5, help="Processos por modo")
+    parser.add_argument('--gunicorn', action='store_true', help="Mede também o gunicorn")
+    parser.add_argument('--output', help="Arquivo JSON de saída (padrão: stdout)")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='midias-startup-')
+    try:
+        spec_file = os.path.join(workdir, 'apispec.json')
+        subprocess.check_call([sys.executable, os.path.join(ROOT, 'build_apispec.py'), '--output', spec_file],
+                              stdout=subprocess.DEVNULL)
+
+        base_env = dict(
+            os.environ,
+            BENCH_WORKDIR=workdir,
+            DB_FILE=os.path.join(workdir, 'midias.db'),
+            MEDIA_FOLDER=os.path.join(workdir, 'media'),
+            DEVICE_DB_FOLDER=os.path.join(workdir, 'devices'),
+            APISPEC_FILE=spec_file
+        )
+        modes = {
+            "eager": dict(base_env, SWAGGER_LAZY='0'),
+            "lazy": dict(base_env, SWAGGER_LAZY='1'),
+        }
+
+        results = []
+        for mode, env in modes.items():
+            samples = [run_probe(env, docs=False) for _ in range(args.runs)]
+            docs_samples = [run_probe(env, docs=True) for _ in range(args.runs)]
+            entry = {
+                "mode": mode,
+                "runs": args.runs,
+                "import_ms": summarize([s["import_ms"] for s in samples]),
+                "first_response_ms": summarize([s["first_response_ms"] for s in samples]),
+                "first_docs_ms": summarize([s["first_docs_ms"] for s in docs_samples]),
+            }
+            if args.gunicorn:
+                entry["gunicorn_first_response_ms"] = summarize([run_gunicorn(env) for _ in range(args.runs)])
+            results.append(entry)
+            print(f"{mode:<6} import->primeira resposta: mediana "
+                  f"{entry['first_response_ms']['median']:.1f} ms", file=sys.stderr)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        "meta": {
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "git_commit": git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+        },
+        "results": results,
+    }
+    data = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(data + '\n')
+    else:
+        print(data)
+
+
+if __name__ == '__main__':
+    main()
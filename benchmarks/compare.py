@@ -0,0 +1,60 @@
+"""Compara dois resultados do bench_api.py e aponta regressões
+
+Uso:
+    python benchmarks/compare.py baseline.json atual.json --threshold 0.15
+
+Sai com código 1 se algum cenário piorar o p50 (ou a vazão) além do limite.
+"""
+import argparse
+import json
+import sys
+
+
+def index_results(report):
+    return {(r['scenario'], r['library_size']): r for r in report['results']}
+
+
+def compare(baseline, current, threshold):
+    """Retorna a lista de linhas comparadas e se houve regressão"""
+    base = index_results(baseline)
+    rows = []
+    regressed = False
+    for key, cur in sorted(index_results(current).items()):
+        old = base.get(key)
+        if not old:
+            continue
+        p50_delta = (cur['latency_ms']['p50'] - old['latency_ms']['p50']) / old['latency_ms']['p50']
+        rps_delta = None
+        if old.get('throughput_rps') and cur.get('throughput_rps'):
+            rps_delta = (cur['throughput_rps'] - old['throughput_rps']) / old['throughput_rps']
+        bad = p50_delta > threshold or (rps_delta is not None and rps_delta < -threshold)
+        regressed = regressed or bad
+        rows.append((key, old['latency_ms']['p50'], cur['latency_ms']['p50'], p50_delta, rps_delta, bad))
+    return rows, regressed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compara resultados de benchmark")
+    parser.add_argument('baseline')
+    parser.add_argument('current')
+    parser.add_argument('--threshold', type=float, default=0.15,
+                        help="Piora relativa tolerada (0.15 = 15%%)")
+    args = parser.parse_args()
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.current) as f:
+        current = json.load(f)
+
+    rows, regressed = compare(baseline, current, args.threshold)
+    for (scenario, size), old_p50, new_p50, p50_delta, rps_delta, bad in rows:
+        rps = f"{rps_delta:+.1%}" if rps_delta is not None else "n/a"
+        flag = "REGRESSÃO" if bad else "ok"
+        print(f"{scenario:<16} {size:>8}  p50 {old_p50:>9.3f} -> {new_p50:>9.3f} ms "
+              f"({p50_delta:+.1%})  rps {rps:>8}  {flag}")
+
+    sys.exit(1 if regressed else 0)
+
+
+if __name__ == '__main__':
+    main()
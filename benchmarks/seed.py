@@ -0,0 +1,113 @@
+"""Popula uma base de dados com uma biblioteca sintética para os benchmarks"""
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import uuid
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from media_layout import prepare_shard_path  # noqa: E402
+
+MIME_TYPES = [
+    ("audio/mpeg", ".mp3"),
+    ("audio/m4a", ".m4a"),
+    ("video/mp4", ".mp4"),
+]
+
+CREATE_TABLE = '''
+    CREATE TABLE IF NOT EXISTS midias (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name TEXT NOT NULL,
+        uri TEXT NOT NULL,
+        mimeType TEXT NOT NULL,
+        cover TEXT,
+        isFavorite INTEGER DEFAULT 0,
+        duration INTEGER DEFAULT 0,
+        fileSize INTEGER DEFAULT 0,
+        dateAdded TEXT DEFAULT (datetime('now')),
+        lastAccessed TEXT DEFAULT (datetime('now')),
+        deviceId TEXT,
+        deviceName TEXT
+    )
+'''
+
+
+def create_media_files(media_folder, count, file_size, rng):
+    """Cria `count` arquivos de mídia sintéticos e retorna (filename, mimeType, tamanho)"""
+    os.makedirs(media_folder, exist_ok=True)
+    files = []
+    for _ in range(count):
+        mime_type, ext = rng.choice(MIME_TYPES)
+        filename = str(uuid.uuid4()) + ext
+        with open(prepare_shard_path(media_folder, filename), 'wb') as f:
+            f.write(rng.randbytes(file_size))
+        files.append((filename, mime_type, file_size))
+    return files
+
+
+def seed_library(db_file, media_folder, size, file_count=20, file_size=256 * 1024,
+                 devices=4, favorite_ratio=0.2, seed=42):
+    """Insere `size` mídias sintéticas apontando para um conjunto de arquivos reais
+
+    As linhas reutilizam os mesmos `file_count` arquivos para que bibliotecas
+    grandes não ocupem o disco inteiro. Retorna a lista de filenames criados.
+    """
+    rng = random.Random(seed)
+    files = create_media_files(media_folder, file_count, file_size, rng)
+
+    conn = sqlite3.connect(db_file)
+    cursor = conn.cursor()
+    cursor.execute(CREATE_TABLE)
+
+    start = datetime(2024, 1, 1)
+
+    def rows():
+        for i in range(size):
+            filename, mime_type, length = files[i % len(files)]
+            device = i % devices if devices else None
+            added = start + timedelta(seconds=rng.randint(0, 365 * 24 * 3600))
+            added = added.strftime('%Y-%m-%d %H:%M:%S')
+            yield (
+                f"Faixa {i:07d}",
+                f"/api/midias/media/{filename}",
+                mime_type,
+                1 if rng.random() < favorite_ratio else 0,
+                rng.randint(30, 600),
+                length,
+                added,
+                added,
+                f"device-{device}" if device is not None else None,
+                f"Dispositivo {device}" if device is not None else None,
+            )
+
+    # Insere tudo numa única transação
+    cursor.executemany('''
+        INSERT INTO midias (name, uri, mimeType, isFavorite, duration, fileSize,
+                            dateAdded, lastAccessed, deviceId, deviceName)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ''', rows())
+
+    conn.commit()
+    conn.close()
+    return [f[0] for f in files]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Popula midias.db com dados sintéticos")
+    parser.add_argument('--db', default=os.environ.get('DB_FILE', 'midias.db'))
+    parser.add_argument('--media-folder', default=os.environ.get('MEDIA_FOLDER', 'media'))
+    parser.add_argument('--size', type=int, default=1000, help="Número de mídias")
+    parser.add_argument('--files', type=int, default=20, help="Número de arquivos reais")
+    parser.add_argument('--file-size', type=int, default=256 * 1024, help="Bytes por arquivo")
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    seed_library(args.db, args.media_folder, args.size, args.files, args.file_size, seed=args.seed)
+    print(f"{args.size} mídias inseridas em {args.db}")
+
+
+if __name__ == '__main__':
+    main()
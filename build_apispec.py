@@ -0,0 +1,64 @@
+"""Gera o snapshot apispec.json usado pelo modo SWAGGER_LAZY=1
+
+Roda no build (ver render.yaml): importa o app com o Swagger completo,
+numa base temporária, e grava a especificação OpenAPI já renderizada.
+
+Uso:
+    python build_apispec.py [--output apispec.json]
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+
+def build_spec():
+    """Retorna a especificação OpenAPI gerada pelo flasgger"""
+    workdir = tempfile.mkdtemp(prefix='apispec-')
+    try:
+        # O build roda com o ambiente de produção: toda base, pasta de dados e
+        # backend remoto é trocado por um descartável, para que o import do app
+        # (create_schema, migração de URIs, restore dos snapshots) não toque
+        # nos dados reais
+        os.environ.update(
+            SWAGGER_LAZY='0',
+            DATABASE_URL='',
+            DB_FILE=os.path.join(workdir, 'midias.db'),
+            MEDIA_FOLDER=os.path.join(workdir, 'media'),
+            DEVICE_DB_FOLDER=os.path.join(workdir, 'devices'),
+            DEDICATED_DEVICES='',
+            BACKUP_DIR=os.path.join(workdir, 'backups'),
+            BACKUP_INTERVAL_MINUTES='0',
+            WAVEFORM_FOLDER=os.path.join(workdir, 'waveforms'),
+            WAVEFORM_ON_UPLOAD='0',
+            STORAGE_BACKEND='local',
+            MEDIA_SHARD_MIGRATION='0'
+        )
+        sys.path.insert(0, ROOT)
+        import app as app_module
+
+        response = app_module.app.test_client().get(app_module.swagger_config['specs'][0]['route'])
+        if response.status_code != 200:
+            raise RuntimeError(f"Falha ao gerar a especificação: HTTP {response.status_code}")
+        return response.get_json()
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Gera o snapshot apispec.json")
+    parser.add_argument('--output', default=os.path.join(ROOT, 'apispec.json'))
+    args = parser.parse_args()
+
+    spec = build_spec()
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(spec, f, ensure_ascii=False, separators=(',', ':'), sort_keys=True)
+    print(f"{len(spec.get('paths', {}))} rotas gravadas em {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,268 @@
+"""Eventos de alteração da biblioteca para o stream SSE (/api/events)
+
+Cada alteração (mídia criada, editada, removida, favorito) vira uma linha
+da tabela `midia_events` da mesma base em que a alteração foi gravada (a
+principal ou a base dedicada do dispositivo, identificadas pelo número do
+shard), para o evento não disputar o lock de escrita de outra base. O id
+do evento SSE é o cursor com a última linha lida de cada base
+(`0:120,1:35`), então qualquer worker do gunicorn vê os eventos de todos os
+outros e o cliente retoma do ponto certo com `Last-Event-ID`.
+
+Em cada worker, uma única thread (`EventHub`) acompanha as tabelas: a cada
+`poll_interval` ela confere `PRAGMA data_version` de cada base (que só muda
+quando outra conexão grava nela) e, se mudou, lê os eventos novos para um
+buffer em memória e acorda os assinantes. Assim o custo de N clientes
+ociosos é uma consulta barata por base e por worker, não uma por cliente.
+"""
+import collections
+import json
+import sqlite3
+import threading
+import time
+
+EVENTS_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS midia_events (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        type TEXT NOT NULL,
+        midiaId INTEGER,
+        deviceId TEXT,
+        payload TEXT,
+        createdAt TEXT DEFAULT (datetime('now'))
+    )
+'''
+
+
+def create_events_schema(cursor):
+    cursor.execute(EVENTS_SCHEMA)
+
+
+def record_event(db_file, event_type, midia_id=None, device_id=None, payload=None):
+    """Grava um evento e retorna o id"""
+    conn = sqlite3.connect(db_file)
+    try:
+        cursor = conn.cursor()
+        cursor.execute(
+            'INSERT INTO midia_events (type, midiaId, deviceId, payload) VALUES (?, ?, ?, ?)',
+            (event_type, midia_id, device_id, json.dumps(payload or {}, ensure_ascii=False))
+        )
+        conn.commit()
+        return cursor.lastrowid
+    finally:
+        conn.close()
+
+
+def row_to_event(row, shard=0):
+    return {
+        "id": row[0],
+        "shard": shard,
+        "type": row[1],
+        "midiaId": row[2],
+        "deviceId": row[3],
+        "data": json.loads(row[4]) if row[4] else {},
+        "createdAt": row[5],
+    }
+
+
+def read_events(conn, after_id, limit, shard=0):
+    cursor = conn.execute(
+        'SELECT id, type, midiaId, deviceId, payload, createdAt FROM midia_events '
+        'WHERE id > ? ORDER BY id LIMIT ?', (after_id, limit)
+    )
+    return [row_to_event(row, shard) for row in cursor.fetchall()]
+
+
+def format_cursor(cursor):
+    """{shard: último id} -> '0:120,1:35' (id do evento SSE)"""
+    return ','.join(f"{shard}:{last_id}" for shard, last_id in sorted(cursor.items()))
+
+
+def parse_cursor(value):
+    """'0:120,1:35' -> {shard: último id}; levanta ValueError se inválido"""
+    cursor = {}
+    for part in value.split(','):
+        shard, _, last_id = part.partition(':')
+        cursor[int(shard)] = int(last_id)
+    return cursor
+
+
+def format_sse(event, cursor):
+    """Serializa um evento no formato text/event-stream"""
+    data = dict(event["data"], midiaId=event["midiaId"], deviceId=event["deviceId"],
+                createdAt=event["createdAt"])
+    return (f"id: {format_cursor(cursor)}\nevent: {event['type']}\n"
+            f"data: {json.dumps(data, ensure_ascii=False)}\n\n")
+
+
+class EventHub:
+    """Acompanha `midia_events` de cada base e distribui os eventos novos
+
+    `sources()` retorna `{shard: arquivo da base}` e é consultado a cada
+    ciclo, então bases dedicadas criadas depois do início entram sozinhas.
+    """
+
+    def __init__(self, sources, poll_interval=0.5, backlog=1000, retention=10000):
+        self.sources = sources
+        self.poll_interval = poll_interval
+        self.backlog = backlog
+        self.retention = retention
+        self.last_ids = {}
+        self.subscribers = 0
+        self._recent = {}
+        self._pruned = {}
+        self._cond = threading.Condition()
+        self._thread = None
+        self.stats = {"polls": 0, "reads": 0, "events": 0, "pruned": 0}
+
+    def start(self):
+        if self._thread is not None:
+            return
+        # Eventos anteriores ao início não vão para o buffer
+        for shard, db_file in self.sources().items():
+            conn = sqlite3.connect(db_file)
+            try:
+                row = conn.execute('SELECT MAX(id) FROM midia_events').fetchone()
+            finally:
+                conn.close()
+            self.last_ids[shard] = row[0] or 0
+            self._recent[shard] = collections.deque(maxlen=self.backlog)
+        self._thread = threading.Thread(target=self._run, name='event-hub', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        conns = {}
+        data_versions = {}
+        last_prune = 0
+        while True:
+            time.sleep(self.poll_interval)
+            self.stats["polls"] += 1
+            prune = self.retention and time.monotonic() - last_prune > 60
+            if prune:
+                last_prune = time.monotonic()
+            for shard, db_file in self.sources().items():
+                try:
+                    conn = conns.get(shard)
+                    if conn is None:
+                        conn = conns[shard] = sqlite3.connect(db_file, check_same_thread=False)
+                    version = conn.execute('PRAGMA data_version').fetchone()[0]
+                    if version != data_versions.get(shard):
+                        data_versions[shard] = version
+                        self._read_new(conn, shard)
+                    if prune:
+                        self._prune(conn, shard)
+                except sqlite3.Error as e:
+                    print(f"Erro ao ler eventos da base {db_file}: {e}")
+
+    def _read_new(self, conn, shard):
+        while True:
+            events = read_events(conn, self.last_ids.get(shard, 0), self.backlog, shard)
+            self.stats["reads"] += 1
+            if not events:
+                return
+            with self._cond:
+                self._recent.setdefault(shard, collections.deque(maxlen=self.backlog)).extend(events)
+                self.last_ids[shard] = events[-1]["id"]
+                self.stats["events"] += len(events)
+                self._cond.notify_all()
+            if len(events) < self.backlog:
+                return
+
+    def _prune(self, conn, shard):
+        """Remove os eventos além da retenção, só quando o limite avançou
+
+        Todos os workers acompanham as mesmas bases: o primeiro a ver o
+        limite novo apaga; os outros encontram `MIN(id)` já acima dele e
+        não disputam o lock de escrita com um DELETE vazio.
+        """
+        threshold = self.last_ids.get(shard, 0) - self.retention
+        if threshold <= self._pruned.get(shard, 0):
+            return
+        oldest = conn.execute('SELECT MIN(id) FROM midia_events').fetchone()[0]
+        if oldest is not None and oldest <= threshold:
+            cursor = conn.execute('DELETE FROM midia_events WHERE id <= ?', (threshold,))
+            conn.commit()
+            self.stats["pruned"] += cursor.rowcount
+        self._pruned[shard] = threshold
+
+    def current_cursor(self):
+        with self._cond:
+            return dict(self.last_ids)
+
+    def cursor_from(self, value):
+        """Cursor a partir do Last-Event-ID (None = a partir de agora)
+
+        Um id numérico simples (formato anterior) vale para a base principal;
+        nas demais, o cliente continua do ponto atual.
+        """
+        if not value:
+            return self.current_cursor()
+        if value.isdigit():
+            cursor = self.current_cursor()
+            cursor[0] = int(value)
+            return cursor
+        return parse_cursor(value)
+
+    def _pending_shards(self, cursor):
+        return [shard for shard, last_id in self.last_ids.items() if last_id > cursor.get(shard, 0)]
+
+    def events_after(self, cursor):
+        """Eventos posteriores ao cursor: do buffer ou, se ficaram para trás, da base
+
+        Retorna None se eventos intermediários já foram removidos pela
+        retenção (o cliente deve recarregar a biblioteca).
+        """
+        events = []
+        behind = []
+        with self._cond:
+            for shard in self._pending_shards(cursor):
+                after_id = cursor.get(shard, 0)
+                recent = self._recent.get(shard)
+                if recent and recent[0]["id"] <= after_id + 1:
+                    events.extend(e for e in recent if e["id"] > after_id)
+                else:
+                    behind.append(shard)
+
+        sources = self.sources()
+        for shard in behind:
+            conn = sqlite3.connect(sources[shard])
+            try:
+                after_id = cursor.get(shard, 0)
+                oldest = conn.execute('SELECT MIN(id) FROM midia_events').fetchone()[0]
+                if oldest is None or oldest > after_id + 1:
+                    return None
+                events.extend(read_events(conn, after_id, self.backlog, shard))
+            finally:
+                conn.close()
+        events.sort(key=lambda e: (e["createdAt"] or '', e["shard"], e["id"]))
+        return events
+
+    def wait(self, cursor, timeout):
+        """Bloqueia até existir evento posterior ao cursor ou o timeout expirar"""
+        with self._cond:
+            return self._cond.wait_for(lambda: self._pending_shards(cursor), timeout)
+
+    def stream(self, cursor=None, device_id=None, heartbeat=15.0, max_duration=300.0, retry_ms=3000):
+        """Gerador text/event-stream de um assinante"""
+        cursor = dict(self.current_cursor() if cursor is None else cursor)
+        deadline = time.monotonic() + max_duration
+        with self._cond:
+            self.subscribers += 1
+        try:
+            yield f"retry: {retry_ms}\n\n"
+            while time.monotonic() < deadline:
+                events = self.events_after(cursor)
+                if events is None:
+                    # Lacuna maior que a retenção: o cliente refaz a carga completa
+                    cursor = self.current_cursor()
+                    yield f"id: {format_cursor(cursor)}\nevent: reset\ndata: {{}}\n\n"
+                    continue
+                for event in events:
+                    cursor[event["shard"]] = max(cursor.get(event["shard"], 0), event["id"])
+                    if device_id and event["deviceId"] not in (device_id, None):
+                        continue
+                    yield format_sse(event, cursor)
+                if not events and not self.wait(cursor, min(heartbeat, max(deadline - time.monotonic(), 0))):
+                    # Comentário SSE mantém a conexão viva em proxies
+                    yield ": ping\n\n"
+        finally:
+            with self._cond:
+                self.subscribers -= 1
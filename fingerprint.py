@@ -0,0 +1,255 @@
+"""Impressão digital do áudio, ignorando as tags de metadados
+
+Um hash do arquivo inteiro muda quando só as tags mudam: o mesmo MP3 com
+outro cabeçalho ID3 (ex.: reescrito pelo Lavf) parece outro arquivo. Aqui o
+hash (SHA-256) cobre apenas o áudio comprimido:
+
+- MP3: descarta tags ID3v2 no início (e lixo até o primeiro frame) e a tag
+  ID3v1 de 128 bytes no fim;
+- MP4/M4A: apenas o conteúdo das caixas `mdat` (`moov`, com o `ilst` das
+  tags, e as demais caixas são ignoradas);
+- FLAC: descarta os blocos de metadados (VORBIS_COMMENT, PICTURE...);
+- WAV: apenas o chunk `data`;
+- outros formatos: o arquivo inteiro.
+
+A leitura é sequencial, em blocos, então serve para um upload em andamento
+ou para um objeto remoto sem baixá-lo para o disco.
+
+Uso:
+    python fingerprint.py uploads/*.mp3
+    python fingerprint.py --backfill --db midias.db --media-folder media
+"""
+import argparse
+import hashlib
+import json
+import os
+
+from database import library_stores
+from media_layout import resolve_media_path
+from reclaim import media_filename
+
+CHUNK_SIZE = 256 * 1024
+ID3V1_SIZE = 128
+# Quanto procurar pelo primeiro frame MPEG depois das tags
+MAX_SYNC_SEARCH = 64 * 1024
+
+
+class SequentialReader:
+    """Leitura sequencial com read exato e skip"""
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.pending = b''
+
+    def read(self, n):
+        parts = [self.pending[:n]]
+        self.pending = self.pending[n:]
+        missing = n - len(parts[0])
+        while missing > 0:
+            data = self.stream.read(max(missing, CHUNK_SIZE))
+            if not data:
+                break
+            parts.append(data[:missing])
+            self.pending = data[missing:]
+            missing -= len(parts[-1])
+        return b''.join(parts)
+
+    def unread(self, data):
+        self.pending = data + self.pending
+
+    def skip(self, n):
+        while n > 0:
+            data = self.read(min(n, CHUNK_SIZE))
+            if not data:
+                break
+            n -= len(data)
+
+    def chunks(self, limit=None):
+        """Blocos até `limit` bytes (ou até o fim)"""
+        while limit is None or limit > 0:
+            data = self.read(CHUNK_SIZE if limit is None else min(CHUNK_SIZE, limit))
+            if not data:
+                break
+            if limit is not None:
+                limit -= len(data)
+            yield data
+
+
+def _syncsafe(data):
+    return (data[0] << 21) | (data[1] << 14) | (data[2] << 7) | data[3]
+
+
+def skip_id3v2(reader):
+    """Descarta as tags ID3v2 do início (pode haver mais de uma)"""
+    while True:
+        header = reader.read(10)
+        if len(header) == 10 and header[:3] == b'ID3':
+            size = _syncsafe(header[6:10])
+            if header[5] & 0x10:  # rodapé
+                size += 10
+            reader.skip(size)
+        else:
+            reader.unread(header)
+            return
+
+
+def find_frame_sync(data):
+    for i in range(len(data) - 1):
+        if data[i] == 0xFF and data[i + 1] & 0xE0 == 0xE0:
+            return i
+    return -1
+
+
+def _hash_mp3(reader, digest):
+    head = reader.read(MAX_SYNC_SEARCH)
+    start = find_frame_sync(head)
+    if start == -1:
+        return False
+    # Os últimos 128 bytes só entram no hash se não forem uma tag ID3v1; num
+    # arquivo menor que MAX_SYNC_SEARCH eles ainda estão em `head`
+    pending = head[start:]
+    for chunk in reader.chunks():
+        pending += chunk
+        if len(pending) > ID3V1_SIZE:
+            digest.update(pending[:-ID3V1_SIZE])
+            pending = pending[-ID3V1_SIZE:]
+    if len(pending) >= ID3V1_SIZE and pending[-ID3V1_SIZE:].startswith(b'TAG'):
+        pending = pending[:-ID3V1_SIZE]
+    digest.update(pending)
+    return True
+
+
+def _hash_mp4(reader, digest):
+    found = False
+    while True:
+        header = reader.read(8)
+        if len(header) < 8:
+            return found
+        size = int.from_bytes(header[:4], 'big')
+        box_type = header[4:8]
+        header_size = 8
+        if size == 1:
+            size = int.from_bytes(reader.read(8), 'big')
+            header_size = 16
+        body = None if size == 0 else size - header_size
+        if body is not None and body < 0:
+            return found
+        if box_type == b'mdat':
+            found = True
+            for chunk in reader.chunks(body):
+                digest.update(chunk)
+        elif body is None:
+            return found
+        else:
+            reader.skip(body)
+
+
+def _hash_flac(reader, digest):
+    reader.skip(4)  # fLaC
+    while True:
+        header = reader.read(4)
+        if len(header) < 4:
+            return False
+        reader.skip(int.from_bytes(header[1:4], 'big'))
+        if header[0] & 0x80:  # último bloco de metadados
+            break
+    for chunk in reader.chunks():
+        digest.update(chunk)
+    return True
+
+
+def _hash_wav(reader, digest):
+    reader.skip(12)  # RIFF <tamanho> WAVE
+    while True:
+        header = reader.read(8)
+        if len(header) < 8:
+            return False
+        size = int.from_bytes(header[4:8], 'little')
+        if header[:4] == b'data':
+            for chunk in reader.chunks(size):
+                digest.update(chunk)
+            return True
+        reader.skip(size + (size & 1))
+
+
+def detect_format(head):
+    """Formato pelo início do arquivo (depois das tags ID3v2)"""
+    if head[4:8] == b'ftyp':
+        return 'mp4'
+    if head[:4] == b'fLaC':
+        return 'flac'
+    if head[:4] == b'RIFF' and head[8:12] == b'WAVE':
+        return 'wav'
+    if find_frame_sync(head[:4]) == 0:
+        return 'mp3'
+    return None
+
+
+def audio_fingerprint(stream):
+    """SHA-256 (hex) do áudio de `stream`, sem tags; None se não houver áudio"""
+    reader = SequentialReader(stream)
+    first = reader.read(3)
+    reader.unread(first)
+    skip_id3v2(reader)
+    head = reader.read(12)
+    reader.unread(head)
+
+    kind = detect_format(head)
+    if kind is None and first == b'ID3':
+        # Tag ID3 seguida de padding ou lixo: procura o primeiro frame MPEG
+        kind = 'mp3'
+    digest = hashlib.sha256()
+    hashers = {'mp3': _hash_mp3, 'mp4': _hash_mp4, 'flac': _hash_flac, 'wav': _hash_wav}
+    if kind in hashers:
+        return digest.hexdigest() if hashers[kind](reader, digest) else None
+
+    empty = True
+    for chunk in reader.chunks():
+        empty = False
+        digest.update(chunk)
+    return None if empty else digest.hexdigest()
+
+
+def file_fingerprint(path):
+    with open(path, 'rb') as f:
+        return audio_fingerprint(f)
+
+
+def backfill(stores, media_folder):
+    """Calcula a impressão digital das mídias locais que ainda não têm
+
+    `stores` são os MidiaStore da biblioteca (ver `database.library_stores`).
+    """
+    report = {"updated": 0, "missing": 0}
+    for store in stores:
+        for midia_id, uri in store.missing_fingerprints():
+            filename = media_filename(uri)
+            path = resolve_media_path(media_folder, filename) if filename else None
+            if not path or not os.path.exists(path):
+                report["missing"] += 1
+                continue
+            store.set_fingerprint(midia_id, file_fingerprint(path))
+            report["updated"] += 1
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Impressão digital do áudio, ignorando tags")
+    parser.add_argument('files', nargs='*', help="Arquivos para calcular a impressão digital")
+    parser.add_argument('--backfill', action='store_true', help="Preenche a coluna audioFingerprint")
+    parser.add_argument('--db', default=os.environ.get('DB_FILE', 'midias.db'))
+    parser.add_argument('--media-folder', default=os.environ.get('MEDIA_FOLDER', 'media'))
+    parser.add_argument('--device-db-folder', default=os.environ.get('DEVICE_DB_FOLDER', 'devices'))
+    parser.add_argument('--database-url', default=os.environ.get('DATABASE_URL', ''),
+                        help="Servidor com a tabela de mídias (como no app)")
+    args = parser.parse_args()
+
+    if args.backfill:
+        stores = library_stores(args.db, args.device_db_folder, args.database_url)
+        print(json.dumps(backfill(stores, args.media_folder), indent=2))
+    for path in args.files:
+        print(f"{file_fingerprint(path)}  {path}")
+
+
+if __name__ == '__main__':
+    main()
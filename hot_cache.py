@@ -0,0 +1,322 @@
+"""Cache em memória dos arquivos de mídia mais tocados
+
+Poucas faixas concentram a maior parte do tráfego de `serve_media`. Este
+cache guarda, dentro de um orçamento de bytes, um mmap do arquivo (disco
+local: as páginas são as do page cache, sem cópia extra) ou o conteúdo em
+memória (backend remoto: evita uma ida ao S3 por requisição). Ranges são
+servidos direto do buffer, sem abrir nem posicionar o arquivo.
+
+- Admissão: um arquivo entra depois de `admit_after` pedidos (contagem
+  aproximada e envelhecida), para que downloads únicos não expulsem as
+  faixas populares.
+- Despejo: entre os `sample` itens usados há mais tempo (LRU), sai o de
+  menor frequência (LFU); se ele for mais popular que o candidato, o
+  candidato não entra.
+- Aquecimento: `warm()` pede readahead ao kernel (`posix_fadvise`
+  WILLNEED) ou, no backend remoto, pré-carrega o objeto em segundo plano,
+  por exemplo para o próximo item de uma playlist.
+- Validade: itens locais são conferidos pelo stat do arquivo a cada
+  acerto; itens remotos valem por `remote_ttl` segundos (outro worker pode
+  ter removido ou trocado o objeto). `invalidate()` descarta na hora.
+
+`get()` e `admit_*()` devolvem o item com uma reserva de leitura, liberada
+quando o corpo da resposta (`chunks()`) é fechado; o mmap de um item
+despejado só é fechado quando a última leitura em andamento termina.
+"""
+import collections
+import mmap
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+CHUNK_SIZE = 256 * 1024
+
+
+class CachedMedia:
+    """Conteúdo de um arquivo em cache (mmap ou bytes)"""
+
+    __slots__ = ('filename', 'data', 'size', 'path', 'stat_key', 'mtime', 'expires', 'hits',
+                 'readers', 'retired', 'closed', '_lock')
+
+    def __init__(self, filename, data, size, path=None, stat_key=None, mtime=None, expires=None):
+        self.filename = filename
+        self.data = data
+        self.size = size
+        self.path = path
+        self.stat_key = stat_key
+        self.mtime = mtime
+        self.expires = expires
+        self.hits = 0
+        self.readers = 0
+        self.retired = False
+        self.closed = False
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Reserva o buffer para uma leitura; False se já foi fechado"""
+        with self._lock:
+            if self.closed:
+                return False
+            self.readers += 1
+            return True
+
+    def release(self):
+        with self._lock:
+            self.readers -= 1
+            if self.retired and self.readers == 0:
+                self._close()
+
+    def retire(self):
+        """Saiu do cache: fecha agora ou quando terminar a última leitura"""
+        with self._lock:
+            self.retired = True
+            if self.readers == 0:
+                self._close()
+
+    def _close(self):
+        if not self.closed:
+            self.closed = True
+            if isinstance(self.data, mmap.mmap):
+                self.data.close()
+
+    def chunks(self, start=0, stop=None):
+        """Blocos do intervalo [start, stop); consome a reserva de get()/admit_*()"""
+        return _LeasedChunks(self, start, self.size if stop is None else stop)
+
+
+class _LeasedChunks:
+    """Corpo da resposta que libera a reserva do item ao terminar ou ser fechado"""
+
+    def __init__(self, entry, start, stop):
+        self.entry = entry
+        self.start = start
+        self.stop = stop
+        self._released = False
+
+    def __iter__(self):
+        data = self.entry.data
+        try:
+            for offset in range(self.start, self.stop, CHUNK_SIZE):
+                yield data[offset:min(offset + CHUNK_SIZE, self.stop)]
+        finally:
+            self.close()
+
+    def close(self):
+        if not self._released:
+            self._released = True
+            self.entry.release()
+
+
+def _stat_key(path):
+    st = os.stat(path)
+    return st.st_size, st.st_mtime_ns
+
+
+class HotMediaCache:
+    """Cache LFU/LRU por orçamento de bytes"""
+
+    def __init__(self, budget_bytes, max_object_bytes, admit_after=2, sample=8,
+                 track_max=10000, decay_every=10000, remote_ttl=60):
+        self.budget = budget_bytes
+        self.remote_ttl = remote_ttl
+        self.max_object = max_object_bytes
+        self.admit_after = admit_after
+        self.sample = sample
+        self.track_max = track_max
+        self.decay_every = decay_every
+        self.used = 0
+        self._entries = collections.OrderedDict()
+        self._freq = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._prefetch = ThreadPoolExecutor(max_workers=1, thread_name_prefix='media-prefetch')
+        self._lookups_since_decay = 0
+        self.stats = {
+            "hits": 0, "misses": 0, "bytes_hit": 0, "admitted": 0, "rejected": 0,
+            "evicted": 0, "invalidated": 0, "expired": 0, "warmed": 0, "prefetched": 0,
+        }
+
+    @property
+    def enabled(self):
+        return self.budget > 0
+
+    def _touch_freq(self, filename, amount=1):
+        count = self._freq.pop(filename, 0) + amount
+        self._freq[filename] = count
+        if len(self._freq) > self.track_max:
+            self._freq.popitem(last=False)
+        self._lookups_since_decay += 1
+        if self._lookups_since_decay >= self.decay_every:
+            # Envelhecimento: popularidade antiga perde peso
+            self._lookups_since_decay = 0
+            for name in list(self._freq):
+                self._freq[name] //= 2
+                if not self._freq[name]:
+                    del self._freq[name]
+        return count
+
+    def get(self, filename):
+        """Item em cache, já reservado para leitura (conta acerto/erro), ou None"""
+        if not self.enabled:
+            return None
+        with self._lock:
+            self._touch_freq(filename)
+            entry = self._entries.get(filename)
+            if entry is None or not entry.acquire():
+                self.stats["misses"] += 1
+                return None
+        if entry.path is not None:
+            # Arquivo local substituído ou removido: descarta o mapeamento antigo
+            try:
+                valid = _stat_key(entry.path) == entry.stat_key
+            except OSError:
+                valid = False
+            outcome = "invalidated"
+        else:
+            # Objeto remoto: sem como conferir a cada acerto, vale até expirar
+            valid = entry.expires is None or time.monotonic() < entry.expires
+            outcome = "expired"
+        if not valid:
+            entry.release()
+            self._discard(entry, outcome)
+            with self._lock:
+                self.stats["misses"] += 1
+            return None
+        with self._lock:
+            if filename in self._entries:
+                self._entries.move_to_end(filename)
+            entry.hits += 1
+            self.stats["hits"] += 1
+        return entry
+
+    def record_bytes(self, nbytes):
+        with self._lock:
+            self.stats["bytes_hit"] += nbytes
+
+    def should_admit(self, filename):
+        """O arquivo já foi pedido vezes suficientes para entrar no cache"""
+        if not self.enabled:
+            return False
+        with self._lock:
+            return self._freq.get(filename, 0) >= self.admit_after
+
+    def fits(self, size):
+        return size is not None and 0 < size <= min(self.max_object, self.budget)
+
+    def admit_file(self, filename, path):
+        """Mapeia um arquivo local e tenta colocá-lo no cache"""
+        with open(path, 'rb') as f:
+            st = os.fstat(f.fileno())
+            if not self.fits(st.st_size):
+                return None
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        entry = CachedMedia(filename, data, st.st_size, os.path.abspath(path),
+                            (st.st_size, st.st_mtime_ns), st.st_mtime)
+        cached = self._insert(entry)
+        if cached is not entry:
+            # Recusado, ou outro pedido mapeou o arquivo antes
+            entry.retire()
+        return cached
+
+    def admit_bytes(self, filename, data):
+        if not self.fits(len(data)):
+            return None
+        expires = time.monotonic() + self.remote_ttl if self.remote_ttl else None
+        return self._insert(CachedMedia(filename, data, len(data), expires=expires))
+
+    def _insert(self, entry):
+        """Coloca no cache e devolve o item reservado para leitura (ou None)"""
+        with self._lock:
+            current = self._entries.get(entry.filename)
+            if current is not None and current.acquire():
+                return current
+            frequency = self._freq.get(entry.filename, 0)
+            while self.used + entry.size > self.budget and self._entries:
+                candidates = [self._entries[name] for name in list(self._entries)[:self.sample]]
+                victim = min(candidates, key=lambda e: self._freq.get(e.filename, e.hits))
+                if self._freq.get(victim.filename, victim.hits) > frequency:
+                    self.stats["rejected"] += 1
+                    return None
+                del self._entries[victim.filename]
+                self.used -= victim.size
+                victim.retire()
+                self.stats["evicted"] += 1
+            self._entries[entry.filename] = entry
+            self.used += entry.size
+            entry.acquire()
+            self.stats["admitted"] += 1
+            return entry
+
+    def _discard(self, entry, outcome):
+        """Remove o item se ele ainda for o que está no cache"""
+        with self._lock:
+            if self._entries.get(entry.filename) is entry:
+                del self._entries[entry.filename]
+                self.used -= entry.size
+                entry.retire()
+                self.stats[outcome] += 1
+
+    def invalidate(self, filename):
+        """Descarta o arquivo (removido ou regravado)"""
+        with self._lock:
+            entry = self._entries.pop(filename, None)
+            if entry is not None:
+                self.used -= entry.size
+                entry.retire()
+                self.stats["invalidated"] += 1
+
+    def warm(self, filename, path=None, loader=None):
+        """Prepara um arquivo que deve ser pedido em breve
+
+        Disco local: readahead via posix_fadvise (ou madvise, se já mapeado).
+        Remoto: `loader()` carrega os bytes em segundo plano.
+        """
+        if not self.enabled:
+            return
+        with self._lock:
+            # Conta como pedidos suficientes para entrar no cache no primeiro acesso
+            self._freq[filename] = max(self._freq.get(filename, 0), self.admit_after - 1)
+            entry = self._entries.get(filename)
+            self.stats["warmed"] += 1
+        if entry is not None:
+            if isinstance(entry.data, mmap.mmap) and hasattr(mmap, 'MADV_WILLNEED'):
+                try:
+                    entry.data.madvise(mmap.MADV_WILLNEED)
+                except (OSError, ValueError):
+                    pass
+            return
+        if path is not None:
+            if hasattr(os, 'posix_fadvise'):
+                try:
+                    fd = os.open(path, os.O_RDONLY)
+                    try:
+                        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_WILLNEED)
+                    finally:
+                        os.close(fd)
+                except OSError:
+                    pass
+        elif loader is not None:
+            self._prefetch.submit(self._load, filename, loader)
+
+    def _load(self, filename, loader):
+        try:
+            data = loader()
+            if data is not None:
+                entry = self.admit_bytes(filename, data)
+                if entry:
+                    entry.release()
+                    with self._lock:
+                        self.stats["prefetched"] += 1
+        except Exception as e:
+            print(f"Erro ao pré-carregar {filename}: {e}")
+
+    def snapshot(self):
+        with self._lock:
+            lookups = self.stats["hits"] + self.stats["misses"]
+            return dict(
+                self.stats,
+                entries=len(self._entries),
+                used_bytes=self.used,
+                budget_bytes=self.budget,
+                hit_ratio=round(self.stats["hits"] / lookups, 4) if lookups else 0,
+            )
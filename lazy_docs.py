@@ -0,0 +1,75 @@
+"""Swagger UI sob demanda a partir de um apispec.json pré-gerado
+
+No plano gratuito do Render o tempo de cold start é visível para o usuário.
+Importar o flasgger (jsonschema, yaml, mistune...) e montar o Swagger custa
+mais que o resto da inicialização do app. No modo lazy (SWAGGER_LAZY=1):
+
+- `/apispec.json` é servido direto do snapshot gerado no build
+  (`python build_apispec.py`), sem importar o flasgger;
+- `/docs` e `/flasgger_static/...` montam um app Flask só para a UI no
+  primeiro acesso, usando o snapshot como template.
+"""
+import hashlib
+import json
+import threading
+
+
+class LazySwaggerMiddleware:
+    """Middleware WSGI que atende as rotas de documentação sem passar pelo app"""
+
+    def __init__(self, wsgi_app, spec_file, config):
+        self.wsgi_app = wsgi_app
+        self.config = config
+        self.spec_route = config['specs'][0]['route']
+        self.docs_route = config['specs_route'].rstrip('/') or '/'
+        self.static_url_path = config['static_url_path']
+
+        with open(spec_file, 'rb') as f:
+            self.spec_bytes = f.read()
+        self.spec_etag = '"' + hashlib.sha1(self.spec_bytes).hexdigest() + '"'
+
+        self._docs_app = None
+        self._lock = threading.Lock()
+
+    def __call__(self, environ, start_response):
+        path = environ.get('PATH_INFO', '')
+        if path == self.spec_route:
+            return self._serve_spec(environ, start_response)
+        if (path == self.docs_route or path.startswith(self.docs_route + '/')
+                or path.startswith(self.static_url_path + '/')):
+            return self.docs_app()(environ, start_response)
+        return self.wsgi_app(environ, start_response)
+
+    def _serve_spec(self, environ, start_response):
+        headers = [
+            ('Content-Type', 'application/json'),
+            ('ETag', self.spec_etag),
+            ('Cache-Control', 'no-cache'),
+            ('Access-Control-Allow-Origin', '*'),
+        ]
+        if environ.get('HTTP_IF_NONE_MATCH') == self.spec_etag:
+            start_response('304 Not Modified', headers)
+            return [b'']
+        headers.append(('Content-Length', str(len(self.spec_bytes))))
+        start_response('200 OK', headers)
+        if environ.get('REQUEST_METHOD') == 'HEAD':
+            return [b'']
+        return [self.spec_bytes]
+
+    def docs_app(self):
+        """Monta (uma única vez) o app da Swagger UI"""
+        if self._docs_app is None:
+            with self._lock:
+                if self._docs_app is None:
+                    self._docs_app = self._build_docs_app()
+        return self._docs_app
+
+    def _build_docs_app(self):
+        from flask import Flask
+        from flasgger import Swagger
+
+        docs_app = Flask('docs')
+        config = dict(self.config)
+        config['specs'] = [dict(spec, rule_filter=lambda rule: False) for spec in self.config['specs']]
+        Swagger(docs_app, config=config, template=json.loads(self.spec_bytes))
+        return docs_app.wsgi_app
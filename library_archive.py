@@ -0,0 +1,152 @@
+"""Exportação e importação da biblioteca como um único arquivo tar
+
+O tar é montado à mão, membro a membro, enquanto é enviado: o cabeçalho de
+cada arquivo de mídia sai com o tamanho informado pelo storage e o conteúdo
+vem em blocos de `storage.get`, então a memória usada não depende do tamanho
+da biblioteca e nada é gravado em disco. Os metadados vão em lotes NDJSON:
+
+    media/<filename>           arquivos do lote (antes dos metadados)
+    metadata/000001.ndjson     uma mídia por linha
+    media/<filename>
+    metadata/000002.ndjson
+    ...
+
+Como cada lote de metadados vem depois dos seus arquivos, a importação
+(também em streaming, `tarfile` no modo `r|*`) só grava as linhas quando os
+arquivos que elas referenciam já estão no storage.
+"""
+import json
+import mimetypes
+import tarfile
+import time
+
+from media_layout import is_safe_filename
+from reclaim import media_filename
+
+FORMAT_VERSION = 1
+BLOCK_SIZE = tarfile.BLOCKSIZE
+MEDIA_PREFIX = 'media/'
+METADATA_PREFIX = 'metadata/'
+# Maior lote de metadados aceito na importação (linhas são lidas em memória)
+MAX_METADATA_SIZE = 64 * 1024 * 1024
+
+
+class ArchiveError(Exception):
+    """Arquivo de importação inválido ou incompleto"""
+
+
+def _header(name, size, mtime):
+    info = tarfile.TarInfo(name)
+    info.size = size
+    info.mtime = int(mtime)
+    info.mode = 0o644
+    return info.tobuf(format=tarfile.PAX_FORMAT)
+
+
+def _padding(size):
+    return b'\0' * (-size % BLOCK_SIZE)
+
+
+def tar_member(name, data):
+    """Membro do tar com conteúdo já em memória (pequeno)"""
+    yield _header(name, len(data), time.time())
+    yield data
+    yield _padding(len(data))
+
+
+def tar_file_member(name, size, chunks):
+    """Membro do tar com o conteúdo lido em blocos; `size` precisa ser exato"""
+    yield _header(name, size, time.time())
+    written = 0
+    for chunk in chunks:
+        written += len(chunk)
+        if written > size:
+            raise ArchiveError(f"{name} cresceu durante a exportação")
+        yield chunk
+    if written != size:
+        raise ArchiveError(f"{name} mudou de tamanho durante a exportação")
+    yield _padding(size)
+
+
+def export_archive(batches, storage, include_media=True):
+    """Gera os bytes do tar a partir de lotes de mídias (listas de dicts)"""
+    yield from tar_member('manifest.json', json.dumps({
+        "format": "media-player-api-library",
+        "version": FORMAT_VERSION,
+        "created": time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+    }).encode())
+
+    for number, batch in enumerate(batches, 1):
+        if include_media:
+            seen = set()
+            for midia in batch:
+                filename = media_filename(midia.get('uri'))
+                if not filename or filename in seen or not is_safe_filename(filename):
+                    continue
+                seen.add(filename)
+                size = storage.size(filename)
+                if size is None:
+                    continue
+                try:
+                    chunks = storage.get(filename)
+                except FileNotFoundError:
+                    # Removido entre a listagem e a leitura: a linha segue sem o arquivo
+                    continue
+                try:
+                    yield from tar_file_member(MEDIA_PREFIX + filename, size, chunks)
+                finally:
+                    # Cliente desconectado no meio do arquivo: fecha o leitor do
+                    # storage (arquivo local ou corpo da resposta do S3)
+                    close = getattr(chunks, 'close', None)
+                    if close:
+                        close()
+
+        lines = ''.join(json.dumps(midia, ensure_ascii=False) + '\n' for midia in batch)
+        yield from tar_member(f'{METADATA_PREFIX}{number:06d}.ndjson', lines.encode('utf-8'))
+
+    # Dois blocos vazios marcam o fim do tar
+    yield b'\0' * (2 * BLOCK_SIZE)
+
+
+def import_archive(stream, storage, insert_batch):
+    """Lê um tar (opcionalmente gzip) em streaming e importa o conteúdo
+
+    `insert_batch(midias)` grava um lote de metadados numa transação e
+    retorna `(inseridas, ignoradas)`. Arquivos que já existem no storage
+    nunca são sobrescritos: o nome de um upload não muda de conteúdo, e um
+    arquivo importado não pode substituir uma mídia da biblioteca.
+    """
+    stats = {"midias": 0, "skipped_midias": 0, "files": 0, "skipped_files": 0, "bytes": 0}
+    try:
+        archive = tarfile.open(fileobj=stream, mode='r|*')
+    except tarfile.TarError as e:
+        raise ArchiveError(f"Arquivo inválido: {e}")
+
+    try:
+        for member in archive:
+            if not member.isfile():
+                continue
+            if member.name.startswith(MEDIA_PREFIX):
+                filename = member.name[len(MEDIA_PREFIX):]
+                if not is_safe_filename(filename) or storage.exists(filename):
+                    # O modo stream descarta o conteúdo ao avançar para o próximo membro
+                    stats["skipped_files"] += 1
+                    continue
+                content_type = mimetypes.guess_type(filename)[0]
+                stats["bytes"] += storage.put(filename, archive.extractfile(member), content_type)
+                stats["files"] += 1
+            elif member.name.startswith(METADATA_PREFIX):
+                if member.size > MAX_METADATA_SIZE:
+                    raise ArchiveError(f"{member.name} excede {MAX_METADATA_SIZE} bytes")
+                data = archive.extractfile(member).read().decode('utf-8')
+                midias = [json.loads(line) for line in data.splitlines() if line.strip()]
+                inserted, skipped = insert_batch(midias)
+                stats["midias"] += inserted
+                stats["skipped_midias"] += skipped
+    except (tarfile.TarError, EOFError) as e:
+        raise ArchiveError(f"Arquivo incompleto ou corrompido: {e}")
+    except ValueError as e:
+        raise ArchiveError(f"Metadados inválidos: {e}")
+    finally:
+        archive.close()
+    return stats
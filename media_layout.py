@@ -0,0 +1,168 @@
+"""Layout particionado (fan-out) da pasta de mídias
+
+Com milhões de arquivos num único diretório, buscas e listagens degradam.
+Os arquivos passam a ficar em `MEDIA_FOLDER/ab/cd/<filename>`, onde `abcd`
+são os primeiros caracteres do UUID do filename. O caminho é calculado só
+a partir do filename, então servir um arquivo não custa consulta à base e
+as URLs antigas (`/api/midias/media/<filename>`) continuam válidas.
+
+Arquivos no layout antigo (plano) continuam sendo encontrados até a
+migração online movê-los:
+    python media_layout.py --media-folder media
+"""
+import argparse
+import hashlib
+import json
+import os
+import string
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+HEX_DIGITS = set(string.hexdigits.lower())
+LOCK_NAME = '.migrate.lock'
+
+
+def shard_dirs(filename):
+    """Subpastas (nível 1, nível 2) de um filename"""
+    prefix = filename[:4].lower()
+    if len(prefix) < 4 or not set(prefix) <= HEX_DIGITS:
+        # Nomes que não começam com UUID são distribuídos por hash
+        prefix = hashlib.md5(filename.encode('utf-8')).hexdigest()[:4]
+    return prefix[:2], prefix[2:4]
+
+
+def is_safe_filename(filename):
+    """Aceita apenas nomes simples, sem separadores nem arquivos ocultos"""
+    return (
+        bool(filename)
+        and os.path.basename(filename) == filename
+        and '\\' not in filename
+        and not filename.startswith('.')
+    )
+
+
+def shard_path(media_folder, filename):
+    """Caminho do arquivo no layout particionado"""
+    level1, level2 = shard_dirs(filename)
+    return os.path.join(media_folder, level1, level2, filename)
+
+
+def flat_path(media_folder, filename):
+    """Caminho do arquivo no layout antigo (plano)"""
+    return os.path.join(media_folder, filename)
+
+
+def resolve_media_path(media_folder, filename):
+    """Localiza o arquivo no disco ou retorna None
+
+    Tenta o layout particionado, depois o plano e, por fim, o particionado de
+    novo: se a migração mover o arquivo entre as duas primeiras verificações
+    ele ainda é encontrado.
+    """
+    if not is_safe_filename(filename):
+        return None
+    sharded = shard_path(media_folder, filename)
+    for candidate in (sharded, flat_path(media_folder, filename), sharded):
+        if os.path.isfile(candidate):
+            return candidate
+    return None
+
+
+def prepare_shard_path(media_folder, filename):
+    """Cria as subpastas e retorna o caminho para gravar um novo arquivo"""
+    path = shard_path(media_folder, filename)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    return path
+
+
+def has_flat_files(media_folder):
+    """Indica se ainda existe algum arquivo no layout plano (para no primeiro)"""
+    try:
+        with os.scandir(media_folder) as entries:
+            for entry in entries:
+                if entry.is_file(follow_symlinks=False) and not entry.name.startswith('.'):
+                    return True
+    except FileNotFoundError:
+        pass
+    return False
+
+
+def migrate_flat_layout(media_folder, batch_size=200, pause=0.05):
+    """Move os arquivos do layout plano para o particionado, em lotes
+
+    `os.replace` é atômico no mesmo sistema de arquivos, então cada arquivo
+    está sempre em um dos dois caminhos que `resolve_media_path` consulta.
+    Um lock de arquivo garante que apenas um worker migre por vez.
+    """
+    stats = {"moved": 0, "skipped": 0, "locked": False}
+    lock_file = None
+    if fcntl:
+        lock_file = open(os.path.join(media_folder, LOCK_NAME), 'w')
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            stats["locked"] = True
+            return stats
+
+    try:
+        while True:
+            batch = []
+            with os.scandir(media_folder) as entries:
+                for entry in entries:
+                    if entry.is_file(follow_symlinks=False) and is_safe_filename(entry.name):
+                        batch.append(entry.name)
+                        if len(batch) >= batch_size:
+                            break
+            if not batch:
+                break
+
+            for filename in batch:
+                target = prepare_shard_path(media_folder, filename)
+                try:
+                    os.replace(flat_path(media_folder, filename), target)
+                    stats["moved"] += 1
+                except FileNotFoundError:
+                    stats["skipped"] += 1
+
+            # Pausa entre lotes para não disputar I/O com as requisições
+            if pause:
+                time.sleep(pause)
+    finally:
+        if lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+            lock_file.close()
+    return stats
+
+
+def start_background_migration(media_folder, batch_size=200, pause=0.05):
+    """Dispara a migração numa thread daemon, se houver arquivos no layout plano"""
+    if not has_flat_files(media_folder):
+        return None
+    thread = threading.Thread(
+        target=migrate_flat_layout,
+        args=(media_folder, batch_size, pause),
+        name='media-layout-migration',
+        daemon=True
+    )
+    thread.start()
+    return thread
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Migra a pasta de mídias para o layout particionado")
+    parser.add_argument('--media-folder', default=os.environ.get('MEDIA_FOLDER', 'media'))
+    parser.add_argument('--batch-size', type=int, default=200)
+    parser.add_argument('--pause', type=float, default=0.05, help="Segundos entre lotes")
+    args = parser.parse_args()
+
+    print(json.dumps(migrate_flat_layout(args.media_folder, args.batch_size, args.pause), indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,136 @@
+"""Buffer write-behind para eventos de reprodução
+
+Registrar cada play com um UPDATE + commit síncrono serializaria todos os
+workers no lock de escrita do SQLite. Aqui os eventos ficam em memória,
+agrupados por id (N plays da mesma mídia viram um único UPDATE), e são
+gravados em lote, numa transação, a cada `interval` segundos ou quando
+`max_events` eventos se acumulam. No encerramento do processo o que estiver
+pendente é gravado (atexit).
+"""
+import atexit
+import threading
+import time
+
+
+class PartialFlushError(Exception):
+    """Parte do lote foi gravada; `pending` tem só o que não foi"""
+
+    def __init__(self, pending, error):
+        super().__init__(str(error))
+        self.pending = pending
+        self.error = error
+
+
+class PlayBuffer:
+    """Acumula plays por id e delega a gravação em lote para `flush_fn`
+
+    `flush_fn(updates)` recebe `{midia_id: (plays, ultimo_play)}` e deve
+    gravar tudo numa transação. Se levantar exceção, os eventos voltam para
+    o buffer e são tentados de novo no próximo ciclo; quando a gravação é
+    dividida (uma transação por base), `flush_fn` levanta PartialFlushError
+    com apenas o subconjunto não gravado, para não contar plays duas vezes.
+    """
+
+    def __init__(self, flush_fn, interval=1.0, max_events=500):
+        self.flush_fn = flush_fn
+        self.interval = interval
+        self.max_events = max_events
+        self._pending = {}
+        self._pending_events = 0
+        self._cond = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._closed = False
+        self._thread = None
+        self.stats = {
+            "events": 0,
+            "flushes": 0,
+            "rows_written": 0,
+            "errors": 0,
+        }
+
+    def start(self):
+        """Inicia a thread de gravação e registra o flush de encerramento"""
+        if self._thread:
+            return
+        self._thread = threading.Thread(target=self._run, name='play-buffer', daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def record(self, midia_id, played_at):
+        """Registra um play (O(1), sem tocar na base)"""
+        with self._cond:
+            plays, last = self._pending.get(midia_id, (0, played_at))
+            self._pending[midia_id] = (plays + 1, max(last, played_at))
+            self._pending_events += 1
+            self.stats["events"] += 1
+            if self._pending_events >= self.max_events:
+                self._cond.notify()
+
+    def pending(self):
+        with self._cond:
+            return self._pending_events
+
+    def flush(self):
+        """Grava imediatamente o que estiver pendente"""
+        with self._flush_lock:
+            with self._cond:
+                updates = self._pending
+                self._pending = {}
+                self._pending_events = 0
+            if not updates:
+                return 0
+            try:
+                self.flush_fn(updates)
+            except PartialFlushError as e:
+                self.stats["errors"] += 1
+                self.stats["rows_written"] += len(updates) - len(e.pending)
+                self._requeue(e.pending)
+                raise
+            except Exception:
+                self.stats["errors"] += 1
+                self._requeue(updates)
+                raise
+            self.stats["flushes"] += 1
+            self.stats["rows_written"] += len(updates)
+            return len(updates)
+
+    def _requeue(self, updates):
+        with self._cond:
+            for midia_id, (plays, last) in updates.items():
+                current_plays, current_last = self._pending.get(midia_id, (0, last))
+                self._pending[midia_id] = (current_plays + plays, max(current_last, last))
+                self._pending_events += plays
+
+    def _run(self):
+        while True:
+            with self._cond:
+                deadline = time.monotonic() + self.interval
+                while not self._closed and self._pending_events < self.max_events:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                closed = self._closed
+            try:
+                self.flush()
+            except Exception:
+                # Falha já contabilizada; os eventos voltaram para o buffer
+                if not closed:
+                    time.sleep(self.interval)
+            if closed:
+                return
+
+    def close(self):
+        """Encerra a thread e grava os eventos pendentes"""
+        with self._cond:
+            if self._closed:
+                return
+            self._closed = True
+            self._cond.notify()
+        if self._thread:
+            self._thread.join(timeout=10)
+        # Garante o flush final mesmo se a thread não estava rodando
+        try:
+            self.flush()
+        except Exception:
+            pass
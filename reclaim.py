@@ -0,0 +1,257 @@
+"""Recuperação de arquivos órfãos e compactação da base de dados
+
+Um arquivo em MEDIA_FOLDER é órfão quando nenhuma linha de `midias` aponta
+para ele (ex.: mídia deletada antes da limpeza automática existir, ou upload
+que falhou depois do `file.save()`). Este módulo percorre o diretório em
+streaming, compara com o conjunto de filenames referenciados e remove (ou
+move para quarentena) os órfãos em lotes. Depois compacta o SQLite.
+
+Uso:
+    python reclaim.py --dry-run
+    python reclaim.py --quarantine quarantine --batch-size 500
+    python reclaim.py --media-folder uploads --min-age 0
+
+Com DATABASE_URL (ou --database-url) as referências são lidas do servidor,
+como no app; sem ele, da base principal e das bases dedicadas.
+"""
+import argparse
+import glob
+import json
+import os
+import shutil
+import sqlite3
+import time
+
+MEDIA_URI_PREFIXES = ('/api/midias/media/', '/api/files/')
+
+
+def media_filename(uri):
+    """Extrai o filename de uma URI servida pela API (ou None se for externa)"""
+    if not uri:
+        return None
+    for prefix in MEDIA_URI_PREFIXES:
+        pos = uri.find(prefix)
+        if pos != -1:
+            return uri[pos + len(prefix):].split('?', 1)[0] or None
+    return None
+
+
+def canonical_media_uri(uri):
+    """Forma com que a URI é gravada na base
+
+    URIs de arquivos servidos pela API, absolutas (como a devolvida pelo
+    upload) ou no formato antigo /api/files/, viram /api/midias/media/<filename>;
+    assim a contagem de referências por igualdade de uri não deixa nenhuma de
+    fora. URIs externas não mudam.
+    """
+    filename = media_filename(uri)
+    return MEDIA_URI_PREFIXES[0] + filename if filename else uri
+
+
+def media_uris(filename):
+    """URIs canônicas com que um filename pode estar gravado na base"""
+    return [prefix + filename for prefix in MEDIA_URI_PREFIXES]
+
+
+def referenced_filenames(store):
+    """Conjunto de filenames referenciados, lido em lotes pela chave primária"""
+    referenced = set()
+    for uri in store.iter_uris():
+        filename = media_filename(uri)
+        if filename:
+            referenced.add(filename)
+    return referenced
+
+
+def still_referenced(store, filenames):
+    """Confirma na base, pelo índice de uri, quais filenames ganharam referência"""
+    uris = [uri for filename in filenames for uri in media_uris(filename)]
+    return {media_filename(uri) for uri in store.existing_uris(uris)}
+
+
+def iter_media_files(media_folder, skip_dirs=()):
+    """Percorre a pasta de mídias (e subpastas) em streaming com os.scandir"""
+    stack = [media_folder]
+    skip = {os.path.abspath(d) for d in skip_dirs}
+    while stack:
+        folder = stack.pop()
+        try:
+            with os.scandir(folder) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        if os.path.abspath(entry.path) not in skip and not entry.name.startswith('.'):
+                            stack.append(entry.path)
+                    elif entry.is_file(follow_symlinks=False) and not entry.name.startswith('.'):
+                        yield entry
+        except FileNotFoundError:
+            continue
+
+
+def _dispose(entry, quarantine, dry_run):
+    if dry_run:
+        return
+    if quarantine:
+        os.makedirs(quarantine, exist_ok=True)
+        shutil.move(entry.path, os.path.join(quarantine, entry.name))
+    else:
+        os.remove(entry.path)
+
+
+def reclaim_orphans(stores, media_folder, quarantine=None, batch_size=500,
+                    min_age=3600, dry_run=False):
+    """Remove ou coloca em quarentena os arquivos sem referência na base
+
+    `stores` são os MidiaStore (database.py) com as mídias da biblioteca: a
+    base principal e as de dispositivos dedicados ou, com DATABASE_URL, o
+    servidor (ver `database.library_stores`). Arquivos mais novos que
+    `min_age` segundos são ignorados para não competir com uploads em
+    andamento (arquivo salvo, INSERT ainda não feito).
+    """
+    stats = {
+        "scanned": 0,
+        "orphans": 0,
+        "reclaimed": 0,
+        "bytes_reclaimed": 0,
+        "skipped_recent": 0,
+        "dry_run": dry_run,
+        "quarantine": quarantine,
+    }
+    if not os.path.isdir(media_folder):
+        return stats
+
+    referenced = set()
+    for store in stores:
+        referenced |= referenced_filenames(store)
+    cutoff = time.time() - min_age
+    batch = []
+
+    def flush():
+        # Revalida o lote: uma mídia pode ter sido criada durante a varredura
+        names = [e.name for e, _ in batch]
+        revived = set()
+        for store in stores:
+            revived |= still_referenced(store, names)
+        for entry, size in batch:
+            if entry.name in revived:
+                continue
+            try:
+                _dispose(entry, quarantine, dry_run)
+            except FileNotFoundError:
+                continue
+            stats["reclaimed"] += 1
+            stats["bytes_reclaimed"] += size
+        batch.clear()
+
+    skip = [quarantine] if quarantine else []
+    for entry in iter_media_files(media_folder, skip_dirs=skip):
+        stats["scanned"] += 1
+        if entry.name in referenced:
+            continue
+        st = entry.stat(follow_symlinks=False)
+        if st.st_mtime > cutoff:
+            stats["skipped_recent"] += 1
+            continue
+        stats["orphans"] += 1
+        batch.append((entry, st.st_size))
+        if len(batch) >= batch_size:
+            flush()
+    if batch:
+        flush()
+    return stats
+
+
+def compact_database(db_file, full=False, pages=None):
+    """Devolve ao sistema de arquivos as páginas livres do SQLite
+
+    Com auto_vacuum=INCREMENTAL usa `incremental_vacuum`, que não bloqueia a
+    base pelo tempo de uma reescrita completa. Sem ele (bases antigas) ou com
+    `full=True`, roda VACUUM.
+    """
+    conn = sqlite3.connect(db_file, isolation_level=None)
+    try:
+        size_before = os.path.getsize(db_file)
+        free_before = conn.execute('PRAGMA freelist_count').fetchone()[0]
+        mode = conn.execute('PRAGMA auto_vacuum').fetchone()[0]
+
+        if mode == 2 and not full:
+            # incremental_vacuum só libera páginas enquanto o cursor é consumido
+            if pages:
+                conn.execute(f'PRAGMA incremental_vacuum({int(pages)})').fetchall()
+            else:
+                conn.execute('PRAGMA incremental_vacuum').fetchall()
+            method = "incremental_vacuum"
+        else:
+            conn.execute('VACUUM')
+            method = "vacuum"
+
+        free_after = conn.execute('PRAGMA freelist_count').fetchone()[0]
+    finally:
+        conn.close()
+
+    return {
+        "method": method,
+        "free_pages_before": free_before,
+        "free_pages_after": free_after,
+        "size_before": size_before,
+        "size_after": os.path.getsize(db_file),
+    }
+
+
+def enable_incremental_vacuum(db_file):
+    """Converte uma base existente para auto_vacuum=INCREMENTAL (requer VACUUM)"""
+    conn = sqlite3.connect(db_file, isolation_level=None)
+    try:
+        conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
+        conn.execute('VACUUM')
+    finally:
+        conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Recupera arquivos órfãos e compacta a base")
+    parser.add_argument('--db', default=os.environ.get('DB_FILE', 'midias.db'))
+    parser.add_argument('--media-folder', default=os.environ.get('MEDIA_FOLDER', 'media'))
+    parser.add_argument('--device-db-folder', default=os.environ.get('DEVICE_DB_FOLDER', 'devices'),
+                        help="Pasta das bases de dispositivos dedicados")
+    parser.add_argument('--quarantine', help="Move os órfãos para esta pasta em vez de apagar")
+    parser.add_argument('--batch-size', type=int, default=500)
+    parser.add_argument('--min-age', type=int, default=3600,
+                        help="Ignora arquivos modificados há menos de N segundos")
+    parser.add_argument('--dry-run', action='store_true', help="Apenas relata, não remove nada")
+    parser.add_argument('--no-compact', action='store_true', help="Não compacta a base")
+    parser.add_argument('--full-vacuum', action='store_true', help="Força VACUUM completo")
+    parser.add_argument('--enable-incremental', action='store_true',
+                        help="Converte a base para auto_vacuum=INCREMENTAL")
+    parser.add_argument('--database-url', default=os.environ.get('DATABASE_URL', ''),
+                        help="Servidor com a tabela de mídias (como no app)")
+    args = parser.parse_args()
+
+    # database.py importa este módulo (MEDIA_URI_PREFIXES)
+    from database import library_stores
+
+    # Com DATABASE_URL as mídias estão no servidor; o SQLite local (playlists,
+    # eventos) continua sendo compactado, as bases dedicadas não são usadas
+    stores = library_stores(args.db, args.device_db_folder, args.database_url)
+    db_files = [args.db]
+    if not args.database_url:
+        db_files += sorted(glob.glob(os.path.join(args.device_db_folder, '*.db')))
+    try:
+        report = {
+            "orphans": reclaim_orphans(stores, args.media_folder, args.quarantine,
+                                       args.batch_size, args.min_age, args.dry_run)
+        }
+    finally:
+        for store in stores:
+            store.engine.dispose()
+    if not args.dry_run:
+        for db_file in db_files:
+            if args.enable_incremental:
+                enable_incremental_vacuum(db_file)
+            if not args.no_compact:
+                report.setdefault("compaction", {})[db_file] = compact_database(db_file, full=args.full_vacuum)
+
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+"""Coalescência de leituras idênticas simultâneas (single-flight)
+
+Quando a biblioteca muda, dezenas de clientes pedem `/api/midias` e
+`/api/stats` ao mesmo tempo. Dentro de um worker, a primeira requisição de
+uma chave executa a consulta e serializa o JSON; as que chegarem enquanto
+ela estiver em andamento esperam e recebem os mesmos bytes. Nada fica em
+cache depois que a execução termina.
+
+A geração (`invalidate()`) entra na chave: depois de uma escrita neste
+worker, as novas leituras não se juntam a uma execução iniciada antes dela.
+"""
+import threading
+
+
+class _Flight:
+    __slots__ = ('done', 'result', 'error', 'waiters')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    """Executa `fn` uma vez por chave entre as chamadas simultâneas"""
+
+    def __init__(self):
+        self.generation = 0
+        self._flights = {}
+        self._lock = threading.Lock()
+        self.stats = {}
+
+    def invalidate(self):
+        with self._lock:
+            self.generation += 1
+
+    def _counters(self, name):
+        return self.stats.setdefault(name, {"requests": 0, "executions": 0, "coalesced": 0, "errors": 0})
+
+    def do(self, name, fn):
+        """Retorna `(resultado, compartilhado)`; exceções de `fn` chegam a todos"""
+        with self._lock:
+            counters = self._counters(name)
+            counters["requests"] += 1
+            key = (name, self.generation)
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+                counters["executions"] += 1
+            else:
+                flight.waiters += 1
+                counters["coalesced"] += 1
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result, True
+
+        try:
+            flight.result = fn()
+        except BaseException as e:
+            flight.error = e
+            with self._lock:
+                counters["errors"] += 1
+            raise
+        finally:
+            with self._lock:
+                self._flights.pop(key, None)
+            flight.done.set()
+        return flight.result, False
+
+    def snapshot(self):
+        with self._lock:
+            stats = {}
+            for name, counters in self.stats.items():
+                requests = counters["requests"]
+                stats[name] = dict(counters, dedup_ratio=round(counters["coalesced"] / requests, 4) if requests else 0)
+            return {"generation": self.generation, "in_flight": len(self._flights), "keys": stats}
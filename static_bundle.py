@@ -0,0 +1,185 @@
+"""Arquivos estáticos pré-comprimidos servidos direto pelo WSGI
+
+A página `/test-page` e os assets da Swagger UI (`/flasgger_static/...`)
+não mudam entre deploys. Em vez de montar a resposta no Flask a cada
+requisição, cada arquivo ganha uma cópia gzip (e brotli, se o pacote
+`brotli` estiver instalado) gravada uma única vez em STATIC_CACHE_DIR,
+nomeada pelo hash do conteúdo. O middleware escolhe a variante pelo
+Accept-Encoding, responde 304 pelo ETag e entrega o arquivo via
+`wsgi.file_wrapper` (sendfile no gunicorn).
+
+O cache é gerado no build (`python static_bundle.py`) ou, se faltar, na
+inicialização.
+"""
+import argparse
+import gzip
+import hashlib
+import importlib.util
+import mimetypes
+import os
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+STATIC_FOLDER = os.path.join(ROOT, 'static')
+DEFAULT_CACHE_DIR = os.path.join(ROOT, 'static_cache')
+
+# Arquivos pequenos demais ou já comprimidos não ganham variante comprimida
+MIN_COMPRESS_SIZE = 512
+COMPRESSIBLE_TYPES = ('text/', 'application/javascript', 'application/json', 'image/svg+xml')
+SKIP_SUFFIXES = ('.map',)
+CHUNK_SIZE = 64 * 1024
+
+
+def flasgger_static_folder():
+    """Pasta de assets da Swagger UI, localizada sem importar o flasgger"""
+    spec = importlib.util.find_spec('flasgger')
+    if not spec or not spec.submodule_search_locations:
+        return None
+    folder = os.path.join(list(spec.submodule_search_locations)[0], 'ui3', 'static')
+    return folder if os.path.isdir(folder) else None
+
+
+def _write_atomic(path, data):
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+class Asset:
+    """Um arquivo com suas variantes (identity, gzip, br) e o ETag do conteúdo"""
+
+    def __init__(self, source, cache_dir):
+        with open(source, 'rb') as f:
+            data = f.read()
+        digest = hashlib.sha256(data).hexdigest()[:32]
+        self.etag = digest
+        self.content_type = mimetypes.guess_type(source)[0] or 'application/octet-stream'
+        if self.content_type.startswith('text/'):
+            self.content_type += '; charset=utf-8'
+        self.variants = {'identity': (source, len(data))}
+
+        if len(data) < MIN_COMPRESS_SIZE or not self.content_type.startswith(COMPRESSIBLE_TYPES):
+            return
+
+        os.makedirs(cache_dir, exist_ok=True)
+        encoders = [('gzip', '.gz', lambda d: gzip.compress(d, 9, mtime=0))]
+        if brotli:
+            encoders.append(('br', '.br', lambda d: brotli.compress(d, quality=11)))
+        for encoding, suffix, compress in encoders:
+            path = os.path.join(cache_dir, digest + suffix)
+            if not os.path.exists(path):
+                compressed = compress(data)
+                if len(compressed) >= len(data):
+                    continue
+                _write_atomic(path, compressed)
+            self.variants[encoding] = (path, os.path.getsize(path))
+
+    def choose(self, accept_encoding):
+        """Melhor variante aceita pelo cliente: br > gzip > identity"""
+        accepted = set()
+        for part in accept_encoding.lower().split(','):
+            token, _, params = part.strip().partition(';')
+            if params.replace(' ', '') in ('q=0', 'q=0.0', 'q=0.00', 'q=0.000'):
+                continue
+            accepted.add(token.strip())
+        for encoding in ('br', 'gzip'):
+            if encoding in self.variants and (encoding in accepted or '*' in accepted):
+                return encoding
+        return 'identity'
+
+
+class StaticBundleMiddleware:
+    """Middleware WSGI que atende os assets do bundle antes do Flask"""
+
+    def __init__(self, wsgi_app, cache_dir=DEFAULT_CACHE_DIR, max_age=86400):
+        self.wsgi_app = wsgi_app
+        self.cache_dir = cache_dir
+        self.cache_control = f'public, max-age={max_age}'
+        self.assets = {}
+
+    def add_file(self, url_path, source):
+        self.assets[url_path] = Asset(source, self.cache_dir)
+
+    def add_directory(self, url_prefix, folder):
+        """Registra todos os arquivos da pasta (exceto source maps)"""
+        for current, _, files in os.walk(folder):
+            for name in files:
+                if name.endswith(SKIP_SUFFIXES) or name.startswith('.'):
+                    continue
+                source = os.path.join(current, name)
+                relative = os.path.relpath(source, folder).replace(os.sep, '/')
+                self.add_file(f"{url_prefix.rstrip('/')}/{relative}", source)
+
+    def __call__(self, environ, start_response):
+        asset = self.assets.get(environ.get('PATH_INFO', ''))
+        method = environ.get('REQUEST_METHOD', 'GET')
+        if asset is None or method not in ('GET', 'HEAD'):
+            return self.wsgi_app(environ, start_response)
+
+        encoding = asset.choose(environ.get('HTTP_ACCEPT_ENCODING', ''))
+        path, size = asset.variants[encoding]
+        # ETag por representação: a variante comprimida é outro conjunto de bytes
+        etag = f'"{asset.etag}"' if encoding == 'identity' else f'"{asset.etag}-{encoding}"'
+        headers = [
+            ('Content-Type', asset.content_type),
+            ('ETag', etag),
+            ('Cache-Control', self.cache_control),
+            ('Vary', 'Accept-Encoding'),
+        ]
+
+        if_none_match = environ.get('HTTP_IF_NONE_MATCH', '')
+        if if_none_match and (if_none_match.strip() == '*' or etag in if_none_match):
+            start_response('304 Not Modified', headers)
+            return [b'']
+
+        if encoding != 'identity':
+            headers.append(('Content-Encoding', encoding))
+        headers.append(('Content-Length', str(size)))
+        start_response('200 OK', headers)
+        if method == 'HEAD':
+            return [b'']
+
+        f = open(path, 'rb')
+        file_wrapper = environ.get('wsgi.file_wrapper')
+        if file_wrapper:
+            return file_wrapper(f, CHUNK_SIZE)
+        return _iter_file(f)
+
+
+def _iter_file(f):
+    with f:
+        while True:
+            data = f.read(CHUNK_SIZE)
+            if not data:
+                break
+            yield data
+
+
+def build_bundle(wsgi_app, cache_dir=DEFAULT_CACHE_DIR, max_age=86400, static_url_path='/flasgger_static'):
+    """Middleware com a página de teste e os assets da Swagger UI registrados"""
+    bundle = StaticBundleMiddleware(wsgi_app, cache_dir, max_age)
+    bundle.add_file('/test-page', os.path.join(STATIC_FOLDER, 'test-page.html'))
+    swagger_static = flasgger_static_folder()
+    if swagger_static:
+        bundle.add_directory(static_url_path, swagger_static)
+    return bundle
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Gera as cópias pré-comprimidas dos assets estáticos")
+    parser.add_argument('--cache-dir', default=os.environ.get('STATIC_CACHE_DIR', DEFAULT_CACHE_DIR))
+    args = parser.parse_args()
+
+    bundle = build_bundle(None, args.cache_dir)
+    for url_path, asset in sorted(bundle.assets.items()):
+        sizes = ', '.join(f"{enc}={size}" for enc, (_, size) in asset.variants.items())
+        print(f"{url_path}: {sizes}")
+
+
+if __name__ == '__main__':
+    main()
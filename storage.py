@@ -0,0 +1,275 @@
+"""Backends de armazenamento dos arquivos de mídia
+
+`LocalStorage` grava no disco local (layout particionado de media_layout)
+e `S3Storage` em qualquer serviço compatível com S3 (AWS, MinIO, R2...),
+permitindo compartilhar os arquivos entre instâncias e sobreviver ao disco
+efêmero do Render. O backend é escolhido por variável de ambiente:
+
+    STORAGE_BACKEND=local            (padrão)
+    STORAGE_BACKEND=s3
+    S3_BUCKET=midias
+    S3_ENDPOINT_URL=http://localhost:9000   (MinIO; omitir para AWS)
+    S3_REGION=us-east-1
+    S3_PREFIX=media/
+    STORAGE_REDIRECT=1               (serve_media redireciona para URL pré-assinada)
+    S3_PRESIGN_EXPIRES=3600
+    S3_MULTIPART_CHUNK_MB=8
+    S3_MULTIPART_CONCURRENCY=8
+
+O backend S3 precisa do `boto3` (`pip install boto3`).
+"""
+import os
+import shutil
+import tempfile
+from abc import ABC, abstractmethod
+
+from media_layout import prepare_shard_path, resolve_media_path, shard_dirs
+
+CHUNK_SIZE = 1024 * 1024
+
+
+def _file_mode():
+    """Permissão de um arquivo novo segundo a umask do processo (0644 com 022)"""
+    umask = os.umask(0)
+    os.umask(umask)
+    return 0o666 & ~umask
+
+
+class StorageError(Exception):
+    """Erro de configuração ou de acesso ao backend de armazenamento"""
+
+
+class Storage(ABC):
+    """Interface comum dos backends"""
+
+    name = None
+    listeners = ()
+
+    def add_listener(self, callback):
+        """`callback(filename)` é chamado depois de cada put/delete (ex.: invalidar caches)"""
+        self.listeners = list(self.listeners) + [callback]
+
+    def _changed(self, filename):
+        for callback in self.listeners:
+            callback(filename)
+
+    @abstractmethod
+    def put(self, filename, stream, content_type=None):
+        """Grava o conteúdo de `stream` e retorna o tamanho em bytes"""
+
+    @abstractmethod
+    def get(self, filename, start=0, stop=None):
+        """Iterador de blocos do arquivo, opcionalmente só do intervalo [start, stop)"""
+
+    @abstractmethod
+    def size(self, filename):
+        """Tamanho do arquivo ou None se não existir"""
+
+    def exists(self, filename):
+        return self.size(filename) is not None
+
+    @abstractmethod
+    def delete(self, filename):
+        """Remove o arquivo, ignorando se já não existir"""
+
+    def url(self, filename, expires=3600):
+        """URL pré-assinada para download direto, ou None se não suportado"""
+        return None
+
+    def local_path(self, filename):
+        """Caminho no disco local (para servir via sendfile), ou None"""
+        return None
+
+
+class LocalStorage(Storage):
+    """Arquivos no disco local, em MEDIA_FOLDER/ab/cd/<filename>"""
+
+    name = "local"
+
+    def __init__(self, media_folder):
+        self.media_folder = media_folder
+        # Lida uma vez: os.umask não é seguro entre threads
+        self.file_mode = _file_mode()
+        os.makedirs(media_folder, exist_ok=True)
+
+    def put(self, filename, stream, content_type=None):
+        path = prepare_shard_path(self.media_folder, filename)
+        # Grava num temporário ao lado e renomeia: nunca se serve arquivo pela metade
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.upload-')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                shutil.copyfileobj(stream, f, CHUNK_SIZE)
+                size = f.tell()
+            # mkstemp cria com 0600; o arquivo final tem a permissão de um open() comum
+            os.chmod(tmp_path, self.file_mode)
+            os.replace(tmp_path, path)
+        except BaseException:
+            try:
+                os.remove(tmp_path)
+            except FileNotFoundError:
+                pass
+            raise
+        self._changed(filename)
+        return size
+
+    def get(self, filename, start=0, stop=None):
+        path = resolve_media_path(self.media_folder, filename)
+        if not path:
+            raise FileNotFoundError(filename)
+        f = open(path, 'rb')
+
+        def chunks():
+            with f:
+                f.seek(start)
+                remaining = None if stop is None else stop - start
+                while remaining is None or remaining > 0:
+                    data = f.read(CHUNK_SIZE if remaining is None else min(CHUNK_SIZE, remaining))
+                    if not data:
+                        break
+                    if remaining is not None:
+                        remaining -= len(data)
+                    yield data
+
+        return chunks()
+
+    def size(self, filename):
+        path = resolve_media_path(self.media_folder, filename)
+        if not path:
+            return None
+        try:
+            return os.path.getsize(path)
+        except FileNotFoundError:
+            return None
+
+    def delete(self, filename):
+        path = resolve_media_path(self.media_folder, filename)
+        if not path:
+            return
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        self._changed(filename)
+
+    def local_path(self, filename):
+        return resolve_media_path(self.media_folder, filename)
+
+
+class _CountingReader:
+    """Envolve um stream contando os bytes lidos (o boto3 só chama read)"""
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.count = 0
+
+    def read(self, size=-1):
+        data = self.stream.read(size)
+        self.count += len(data)
+        return data
+
+
+class S3Storage(Storage):
+    """Arquivos num bucket compatível com S3
+
+    Uploads grandes usam multipart em paralelo (TransferConfig do boto3), e
+    as chaves reaproveitam o particionamento `ab/cd/` para distribuir a carga
+    entre prefixos.
+    """
+
+    name = "s3"
+
+    def __init__(self, bucket, endpoint_url=None, region=None, prefix='',
+                 multipart_chunk=8 * 1024 * 1024, multipart_concurrency=8, client=None):
+        try:
+            import boto3
+            from boto3.s3.transfer import TransferConfig
+            from botocore.exceptions import ClientError
+        except ImportError:
+            raise StorageError("STORAGE_BACKEND=s3 requer o pacote boto3 (pip install boto3)")
+
+        if not bucket:
+            raise StorageError("S3_BUCKET não configurado")
+
+        self.bucket = bucket
+        self.prefix = prefix
+        self.client = client or boto3.client('s3', endpoint_url=endpoint_url, region_name=region)
+        self.transfer_config = TransferConfig(
+            multipart_threshold=multipart_chunk,
+            multipart_chunksize=multipart_chunk,
+            max_concurrency=multipart_concurrency,
+            use_threads=True
+        )
+        self._client_error = ClientError
+
+    def key(self, filename):
+        level1, level2 = shard_dirs(filename)
+        return f"{self.prefix}{level1}/{level2}/{filename}"
+
+    def _not_found(self, error):
+        code = error.response.get('Error', {}).get('Code')
+        return code in ('404', 'NoSuchKey', 'NotFound')
+
+    def put(self, filename, stream, content_type=None):
+        reader = _CountingReader(stream)
+        extra = {'ContentType': content_type} if content_type else None
+        self.client.upload_fileobj(reader, self.bucket, self.key(filename),
+                                   ExtraArgs=extra, Config=self.transfer_config)
+        self._changed(filename)
+        return reader.count
+
+    def get(self, filename, start=0, stop=None):
+        params = {'Bucket': self.bucket, 'Key': self.key(filename)}
+        if start or stop is not None:
+            params['Range'] = f"bytes={start}-{'' if stop is None else stop - 1}"
+        try:
+            body = self.client.get_object(**params)['Body']
+        except self._client_error as e:
+            if self._not_found(e):
+                raise FileNotFoundError(filename)
+            raise
+
+        def chunks():
+            try:
+                for data in body.iter_chunks(CHUNK_SIZE):
+                    yield data
+            finally:
+                body.close()
+
+        return chunks()
+
+    def size(self, filename):
+        try:
+            head = self.client.head_object(Bucket=self.bucket, Key=self.key(filename))
+        except self._client_error as e:
+            if self._not_found(e):
+                return None
+            raise
+        return head['ContentLength']
+
+    def delete(self, filename):
+        self.client.delete_object(Bucket=self.bucket, Key=self.key(filename))
+        self._changed(filename)
+
+    def url(self, filename, expires=3600):
+        return self.client.generate_presigned_url(
+            'get_object',
+            Params={'Bucket': self.bucket, 'Key': self.key(filename)},
+            ExpiresIn=expires
+        )
+
+
+def create_storage(media_folder):
+    """Instancia o backend configurado em STORAGE_BACKEND"""
+    backend = os.environ.get('STORAGE_BACKEND', 'local').lower()
+    if backend == 'local':
+        return LocalStorage(media_folder)
+    if backend == 's3':
+        return S3Storage(
+            bucket=os.environ.get('S3_BUCKET'),
+            endpoint_url=os.environ.get('S3_ENDPOINT_URL') or None,
+            region=os.environ.get('S3_REGION') or None,
+            prefix=os.environ.get('S3_PREFIX', ''),
+            multipart_chunk=int(os.environ.get('S3_MULTIPART_CHUNK_MB', 8)) * 1024 * 1024,
+            multipart_concurrency=int(os.environ.get('S3_MULTIPART_CONCURRENCY', 8))
+        )
+    raise StorageError(f"STORAGE_BACKEND desconhecido: {backend}")
@@ -0,0 +1,32 @@
+import importlib
+import os
+import sys
+
+import pytest
+
+# Os módulos da API ficam na raiz do repositório
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def load_app(tmp_path, monkeypatch):
+    """Importa app.py de novo com as variáveis de ambiente do teste"""
+    def load(**env):
+        base = {
+            'DB_FILE': str(tmp_path / 'local.db'),
+            'MEDIA_FOLDER': str(tmp_path / 'media'),
+            'DEVICE_DB_FOLDER': str(tmp_path / 'devices'),
+            'BACKUP_DIR': str(tmp_path / 'backups'),
+            'WAVEFORM_FOLDER': str(tmp_path / 'waveforms'),
+            'STATIC_BUNDLE': '0',
+            'ADMISSION_CONTROL': '0',
+            'MEDIA_SHARD_MIGRATION': '0',
+            'WAVEFORM_ON_UPLOAD': '0',
+            'DATABASE_URL': '',
+        }
+        for name, value in dict(base, **env).items():
+            monkeypatch.setenv(name, value)
+        monkeypatch.delitem(sys.modules, 'app', raising=False)
+        return importlib.import_module('app')
+    yield load
+    sys.modules.pop('app', None)
@@ -0,0 +1,122 @@
+"""Controle de admissão (admission.py): classes de rota, token buckets e middleware"""
+import pytest
+
+from admission import (ADMIN, API, EVENTS, HEALTH, STREAMING, UPLOAD, AdmissionMiddleware, TokenBuckets,
+                       classify, parse_rate)
+
+
+@pytest.mark.parametrize('method, path, expected', [
+    ('GET', '/test', HEALTH),
+    ('GET', '/api/events', EVENTS),
+    ('GET', '/api/midias/media/a.mp3', STREAMING),
+    ('GET', '/api/files/a.mp3', STREAMING),
+    ('GET', '/api/export', STREAMING),
+    ('POST', '/api/midias/upload', UPLOAD),
+    ('POST', '/api/import', UPLOAD),
+    ('GET', '/api/midias/upload', API),
+    ('GET', '/debug', ADMIN),
+    ('POST', '/api/admin/backup', ADMIN),
+    ('GET', '/api/midias', API),
+    ('GET', '/api/events/extra', API),
+])
+def test_classify(method, path, expected):
+    assert classify(method, path) == expected
+
+
+def test_parse_rate():
+    assert parse_rate('', (1, 2)) == (1, 2)
+    assert parse_rate('5', None) == (5.0, 5.0)
+    assert parse_rate('0.5', None) == (0.5, 1.0)
+    assert parse_rate('2:10', None) == (2.0, 10.0)
+
+
+def test_token_bucket_burst_and_refill():
+    buckets = TokenBuckets(rate=2, burst=3)
+    assert [buckets.take('a', now=0) for _ in range(3)] == [0, 0, 0]
+    assert buckets.take('a', now=0) == pytest.approx(0.5)
+    # Outra chave tem o próprio bucket
+    assert buckets.take('b', now=0) == 0
+    # 2 tokens por segundo, sem passar da rajada
+    assert buckets.take('a', now=0.5) == 0
+    assert [buckets.take('a', now=100) for _ in range(4)] == [0, 0, 0, pytest.approx(0.5)]
+
+
+def test_token_bucket_refund():
+    buckets = TokenBuckets(rate=1, burst=1)
+    assert buckets.take('a', now=0) == 0
+    buckets.refund('a')
+    assert buckets.take('a', now=0) == 0
+    assert buckets.take('a', now=0) > 0
+    # Não passa da rajada nem cria chaves
+    buckets.refund('a')
+    buckets.refund('a')
+    assert buckets.take('a', now=0) == 0 and buckets.take('a', now=0) > 0
+    buckets.refund('unknown')
+    assert 'unknown' not in buckets._buckets
+
+
+def test_token_bucket_lru_limit():
+    buckets = TokenBuckets(rate=1, burst=1, max_keys=2)
+    for key in ('a', 'b', 'c'):
+        buckets.take(key, now=0)
+    assert list(buckets._buckets) == ['b', 'c']
+
+
+def ok_app(environ, start_response):
+    start_response('200 OK', [('Content-Type', 'text/plain')])
+    return [b'ok']
+
+
+def call(middleware, path='/api/midias', method='GET', **environ):
+    statuses = []
+    environ = dict({'REQUEST_METHOD': method, 'PATH_INFO': path, 'REMOTE_ADDR': '10.0.0.1'}, **environ)
+    body = middleware(environ, lambda status, headers: statuses.append(status))
+    list(body)
+    if hasattr(body, 'close'):
+        body.close()
+    return int(statuses[0].split()[0])
+
+
+def test_device_budget_is_not_burned_by_ip_rejection():
+    # Cada aparelho: 2 requisições; o IP inteiro: 4
+    middleware = AdmissionMiddleware(ok_app, {API: (0.001, 2)}, {}, devices_per_ip=2)
+
+    assert [call(middleware, HTTP_X_DEVICE_ID='d1') for _ in range(3)] == [200, 200, 429]
+    assert [call(middleware, HTTP_X_DEVICE_ID='d2') for _ in range(2)] == [200, 200]
+    # IP esgotado: d3 é recusado sem perder o próprio orçamento
+    assert call(middleware, HTTP_X_DEVICE_ID='d3') == 429
+    assert middleware.buckets[API].take('10.0.0.1|d3', now=None) == 0
+    assert middleware.buckets[API].take('10.0.0.1|d3', now=None) == 0
+
+
+def test_rotating_device_ids_share_the_ip_budget():
+    middleware = AdmissionMiddleware(ok_app, {API: (0.001, 1)}, {}, devices_per_ip=3)
+
+    statuses = [call(middleware, HTTP_X_DEVICE_ID=f'd{i}') for i in range(5)]
+    assert statuses == [200, 200, 200, 429, 429]
+    # Outro IP não é afetado
+    assert call(middleware, REMOTE_ADDR='10.0.0.2') == 200
+
+
+def test_proxy_hops_use_forwarded_address():
+    middleware = AdmissionMiddleware(ok_app, {API: (0.001, 1)}, {}, proxy_hops=1, devices_per_ip=1)
+    forwarded = {'REMOTE_ADDR': '127.0.0.1'}
+    assert call(middleware, HTTP_X_FORWARDED_FOR='spoofed, 1.1.1.1', **forwarded) == 200
+    assert call(middleware, HTTP_X_FORWARDED_FOR='1.1.1.1', **forwarded) == 429
+    assert call(middleware, HTTP_X_FORWARDED_FOR='2.2.2.2', **forwarded) == 200
+
+
+def test_concurrency_cap_until_body_is_closed():
+    middleware = AdmissionMiddleware(ok_app, {}, {STREAMING: 1})
+    environ = {'REQUEST_METHOD': 'GET', 'PATH_INFO': '/api/midias/media/a.mp3', 'REMOTE_ADDR': '10.0.0.1'}
+
+    body = middleware(dict(environ), lambda status, headers: None)
+    assert call(middleware, '/api/midias/media/b.mp3') == 503
+    # Health e outras classes continuam passando
+    assert call(middleware, '/test') == 200
+    assert call(middleware, '/api/midias') == 200
+    body.close()
+    assert call(middleware, '/api/midias/media/b.mp3') == 200
+
+    snapshot = middleware.snapshot()["classes"][STREAMING]
+    assert (snapshot["active"], snapshot["peak"], snapshot["overloaded"], snapshot["admitted"]) == (0, 1, 1, 2)
@@ -0,0 +1,243 @@
+"""Rotas do app.py (listagem, playlists, plays) numa base SQLite temporária"""
+import os
+import sqlite3
+import threading
+import wave
+
+import pytest
+
+from media_layout import shard_path
+
+
+@pytest.fixture
+def app(load_app):
+    return load_app()
+
+
+@pytest.fixture
+def client(app):
+    return app.app.test_client()
+
+
+def add_midia(client, name, **extra):
+    body = dict({"name": name, "uri": f"/api/midias/media/{name}.mp3", "mimeType": "audio/mpeg"}, **extra)
+    response = client.post('/api/midias', json=body)
+    assert response.status_code == 201
+    return response.get_json()['id']
+
+
+def test_list_midias_does_not_touch_the_schema(app, client, monkeypatch):
+    add_midia(client, 'a')
+
+    def fail():
+        raise AssertionError("init_db chamado na requisição")
+    monkeypatch.setattr(app, 'init_db', fail)
+
+    assert [m['name'] for m in client.get('/api/midias').get_json()] == ['a']
+
+
+def test_list_midias_reports_read_errors(app, client, monkeypatch):
+    def broken():
+        raise RuntimeError("base indisponível")
+    monkeypatch.setattr(app, 'midia_stores', broken)
+
+    response = client.get('/api/midias')
+    assert response.status_code == 500
+    assert response.get_json()['error'] == "base indisponível"
+
+
+def test_waveform_reports_its_source(app, client):
+    path = shard_path(app.MEDIA_FOLDER, 'tone.wav')
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with wave.open(path, 'wb') as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(8000)
+        wav.writeframes(b'\xff\x7f\x01\x80' * 2048)
+    midia_id = add_midia(client, 'tone', uri='/api/midias/media/tone.wav', mimeType='audio/wav')
+
+    response = client.get(f'/api/midias/{midia_id}/waveform')
+    assert response.status_code == 200
+    assert (response.headers['X-Waveform-Source'], response.headers['X-Waveform-Estimated']) == ('pcm', '0')
+    assert 'X-Waveform-Source' in response.headers['Access-Control-Expose-Headers']
+
+    body = client.get(f'/api/midias/{midia_id}/waveform?format=json').get_json()
+    assert (body['source'], body['estimated'], body['bits']) == ('pcm', False, 8)
+
+
+# ------------------------------------------------------------
+# Playlists: ordem por chaves espaçadas
+# ------------------------------------------------------------
+
+def playlist_names(client, playlist_id):
+    items = client.get(f'/api/playlists/{playlist_id}/items').get_json()['items']
+    return [item['midia']['name'] for item in items]
+
+
+def item_positions(app, playlist_id):
+    conn = sqlite3.connect(app.DB_FILE)
+    rows = conn.execute('SELECT id, position FROM playlist_items WHERE playlistId = ? ORDER BY position',
+                        (playlist_id,)).fetchall()
+    conn.close()
+    return rows
+
+
+@pytest.fixture
+def playlist(client):
+    """Playlist com as mídias a, b, c; retorna (id, {nome: midiaId}, [itemIds])"""
+    ids = {name: add_midia(client, name) for name in ('a', 'b', 'c', 'x')}
+    playlist_id = client.post('/api/playlists', json={
+        "name": "p", "midiaIds": [ids['a'], ids['b'], ids['c']]
+    }).get_json()['id']
+    items = client.get(f'/api/playlists/{playlist_id}/items').get_json()['items']
+    return playlist_id, ids, [item['itemId'] for item in items]
+
+
+def test_insert_between_items_writes_one_row(app, client, playlist):
+    playlist_id, ids, (first, second, third) = playlist
+    before = dict(item_positions(app, playlist_id))
+
+    response = client.post(f'/api/playlists/{playlist_id}/items', json={"midiaId": ids['x'], "after": first})
+    assert response.status_code == 201
+    new_item = response.get_json()['itemId']
+    assert playlist_names(client, playlist_id) == ['a', 'x', 'b', 'c']
+
+    after = dict(item_positions(app, playlist_id))
+    assert {k: v for k, v in after.items() if k != new_item} == before
+    assert after[new_item] == (before[first] + before[second]) // 2
+
+    client.post(f'/api/playlists/{playlist_id}/items', json={"midiaId": ids['x'], "before": first})
+    client.post(f'/api/playlists/{playlist_id}/items', json={"midiaId": ids['x']})
+    assert playlist_names(client, playlist_id) == ['x', 'a', 'x', 'b', 'c', 'x']
+
+
+def test_repeated_inserts_renumber_the_playlist(app, client, playlist, monkeypatch):
+    playlist_id, ids, (first, second, third) = playlist
+    # Com passo 4, o espaço entre dois vizinhos acaba na terceira inserção
+    monkeypatch.setattr(app, 'PLAYLIST_POSITION_STEP', 4)
+    renumbered = []
+    renumber = app.renumber_playlist
+    monkeypatch.setattr(app, 'renumber_playlist', lambda cursor, pid: renumbered.append(pid) or renumber(cursor, pid))
+    conn = sqlite3.connect(app.DB_FILE)
+    conn.execute('UPDATE playlist_items SET position = id * 4 WHERE playlistId = ?', (playlist_id,))
+    conn.commit()
+    conn.close()
+
+    inserted = []
+    for _ in range(5):
+        response = client.post(f'/api/playlists/{playlist_id}/items', json={"midiaId": ids['x'], "after": first})
+        assert response.status_code == 201
+        inserted.append(response.get_json()['itemId'])
+
+    # Cada inserção logo após `first`: a mais recente fica mais perto dele
+    order = [item_id for item_id, _ in item_positions(app, playlist_id)]
+    assert order == [first] + inserted[::-1] + [second, third]
+    positions = [position for _, position in item_positions(app, playlist_id)]
+    assert len(set(positions)) == len(positions)
+    assert renumbered and set(renumbered) == {playlist_id}
+
+
+def test_move_item(app, client, playlist):
+    playlist_id, ids, (first, second, third) = playlist
+
+    assert client.put(f'/api/playlists/{playlist_id}/items/{third}', json={"before": first}).status_code == 200
+    assert playlist_names(client, playlist_id) == ['c', 'a', 'b']
+    assert client.put(f'/api/playlists/{playlist_id}/items/{third}', json={"after": second}).status_code == 200
+    assert playlist_names(client, playlist_id) == ['a', 'b', 'c']
+    assert client.put(f'/api/playlists/{playlist_id}/items/{first}', json={}).status_code == 200
+    assert playlist_names(client, playlist_id) == ['b', 'c', 'a']
+
+    # Relativo a si mesmo ou a um item de outra playlist: 400, nada muda
+    assert client.put(f'/api/playlists/{playlist_id}/items/{first}', json={"after": first}).status_code == 400
+    assert client.put(f'/api/playlists/{playlist_id}/items/{first}', json={"after": 9999}).status_code == 400
+    assert client.put(f'/api/playlists/9999/items/{first}', json={}).status_code == 404
+    assert playlist_names(client, playlist_id) == ['b', 'c', 'a']
+
+
+@pytest.mark.parametrize('value', ['1', 1.5, True, {"id": 1}, [1]])
+def test_neighbours_must_be_integers(client, playlist, value):
+    playlist_id, ids, (first, _, _) = playlist
+
+    response = client.post(f'/api/playlists/{playlist_id}/items', json={"midiaId": ids['x'], "after": value})
+    assert response.status_code == 400
+    response = client.put(f'/api/playlists/{playlist_id}/items/{first}', json={"before": value})
+    assert response.status_code == 400
+    assert playlist_names(client, playlist_id) == ['a', 'b', 'c']
+
+
+def test_concurrent_inserts_get_distinct_positions(app, playlist):
+    playlist_id, ids, (first, _, _) = playlist
+    barrier = threading.Barrier(6)
+    errors = []
+
+    def run():
+        barrier.wait()
+        try:
+            for _ in range(5):
+                app.place_playlist_item(playlist_id, midia_id=ids['x'], after_item=first)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=run) for _ in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    # Vizinhos lidos e item gravado na mesma transação IMMEDIATE
+    assert not errors
+    positions = [position for _, position in item_positions(app, playlist_id)]
+    assert len(positions) == 33 and len(set(positions)) == 33
+
+
+# ------------------------------------------------------------
+# Plays
+# ------------------------------------------------------------
+
+def test_record_play(app, client):
+    midia_id = add_midia(client, 'a')
+
+    assert client.post(f'/api/midias/{midia_id}/play').status_code == 202
+    assert client.post(f'/api/midias/{midia_id}/play', json={"playlistId": 1}).status_code == 202
+    app.play_buffer.flush()
+    assert client.get(f'/api/midias/{midia_id}').get_json()['playCount'] == 2
+
+
+@pytest.mark.parametrize('body', [{"playlistId": {"id": 1}}, {"playlistId": "1"}, {"playlistId": True}, [1]])
+def test_record_play_rejects_invalid_playlist_id(app, client, body):
+    midia_id = add_midia(client, 'a')
+
+    assert client.post(f'/api/midias/{midia_id}/play', json=body).status_code == 400
+    assert app.play_buffer.pending() == 0
+
+
+def test_record_play_for_unknown_midia(app, client):
+    assert client.post('/api/midias/9999/play').status_code == 404
+    assert app.play_buffer.pending() == 0
+
+
+# ------------------------------------------------------------
+# Cache de mídias quentes
+# ------------------------------------------------------------
+
+def test_cached_response_releases_the_lease_on_error(app, client, monkeypatch):
+    path = shard_path(app.MEDIA_FOLDER, 'a.mp3')
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(b'x' * 1000)
+    monkeypatch.setattr(app.media_cache, 'admit_after', 1)
+
+    response = client.get('/api/midias/media/a.mp3', buffered=True)
+    assert response.status_code == 200 and response.data == b'x' * 1000
+    entry = app.media_cache._entries['a.mp3']
+    assert entry.readers == 0
+
+    def broken(nbytes):
+        raise RuntimeError("falha ao montar a resposta")
+    monkeypatch.setattr(app.media_cache, 'record_bytes', broken)
+    assert client.get('/api/midias/media/a.mp3').status_code == 404
+    assert entry.readers == 0
+
+    # Despejado depois da falha: sem leitura pendente, o mmap fecha na hora
+    app.media_cache.invalidate('a.mp3')
+    assert entry.closed
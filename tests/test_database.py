@@ -0,0 +1,220 @@
+"""MidiaStore (database.py) numa base SQLite temporária e o app com DATABASE_URL"""
+import sqlite3
+import threading
+
+import pytest
+
+from database import MidiaStore, copy_library, create_db_engine, midias, sqlite_url
+from sqlalchemy import select
+
+
+def midia(name, uri, **extra):
+    return dict({"name": name, "uri": uri, "mimeType": "audio/mpeg"}, **extra)
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = MidiaStore(create_db_engine(sqlite_url(str(tmp_path / 'midias.db'))))
+    store.create_schema()
+    return store
+
+
+def test_insert_update_delete(store):
+    midia_id = store.insert_midia(midia('a', '/api/midias/media/a.mp3', deviceId='d1', fileSize=10))
+
+    row = store.get_midias([midia_id])[0]
+    assert (row.name, row.deviceId, row.fileSize, row.isFavorite) == ('a', 'd1', 10, 0)
+
+    assert store.update_midia(midia_id, 'b', True) == (True, 'd1')
+    assert store.get_midias([midia_id])[0].isFavorite == 1
+    assert store.update_midia(midia_id + 1, 'x', False) == (False, None)
+
+    assert store.delete_midia(midia_id) == ('/api/midias/media/a.mp3', 'd1')
+    assert store.delete_midia(midia_id) is None
+    assert store.list_midias() == []
+
+
+def test_uris_are_stored_in_canonical_form(store):
+    absolute = store.insert_midia(midia('a', 'http://localhost:5003/api/midias/media/a.mp3'))
+    store.insert_midia(midia('b', '/api/files/a.mp3'))
+    store.insert_midia(midia('c', 'https://cdn.example.com/c.mp3'))
+
+    assert store.get_uri(absolute) == '/api/midias/media/a.mp3'
+    assert store.count_uri_references(['/api/midias/media/a.mp3', '/api/files/a.mp3']) == 2
+    assert store.count_uri_references(['https://cdn.example.com/c.mp3']) == 1
+
+
+def test_normalize_media_uris(store):
+    with store.write_engine.begin() as conn:
+        conn.execute(midias.insert().values(name='a', uri='http://h/api/files/a.mp3?x=1', mimeType='audio/mpeg'))
+
+    assert store.normalize_media_uris() == 1
+    assert [row.uri for row in store.list_midias()] == ['/api/midias/media/a.mp3']
+    assert store.normalize_media_uris() == 0
+
+
+def test_import_skips_existing_uris(store):
+    store.insert_midia(midia('a', '/api/midias/media/a.mp3', deviceId='d1'))
+
+    inserted, skipped = store.import_midias([
+        midia('a', 'http://outro/api/midias/media/a.mp3', deviceId='d1'),
+        midia('a', '/api/midias/media/a.mp3', deviceId='d2'),
+        midia('b', '/api/midias/media/b.mp3'),
+        midia('b', '/api/midias/media/b.mp3'),
+    ])
+    assert (inserted, skipped) == (2, 2)
+
+
+def test_concurrent_imports_do_not_duplicate(tmp_path):
+    db_file = str(tmp_path / 'midias.db')
+    stores = [MidiaStore(create_db_engine(sqlite_url(db_file))) for _ in range(6)]
+    stores[0].create_schema()
+    rows = [midia(f'm{i}', f'/api/midias/media/{i}.mp3', deviceId='d') for i in range(20)]
+    barrier = threading.Barrier(len(stores))
+    errors = []
+
+    def run(store):
+        barrier.wait()
+        try:
+            for row in rows:
+                store.import_midias([row])
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=run, args=(s,)) for s in stores]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert not errors
+    conn = sqlite3.connect(db_file)
+    assert conn.execute('SELECT COUNT(*), COUNT(DISTINCT uri) FROM midias').fetchone() == (20, 20)
+    conn.close()
+
+
+def test_reads_run_inside_a_transaction(store):
+    # O pysqlite sozinho não abriria transação para um SELECT
+    with store.engine.connect() as conn:
+        conn.execute(select(midias.c.id))
+        assert conn.in_transaction()
+
+
+def test_plays_and_played_midias(store):
+    first = store.insert_midia(midia('a', 'a'))
+    second = store.insert_midia(midia('b', 'b'))
+    store.insert_midia(midia('never', 'c'))
+
+    store.record_plays([(3, '2024-01-01 10:00:00', first), (1, '2024-01-02 10:00:00', second)])
+    store.record_plays([(1, '2023-12-31 10:00:00', first)])
+
+    by_count = store.played_midias('playCount', 10, 'idx_midias_play_count')
+    assert [(row.name, row.playCount) for row in by_count] == [('a', 4), ('b', 1)]
+
+    # Um play mais antigo não faz lastPlayed voltar
+    recent = store.played_midias('lastPlayed', 10, 'idx_midias_last_played')
+    assert [(row.name, row.lastPlayed) for row in recent] == [
+        ('b', '2024-01-02 10:00:00'), ('a', '2024-01-01 10:00:00')
+    ]
+
+    # Editar a mídia não muda a ordem das tocadas recentemente
+    store.update_midia(first, 'a2', True)
+    assert [row.name for row in store.played_midias('lastPlayed', 10, 'idx_midias_last_played')] == ['b', 'a2']
+
+
+def test_device_midias_pagination(store):
+    for i in range(5):
+        store.insert_midia(midia(f'm{i}', f'u{i}', deviceId='d1'))
+    store.insert_midia(midia('other', 'x', deviceId='d2'))
+
+    page = store.device_midias('d1', 3)
+    assert [row.name for row in page] == ['m4', 'm3', 'm2']
+    last = page[-1]
+    assert [row.name for row in store.device_midias('d1', 3, (last.dateAdded, last.id))] == ['m1', 'm0']
+    assert sorted(store.devices()) == [('d1', None, 5), ('d2', None, 1)]
+
+
+def test_library_stats_and_fingerprints(store):
+    store.insert_midia(midia('a', 'a', fileSize=100, duration=60, isFavorite=True, audioFingerprint='f1'))
+    store.insert_midia(midia('b', 'b', fileSize=50, audioFingerprint='f1'))
+    store.insert_midia(dict(midia('v', 'v'), mimeType='video/mp4'))
+
+    stats = store.library_stats()
+    assert (stats["total"], stats["favorites"], stats["total_size"], stats["total_duration"]) == (3, 1, 150, 60)
+    assert stats["by_type"] == {"audio/mpeg": 2, "video/mp4": 1}
+    assert [row.name for row in store.find_by_fingerprint('f1')] == ['a', 'b']
+    assert store.fingerprint_counts() == [('f1', 2)]
+
+
+def test_create_schema_upgrades_old_table(tmp_path):
+    db_file = str(tmp_path / 'old.db')
+    conn = sqlite3.connect(db_file)
+    conn.execute('''
+        CREATE TABLE midias (id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT NOT NULL, uri TEXT NOT NULL,
+            mimeType TEXT NOT NULL, cover TEXT, isFavorite INTEGER DEFAULT 0, duration INTEGER DEFAULT 0,
+            fileSize INTEGER DEFAULT 0, dateAdded TEXT, lastAccessed TEXT, deviceId TEXT, deviceName TEXT)
+    ''')
+    conn.execute("INSERT INTO midias (name, uri, mimeType, lastAccessed) VALUES ('a', 'u', 'audio/mpeg', '2020')")
+    conn.commit()
+
+    store = MidiaStore(create_db_engine(sqlite_url(db_file)))
+    store.create_schema()
+    store.create_schema()
+
+    assert [c["name"] for c in store.columns()][-3:] == ['playCount', 'audioFingerprint', 'lastPlayed']
+    indexes = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+    assert {'idx_midias_uri', 'idx_midias_last_played', 'idx_midias_fingerprint'} <= indexes
+    conn.close()
+
+
+def test_copy_library_keeps_ids(store, tmp_path):
+    ids = [store.insert_midia(midia(f'm{i}', f'u{i}')) for i in range(5)]
+    store.delete_midia(ids[1])
+    target = MidiaStore(create_db_engine(sqlite_url(str(tmp_path / 'server.db'))))
+
+    assert copy_library([store], target, batch_size=2) == 4
+    assert [row.id for row in target.midias_after(0, 10)] == [ids[0]] + ids[2:]
+
+
+def test_app_sqlite_backend(load_app, tmp_path):
+    app = load_app(DEDICATED_DEVICES='big')
+    client = app.app.test_client()
+
+    shared = client.post('/api/midias', json=midia('a', '/api/midias/media/a.mp3')).get_json()['id']
+    dedicated = client.post('/api/midias', json=midia('b', 'b', deviceId='big')).get_json()['id']
+    app.flush_play_events({shared: (2, '2024-01-01 10:00:00'), dedicated: (1, '2024-01-02 10:00:00')})
+
+    assert {m['name'] for m in client.get('/api/midias').get_json()} == {'a', 'b'}
+    assert [m['name'] for m in client.get('/api/midias/recent').get_json()['midias']] == ['b', 'a']
+    assert client.get('/api/db/info').get_json()['database_backend'] == 'sqlite'
+    assert client.delete(f'/api/midias/{dedicated}').status_code == 200
+    assert [m['name'] for m in client.get('/api/midias').get_json()] == ['a']
+
+
+def test_app_with_database_url(load_app, tmp_path):
+    server_db = tmp_path / 'server.db'
+    app = load_app(DATABASE_URL=f'sqlite:///{server_db}')
+    client = app.app.test_client()
+
+    created = client.post('/api/midias', json=midia('a', 'http://localhost:5003/api/midias/media/a.mp3'))
+    assert created.status_code == 201
+    midia_id = created.get_json()['id']
+
+    # A mídia fica no banco do DATABASE_URL, não no SQLite local
+    conn = sqlite3.connect(server_db)
+    assert conn.execute('SELECT id, uri FROM midias').fetchall() == [(midia_id, '/api/midias/media/a.mp3')]
+    local = sqlite3.connect(tmp_path / 'local.db')
+    assert local.execute('SELECT COUNT(*) FROM midias').fetchone() == (0,)
+
+    assert client.get(f'/api/midias/{midia_id}').get_json()['name'] == 'a'
+    assert client.get('/api/stats').get_json()['total_midias'] == 1
+    assert client.get('/api/db/info').get_json()['database_backend'] == 'sqlite'
+
+    playlist = client.post('/api/playlists', json={"name": "p", "midiaIds": [midia_id]}).get_json()
+    items = client.get(f"/api/playlists/{playlist['id']}/items").get_json()
+    assert [item['midia']['name'] for item in items['items']] == ['a']
+
+    assert client.delete(f'/api/midias/{midia_id}').status_code == 200
+    assert conn.execute('SELECT COUNT(*) FROM midias').fetchone() == (0,)
+    conn.close()
+    local.close()
@@ -0,0 +1,101 @@
+"""Eventos da biblioteca (events.py): cursor SSE, leitura atrasada e retenção"""
+import sqlite3
+
+import pytest
+
+from events import EventHub, create_events_schema, format_cursor, parse_cursor, record_event
+
+
+@pytest.fixture
+def sources(tmp_path):
+    files = {}
+    for shard in (0, 1):
+        files[shard] = str(tmp_path / f'{shard}.db')
+        conn = sqlite3.connect(files[shard])
+        create_events_schema(conn.cursor())
+        conn.commit()
+        conn.close()
+    return files
+
+
+def record(db_file, count):
+    return [record_event(db_file, 'midia.updated', midia_id=i) for i in range(count)]
+
+
+def test_cursor_round_trip():
+    assert format_cursor({1: 35, 0: 120}) == '0:120,1:35'
+    assert parse_cursor('0:120,1:35') == {0: 120, 1: 35}
+    for value in ('abc', '0:x', '0120,1:35', ''):
+        with pytest.raises(ValueError):
+            parse_cursor(value)
+
+
+def test_cursor_from_last_event_id(sources):
+    hub = EventHub(lambda: sources)
+    hub.last_ids = {0: 5, 1: 7}
+    assert hub.cursor_from(None) == {0: 5, 1: 7}
+    # Id numérico (formato anterior): vale para a base principal
+    assert hub.cursor_from('3') == {0: 3, 1: 7}
+    assert hub.cursor_from('0:2,1:4') == {0: 2, 1: 4}
+
+
+def test_events_after_reads_buffer_and_database(sources):
+    hub = EventHub(lambda: sources, poll_interval=3600, backlog=3)
+    record(sources[0], 2)
+    hub.start()
+    cursor = hub.current_cursor()
+    assert cursor == {0: 2, 1: 0}
+    assert hub.events_after(cursor) == []
+
+    ids = record(sources[1], 2)
+    with sqlite3.connect(sources[1]) as conn:
+        hub._read_new(conn, 1)
+    events = hub.events_after(cursor)
+    assert [(e["shard"], e["id"]) for e in events] == [(1, ids[0]), (1, ids[1])]
+
+    # Antes do buffer (backlog 3): lido da base
+    record(sources[0], 3)
+    with sqlite3.connect(sources[0]) as conn:
+        hub._read_new(conn, 0)
+    events = hub.events_after({0: 0, 1: 2})
+    assert [(e["shard"], e["id"]) for e in events] == [(0, 1), (0, 2), (0, 3)]
+
+
+def test_events_after_reset_when_retention_passed(sources):
+    hub = EventHub(lambda: sources, poll_interval=3600, backlog=2, retention=3)
+    hub.start()
+    record(sources[0], 8)
+    with sqlite3.connect(sources[0]) as conn:
+        hub._read_new(conn, 0)
+        hub._prune(conn, 0)
+        assert conn.execute('SELECT MIN(id) FROM midia_events').fetchone()[0] == 6
+
+    # Eventos 1-5 removidos: quem parou no 2 recarrega a biblioteca
+    assert hub.events_after({0: 2, 1: 0}) is None
+    assert [e["id"] for e in hub.events_after({0: 6, 1: 0})] == [7, 8]
+
+    stream = hub.stream({0: 2, 1: 0}, max_duration=5)
+    assert next(stream).startswith('retry:')
+    assert next(stream) == 'id: 0:8,1:0\nevent: reset\ndata: {}\n\n'
+    stream.close()
+
+
+def test_prune_runs_once_per_threshold(sources):
+    hubs = [EventHub(lambda: sources, retention=3) for _ in range(2)]
+    record(sources[0], 5)
+    conns = [sqlite3.connect(sources[0]) for _ in hubs]
+    for hub, conn in zip(hubs, conns):
+        hub._read_new(conn, 0)
+
+    statements = []
+    for conn in conns:
+        conn.set_trace_callback(statements.append)
+    for hub, conn in zip(hubs, conns):
+        hub._prune(conn, 0)
+        hub._prune(conn, 0)
+    # Outro worker já apagou; limite sem avanço nem consulta a base
+    assert [s for s in statements if s.startswith('DELETE')] == ['DELETE FROM midia_events WHERE id <= 2']
+    assert len([s for s in statements if s.startswith('SELECT')]) == 2
+    assert [hub.stats["pruned"] for hub in hubs] == [2, 0]
+    for conn in conns:
+        conn.close()
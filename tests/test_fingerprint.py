@@ -0,0 +1,89 @@
+"""Impressão digital do áudio (fingerprint.py): só o áudio entra no hash"""
+import io
+import struct
+
+from fingerprint import audio_fingerprint
+
+MP3_HEADER = bytes([0xFF, 0xFB, 0x90, 0xC0])  # MPEG-1 Layer III, 128 kbps, 44,1 kHz, mono
+MP3_FRAME_SIZE = 144000 * 128 // 44100
+
+
+def fingerprint(data):
+    return audio_fingerprint(io.BytesIO(data))
+
+
+def mp3_audio(seed, frames=4):
+    return b''.join(MP3_HEADER + bytes([(seed + i + j) % 256 for j in range(MP3_FRAME_SIZE - 4)])
+                    for i in range(frames))
+
+
+def id3v2(title, padding=0, footer=False):
+    frame = b'TIT2' + struct.pack('>I', len(title) + 1) + b'\0\0\0' + title
+    body = frame + b'\0' * padding
+    size = bytes([(len(body) >> shift) & 0x7F for shift in (21, 14, 7, 0)])
+    tag = b'ID3\x04\x00' + (b'\x10' if footer else b'\x00') + size + body
+    return tag + (b'3DI\x04\x00\x10' + size if footer else b'')
+
+
+def id3v1(title):
+    return b'TAG' + title.ljust(30, b'\0') + b'\0' * 95
+
+
+def box(kind, *children):
+    body = b''.join(children)
+    return struct.pack('>I', 8 + len(body)) + kind + body
+
+
+def mp4_file(audio, title, free=b''):
+    udta = box(b'udta', box(b'meta', b'\0' * 4, box(b'ilst', box(b'\xa9nam', box(b'data', b'\0' * 8 + title)))))
+    moov = box(b'moov', box(b'mvhd', b'\0' * 100), udta)
+    parts = [box(b'ftyp', b'M4A \0\0\0\0isomM4A '), moov]
+    if free:
+        parts.append(box(b'free', free))
+    return b''.join(parts + [box(b'mdat', audio)])
+
+
+def test_mp3_ignores_id3v2_and_id3v1_tags():
+    audio = mp3_audio(1)
+    variants = [
+        audio,
+        id3v2(b'Lavf') + audio,
+        id3v2(b'Outro titulo', padding=512) + audio + id3v1(b'Outro titulo'),
+        id3v2(b'a') + id3v2(b'b', footer=True) + audio + id3v1(b'x'),
+    ]
+    assert len(set(variants)) == len(variants)
+    assert len({fingerprint(data) for data in variants}) == 1
+
+
+def test_mp3_larger_than_the_sync_search():
+    # O fim do arquivo chega em blocos, depois dos primeiros MAX_SYNC_SEARCH bytes
+    audio = mp3_audio(3, frames=400)
+    assert fingerprint(id3v2(b'x') + audio + id3v1(b'x')) == fingerprint(audio)
+
+
+def test_mp3_with_garbage_after_the_tag():
+    audio = mp3_audio(1)
+    assert fingerprint(id3v2(b't') + b'\0' * 37 + audio) == fingerprint(audio)
+
+
+def test_different_mp3_audio_differs():
+    tag = id3v2(b'mesmo titulo')
+    assert fingerprint(tag + mp3_audio(1)) != fingerprint(tag + mp3_audio(2))
+    # Último frame diferente, com e sem ID3v1
+    assert fingerprint(mp3_audio(1, frames=3)) != fingerprint(mp3_audio(1, frames=4))
+    assert fingerprint(mp3_audio(1) + id3v1(b't')) != fingerprint(mp3_audio(1) + b'\1' * 128)
+
+
+def test_mp4_ignores_moov_metadata():
+    audio = bytes(range(256)) * 40
+    first = mp4_file(audio, b'Titulo')
+    second = mp4_file(audio, b'Outro titulo bem mais longo', free=b'\0' * 64)
+    assert first != second
+    assert fingerprint(first) == fingerprint(second)
+    assert fingerprint(first) != fingerprint(mp4_file(audio[::-1], b'Titulo'))
+
+
+def test_other_formats_and_empty_input():
+    assert fingerprint(b'qualquer coisa') == fingerprint(b'qualquer coisa')
+    assert fingerprint(b'qualquer coisa') != fingerprint(b'outra coisa')
+    assert fingerprint(b'') is None
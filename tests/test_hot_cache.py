@@ -0,0 +1,117 @@
+"""Cache de mídias quentes (hot_cache.py): admissão, despejo, validade e reservas"""
+import os
+
+import pytest
+
+from hot_cache import HotMediaCache
+
+
+@pytest.fixture
+def media(tmp_path):
+    def write(name, size=100, fill=b'a'):
+        path = tmp_path / name
+        path.write_bytes(fill * size)
+        return str(path)
+    return write
+
+
+def read(entry):
+    return b''.join(entry.chunks())
+
+
+def test_admission_threshold():
+    cache = HotMediaCache(1000, 500, admit_after=2)
+    assert not cache.should_admit('a')
+    assert cache.get('a') is None
+    assert not cache.should_admit('a')
+    assert cache.get('a') is None
+    assert cache.should_admit('a')
+    assert cache.snapshot()["misses"] == 2
+
+
+def test_size_limits(media):
+    cache = HotMediaCache(1000, 150, admit_after=0)
+    assert cache.admit_file('big', media('big', 200)) is None
+    assert cache.admit_bytes('empty', b'') is None
+    assert not cache.fits(None)
+    entry = cache.admit_file('a', media('a', 100))
+    assert read(entry) == b'a' * 100
+
+
+def test_lfu_sample_eviction_and_rejection(media):
+    cache = HotMediaCache(250, 250, admit_after=0, sample=2)
+    for name in ('a', 'b'):
+        cache.get(name)
+        cache.admit_bytes(name, name.encode() * 100).release()
+    # 'a' fica mais popular que 'b'
+    for _ in range(3):
+        read(cache.get('a'))
+
+    # 'c' (uma consulta) empata com 'b': 'b' sai, 'a' fica
+    cache.get('c')
+    cache.admit_bytes('c', b'c' * 100).release()
+    assert cache.get('b') is None
+    assert cache.snapshot()["evicted"] == 1
+
+    # 'd' é menos popular que os dois da amostra: não entra
+    assert cache.admit_bytes('d', b'd' * 100) is None
+    assert cache.snapshot()["rejected"] == 1
+    assert read(cache.get('a')) == b'a' * 100
+    assert cache.snapshot()["used_bytes"] == 200
+
+
+def test_stat_change_invalidates_local_entry(media):
+    path = media('a', 100)
+    cache = HotMediaCache(1000, 1000, admit_after=0)
+    cache.admit_file('a', path).release()
+    assert read(cache.get('a')) == b'a' * 100
+
+    with open(path, 'wb') as f:
+        f.write(b'b' * 120)
+    os.utime(path, ns=(0, 1))
+    assert cache.get('a') is None
+    assert cache.snapshot()["invalidated"] == 1
+    assert cache.snapshot()["entries"] == 0
+
+
+def test_remote_entries_expire(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr('hot_cache.time.monotonic', lambda: now[0])
+    cache = HotMediaCache(1000, 1000, admit_after=0, remote_ttl=60)
+    cache.admit_bytes('a', b'a' * 10).release()
+
+    now[0] += 59
+    read(cache.get('a'))
+    now[0] += 2
+    assert cache.get('a') is None
+    assert cache.snapshot()["expired"] == 1
+
+
+def test_retired_mmap_closes_after_last_release(media):
+    cache = HotMediaCache(1000, 1000, admit_after=0)
+    entry = cache.admit_file('a', media('a', 100))
+    reader = cache.get('a')
+    assert entry is reader and entry.readers == 2
+
+    cache.invalidate('a')
+    assert entry.retired and not entry.closed
+    body = entry.chunks(0, 10)
+    assert b''.join(body) == b'a' * 10
+    assert not entry.closed
+    # A última leitura terminou: o mmap é fechado
+    reader.chunks().close()
+    assert entry.closed and entry.data.closed
+    # Um item fechado não é mais reservado
+    assert not entry.acquire()
+
+
+def test_rejected_duplicate_mmap_is_closed(media):
+    path = media('a', 100)
+    cache = HotMediaCache(1000, 1000, admit_after=0)
+    first = cache.admit_file('a', path)
+    second = cache.admit_file('a', path)
+    # O segundo mapeamento é descartado; o item do cache é reservado de novo
+    assert second is first and first.readers == 2
+    first.release()
+    first.release()
+    assert not first.closed
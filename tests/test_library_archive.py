@@ -0,0 +1,87 @@
+"""Exportação e importação da biblioteca (library_archive.py)"""
+import io
+
+import pytest
+
+from library_archive import export_archive
+
+TOKEN = 'segredo'
+
+
+class TrackingStorage:
+    """Storage em memória que registra quais leitores foram fechados"""
+
+    def __init__(self, files):
+        self.files = files
+        self.readers = []
+        self.closed = []
+
+    def size(self, filename):
+        return len(self.files[filename]) if filename in self.files else None
+
+    def get(self, filename, start=0, stop=None):
+        def chunks():
+            data = self.files[filename]
+            try:
+                for offset in range(0, len(data), 1024):
+                    yield data[offset:offset + 1024]
+            finally:
+                self.closed.append(filename)
+        # Referência mantida (como um pool de conexões): o coletor de lixo não fecha o leitor
+        reader = chunks()
+        self.readers.append(reader)
+        return reader
+
+
+def test_export_closes_the_reader_when_the_client_aborts():
+    storage = TrackingStorage({'a.mp3': b'x' * 10000})
+    archive = export_archive([[{"name": "a", "uri": "/api/midias/media/a.mp3"}]], storage)
+
+    # Manifesto (cabeçalho, conteúdo, padding), cabeçalho do arquivo e o primeiro bloco
+    chunks = [next(archive) for _ in range(5)]
+    assert chunks[-1] == b'x' * 1024
+    archive.close()
+    assert storage.closed == ['a.mp3']
+
+
+@pytest.fixture
+def exported(load_app):
+    app = load_app(ADMIN_TOKEN=TOKEN)
+    client = app.app.test_client()
+    app.storage.put('a.mp3', io.BytesIO(b'ID3' + b'a' * 5000))
+    for name, extra in (('a', {}), ('b', {"uri": "https://exemplo.com/b.mp3", "deviceId": "tel-1",
+                                          "isFavorite": True})):
+        body = dict({"name": name, "uri": f"/api/midias/media/{name}.mp3", "mimeType": "audio/mpeg"}, **extra)
+        assert client.post('/api/midias', json=body).status_code == 201
+
+    response = client.get('/api/export', headers={"X-Admin-Token": TOKEN})
+    assert response.status_code == 200
+    midias = client.get('/api/midias').get_json()
+    return response.data, midias
+
+
+def test_export_import_round_trip(load_app, tmp_path, exported):
+    data, midias = exported
+    # Outra instalação, vazia
+    app = load_app(ADMIN_TOKEN=TOKEN, DB_FILE=str(tmp_path / 'novo.db'), MEDIA_FOLDER=str(tmp_path / 'novo-media'),
+                   DEVICE_DB_FOLDER=str(tmp_path / 'novo-devices'))
+    client = app.app.test_client()
+    assert client.get('/api/midias').get_json() == []
+
+    response = client.post('/api/import', data=data, headers={"X-Admin-Token": TOKEN},
+                           content_type='application/x-tar')
+    assert response.status_code == 200
+    assert response.get_json() == {"midias": 2, "skipped_midias": 0, "files": 1, "skipped_files": 0,
+                                   "bytes": 5003}
+
+    fields = ('name', 'uri', 'mimeType', 'deviceId', 'isFavorite')
+    imported = client.get('/api/midias').get_json()
+    assert sorted(tuple(m[f] for f in fields) for m in imported) == \
+        sorted(tuple(m[f] for f in fields) for m in midias)
+    assert b''.join(app.storage.get('a.mp3')) == b'ID3' + b'a' * 5000
+
+    # Importar de novo não duplica mídias nem sobrescreve arquivos
+    response = client.post('/api/import', data=data, headers={"X-Admin-Token": TOKEN},
+                           content_type='application/x-tar')
+    assert response.get_json()["midias"] == 0
+    assert response.get_json()["skipped_files"] == 1
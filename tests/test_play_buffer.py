@@ -0,0 +1,71 @@
+"""PlayBuffer (play_buffer.py): agrupamento e nova tentativa de lotes"""
+import pytest
+
+from play_buffer import PartialFlushError, PlayBuffer
+
+
+def test_flush_groups_plays_by_id():
+    flushed = []
+    buffer = PlayBuffer(flushed.append)
+    buffer.record(1, '2024-01-01 10:00:00')
+    buffer.record(1, '2024-01-01 09:00:00')
+    buffer.record(2, '2024-01-02 10:00:00')
+
+    assert buffer.pending() == 3
+    assert buffer.flush() == 2
+    assert flushed == [{1: (2, '2024-01-01 10:00:00'), 2: (1, '2024-01-02 10:00:00')}]
+    assert buffer.pending() == 0 and buffer.flush() == 0
+    assert (buffer.stats["flushes"], buffer.stats["rows_written"]) == (1, 2)
+
+
+def test_failed_flush_requeues_everything():
+    calls = []
+
+    def flush_fn(updates):
+        calls.append(dict(updates))
+        if len(calls) == 1:
+            raise RuntimeError("base travada")
+
+    buffer = PlayBuffer(flush_fn)
+    buffer.record(1, '2024-01-01 10:00:00')
+    with pytest.raises(RuntimeError):
+        buffer.flush()
+    assert buffer.pending() == 1
+
+    # Um play novo enquanto o lote falhava soma com o que voltou
+    buffer.record(1, '2024-01-03 10:00:00')
+    buffer.flush()
+    assert calls[-1] == {1: (2, '2024-01-03 10:00:00')}
+    assert (buffer.stats["errors"], buffer.stats["rows_written"]) == (1, 1)
+
+
+def test_partial_flush_requeues_only_the_unwritten_rows():
+    calls = []
+
+    def flush_fn(updates):
+        calls.append(dict(updates))
+        if len(calls) == 1:
+            raise PartialFlushError({2: updates[2]}, RuntimeError("base dedicada travada"))
+
+    buffer = PlayBuffer(flush_fn)
+    buffer.record(1, '2024-01-01 10:00:00')
+    buffer.record(2, '2024-01-01 10:00:00')
+    buffer.record(2, '2024-01-01 11:00:00')
+    with pytest.raises(PartialFlushError):
+        buffer.flush()
+    assert buffer.pending() == 2
+    assert buffer.stats["rows_written"] == 1
+
+    buffer.flush()
+    # O id 1 já foi gravado: não é contado de novo
+    assert calls[-1] == {2: (2, '2024-01-01 11:00:00')}
+    assert buffer.stats["rows_written"] == 2
+
+
+def test_close_flushes_pending_plays():
+    flushed = []
+    buffer = PlayBuffer(flushed.append, interval=60)
+    buffer.start()
+    buffer.record(1, '2024-01-01 10:00:00')
+    buffer.close()
+    assert flushed == [{1: (1, '2024-01-01 10:00:00')}]
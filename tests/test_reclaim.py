@@ -0,0 +1,63 @@
+"""Limpeza de órfãos (reclaim.py) lendo as referências pelos MidiaStore"""
+import os
+import sqlite3
+
+from database import MidiaStore, create_db_engine, library_stores, sqlite_url
+from fingerprint import backfill
+from media_layout import shard_path
+from reclaim import reclaim_orphans
+
+
+def media_file(folder, filename, age=7200):
+    path = shard_path(folder, filename)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(b'x' * 10)
+    old = os.path.getmtime(path) - age
+    os.utime(path, (old, old))
+    return path
+
+
+def test_reclaim_reads_references_from_database_url(tmp_path):
+    media = str(tmp_path / 'media')
+    kept = media_file(media, 'kept.mp3')
+    orphan = media_file(media, 'orphan.mp3')
+    recent = media_file(media, 'recent.mp3', age=0)
+
+    # SQLite local com a tabela vazia, como fica com DATABASE_URL
+    local_db = str(tmp_path / 'midias.db')
+    MidiaStore(create_db_engine(sqlite_url(local_db))).create_schema()
+    server_url = f"sqlite:///{tmp_path / 'server.db'}"
+    server = MidiaStore(create_db_engine(server_url))
+    server.create_schema()
+    server.insert_midia({"name": "k", "uri": "http://h/api/midias/media/kept.mp3", "mimeType": "audio/mpeg"})
+
+    stores = library_stores(local_db, str(tmp_path / 'devices'), server_url)
+    assert [store.display_url for store in stores] == [server_url]
+
+    stats = reclaim_orphans(stores, media)
+    assert (stats["scanned"], stats["orphans"], stats["reclaimed"], stats["skipped_recent"]) == (3, 1, 1, 1)
+    assert os.path.exists(kept) and os.path.exists(recent)
+    assert not os.path.exists(orphan)
+
+
+def test_library_stores_without_database_url(tmp_path):
+    devices = tmp_path / 'devices'
+    devices.mkdir()
+    sqlite3.connect(devices / 'd1.db').close()
+
+    stores = library_stores(str(tmp_path / 'midias.db'), str(devices))
+    assert [store.engine.url.database for store in stores] == [str(tmp_path / 'midias.db'), str(devices / 'd1.db')]
+
+
+def test_fingerprint_backfill_writes_through_store(tmp_path):
+    media = str(tmp_path / 'media')
+    media_file(media, 'a.bin')
+    store = MidiaStore(create_db_engine(sqlite_url(str(tmp_path / 'server.db'))))
+    store.create_schema()
+    found = store.insert_midia({"name": "a", "uri": "/api/midias/media/a.bin", "mimeType": "audio/mpeg"})
+    store.insert_midia({"name": "b", "uri": "/api/midias/media/missing.bin", "mimeType": "audio/mpeg"})
+
+    assert backfill([store], media) == {"updated": 1, "missing": 1}
+    assert store.get_midias([found])[0].audioFingerprint is not None
+    assert [midia_id for midia_id, _ in store.missing_fingerprints()] == [found + 1]
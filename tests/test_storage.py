@@ -0,0 +1,118 @@
+"""Backend S3 contra um bucket simulado pelo moto (mesma API do MinIO/AWS)"""
+import io
+import os
+from urllib.parse import urlparse
+
+import pytest
+
+boto3 = pytest.importorskip('boto3')
+moto = pytest.importorskip('moto')
+
+from storage import LocalStorage, S3Storage, Storage, StorageError, create_storage
+
+BUCKET = 'midias'
+FILENAME = 'abcdef12-0000-0000-0000-000000000000.mp3'
+MB = 1024 * 1024
+
+
+@pytest.fixture
+def s3_client(monkeypatch):
+    for name in ('AWS_ACCESS_KEY_ID', 'AWS_SECRET_ACCESS_KEY', 'AWS_SECURITY_TOKEN', 'AWS_SESSION_TOKEN'):
+        monkeypatch.setenv(name, 'testing')
+    monkeypatch.setenv('AWS_DEFAULT_REGION', 'us-east-1')
+    with moto.mock_aws():
+        client = boto3.client('s3', region_name='us-east-1')
+        client.create_bucket(Bucket=BUCKET)
+        yield client
+
+
+@pytest.fixture
+def s3(s3_client):
+    return S3Storage(BUCKET, prefix='media/', multipart_chunk=5 * MB, client=s3_client)
+
+
+def test_storage_interface_is_abstract():
+    with pytest.raises(TypeError):
+        Storage()
+
+
+def test_put_get_size_delete(s3, s3_client):
+    data = b'ID3' + bytes(range(256)) * 40
+
+    assert s3.put(FILENAME, io.BytesIO(data), 'audio/mpeg') == len(data)
+    assert s3.size(FILENAME) == len(data)
+    assert s3.exists(FILENAME)
+    assert b''.join(s3.get(FILENAME)) == data
+
+    # Chave com o mesmo particionamento ab/cd/ do disco local
+    head = s3_client.head_object(Bucket=BUCKET, Key='media/ab/cd/' + FILENAME)
+    assert head['ContentType'] == 'audio/mpeg'
+
+    s3.delete(FILENAME)
+    assert s3.size(FILENAME) is None
+    assert not s3.exists(FILENAME)
+    # Remover de novo não é erro
+    s3.delete(FILENAME)
+
+
+def test_get_range(s3):
+    data = bytes(range(256)) * 4
+    s3.put(FILENAME, io.BytesIO(data))
+
+    assert b''.join(s3.get(FILENAME, 10, 20)) == data[10:20]
+    assert b''.join(s3.get(FILENAME, 1000)) == data[1000:]
+
+
+def test_missing_file(s3):
+    assert s3.size(FILENAME) is None
+    with pytest.raises(FileNotFoundError):
+        s3.get(FILENAME)
+
+
+def test_presigned_url(s3):
+    s3.put(FILENAME, io.BytesIO(b'conteudo'))
+
+    url = urlparse(s3.url(FILENAME, expires=60))
+    assert url.path.endswith('/media/ab/cd/' + FILENAME)
+    assert 'Expires=' in url.query or 'X-Amz-Expires=60' in url.query
+
+
+def test_multipart_above_threshold(s3, s3_client):
+    small = b'a' * (5 * MB - 1)
+    large = os.urandom(11 * MB)
+
+    s3.put('small.mp3', io.BytesIO(small))
+    assert s3.put('large.mp4', io.BytesIO(large)) == len(large)
+
+    # O ETag de um upload multipart termina em -<número de partes>
+    small_etag = s3_client.head_object(Bucket=BUCKET, Key=s3.key('small.mp3'))['ETag']
+    large_etag = s3_client.head_object(Bucket=BUCKET, Key=s3.key('large.mp4'))['ETag']
+    assert '-' not in small_etag
+    assert large_etag.strip('"').endswith('-3')
+    assert b''.join(s3.get('large.mp4')) == large
+
+
+def test_create_storage(s3_client, monkeypatch, tmp_path):
+    monkeypatch.setenv('STORAGE_BACKEND', 's3')
+    monkeypatch.setenv('S3_BUCKET', BUCKET)
+    monkeypatch.setenv('S3_REGION', 'us-east-1')
+    assert isinstance(create_storage(str(tmp_path)), S3Storage)
+
+    monkeypatch.delenv('S3_BUCKET')
+    with pytest.raises(StorageError):
+        create_storage(str(tmp_path))
+
+    monkeypatch.setenv('STORAGE_BACKEND', 'local')
+    assert isinstance(create_storage(str(tmp_path)), LocalStorage)
+
+
+def test_local_put_uses_the_umask_mode(tmp_path):
+    old_umask = os.umask(0o022)
+    try:
+        storage = LocalStorage(str(tmp_path / 'media'))
+    finally:
+        os.umask(old_umask)
+    storage.put(FILENAME, io.BytesIO(b'abc'))
+
+    assert os.stat(storage.local_path(FILENAME)).st_mode & 0o777 == 0o644
+    assert b''.join(storage.get(FILENAME)) == b'abc'
@@ -0,0 +1,217 @@
+"""Forma de onda (waveform.py): formato .dat, leitores de MP3/MP4/WAV e fila de geração"""
+import array
+import math
+import os
+import struct
+import wave
+from contextlib import contextmanager
+
+import pytest
+
+from waveform import (FLAG_8BIT, HEADER, Waveform, WaveformError, WaveformJobs, WaveformStore,
+                      compute_waveform)
+
+
+@pytest.fixture
+def media(tmp_path):
+    folder = tmp_path / 'media'
+    folder.mkdir()
+    return folder
+
+
+def jobs_for(tmp_path, media, **options):
+    opened = []
+
+    @contextmanager
+    def local_copy(filename):
+        opened.append(filename)
+        path = media / filename
+        if not path.exists():
+            raise FileNotFoundError(filename)
+        yield str(path)
+
+    return WaveformJobs(WaveformStore(str(tmp_path / 'waveforms')), local_copy, points=50, **options), opened
+
+
+def test_failures_are_remembered(tmp_path, media):
+    (media / 'bad.bin').write_bytes(b'nada de audio aqui')
+    jobs, opened = jobs_for(tmp_path, media)
+
+    for _ in range(3):
+        with pytest.raises(WaveformError):
+            jobs.submit('bad.bin').result(timeout=5)
+    assert opened == ['bad.bin']
+    assert (jobs.stats["failed"], jobs.stats["failures_cached"]) == (1, 2)
+
+    # Arquivo regravado: analisado de novo
+    jobs.forget('bad.bin')
+    with pytest.raises(WaveformError):
+        jobs.submit('bad.bin').result(timeout=5)
+    assert opened == ['bad.bin', 'bad.bin']
+
+
+def test_failure_marker_expires(tmp_path, media):
+    (media / 'bad.bin').write_bytes(b'nada de audio aqui')
+    jobs, opened = jobs_for(tmp_path, media, failure_ttl=0)
+
+    for _ in range(2):
+        with pytest.raises(WaveformError):
+            jobs.submit('bad.bin').result(timeout=5)
+    assert opened == ['bad.bin', 'bad.bin']
+
+
+def test_missing_files_are_not_remembered(tmp_path, media):
+    jobs, opened = jobs_for(tmp_path, media)
+
+    for _ in range(2):
+        with pytest.raises(FileNotFoundError):
+            jobs.submit('missing.bin').result(timeout=5)
+    assert opened == ['missing.bin', 'missing.bin']
+
+
+# ------------------------------------------------------------
+# Formato .dat e leitores de cada formato
+# ------------------------------------------------------------
+
+def box(kind, *children):
+    body = b''.join(children)
+    return struct.pack('>I', 8 + len(body)) + kind + body
+
+
+def full_box(kind, *fields):
+    """Caixa com versão 0, flags 0 e campos uint32"""
+    return box(kind, struct.pack('>I' + 'I' * len(fields), 0, *fields))
+
+
+def mp4_file(sizes, fragmented=False, delta=1024):
+    hdlr = box(b'hdlr', b'\0' * 8 + b'soun' + b'\0' * 12)
+    trak = box(
+        b'trak',
+        full_box(b'tkhd', 0, 0, 7),
+        box(b'mdia', full_box(b'mdhd', 0, 0, 44100), hdlr, box(b'minf', box(b'stbl',
+            full_box(b'stts', 1, len(sizes), delta),
+            full_box(b'stsz', 0, 0) if fragmented else full_box(b'stsz', 0, len(sizes), *sizes),
+        ))),
+    )
+    parts = [box(b'ftyp', b'M4A \0\0\0\0'), box(b'moov', trak)]
+    if fragmented:
+        # tfhd com default_sample_duration; trun com o tamanho de cada frame
+        tfhd = box(b'tfhd', struct.pack('>III', 0x8, 7, delta))
+        trun = box(b'trun', struct.pack('>II', 0x200, len(sizes)) + struct.pack(f'>{len(sizes)}I', *sizes))
+        parts.append(box(b'moof', box(b'traf', tfhd, trun)))
+    parts.append(box(b'mdat', b'\0' * sum(sizes)))
+    return b''.join(parts)
+
+
+MP3_HEADER = bytes([0xFF, 0xFB, 0x90, 0xC0])  # MPEG-1 Layer III, 128 kbps, 44,1 kHz, mono
+MP3_FRAME_SIZE = 144000 * 128 // 44100
+
+
+def mp3_frame(*gains):
+    """Frame mono com dois granules; gain None = granule em silêncio"""
+    bits = 0
+    side_bits = 17 * 8
+    for granule, gain in enumerate(gains):
+        start = 18 + granule * 59
+        if gain is not None:
+            bits |= 100 << (side_bits - start - 12)        # part2_3_length
+            bits |= gain << (side_bits - start - 21 - 8)   # global_gain
+    side_info = bits.to_bytes(17, 'big')
+    return MP3_HEADER + side_info + b'\x55' * (MP3_FRAME_SIZE - 4 - 17)
+
+
+def id3v2(size=20):
+    return b'ID3\x03\x00\x00' + bytes([0, 0, 0, size]) + b'\0' * size
+
+
+def test_dat_round_trip():
+    waveform = Waveform(44100, 512, [-128, 127, -3, 4, 0, 0], 'pcm')
+    payload = waveform.to_bytes()
+    assert HEADER.unpack_from(payload) == (1, FLAG_8BIT, 44100, 512, 3)
+    assert len(payload) == HEADER.size + 6
+
+    decoded = Waveform.from_bytes(payload, 'pcm')
+    assert (decoded.sample_rate, decoded.samples_per_pixel, decoded.data) == (44100, 512, waveform.data)
+    assert decoded.to_json()["length"] == 3
+    assert (decoded.to_json()["source"], decoded.to_json()["estimated"]) == ('pcm', False)
+    assert Waveform.from_bytes(payload).to_json()["estimated"] is None
+
+    with pytest.raises(WaveformError):
+        Waveform.from_bytes(payload[:10])
+    with pytest.raises(WaveformError):
+        Waveform.from_bytes(HEADER.pack(2, FLAG_8BIT, 1, 1, 0))
+
+
+def test_wav_peaks(tmp_path):
+    path = str(tmp_path / 'tone.wav')
+    with wave.open(path, 'wb') as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(8000)
+        samples = [int(32767 * math.sin(i / 5)) if i < 4096 else 0 for i in range(8192)]
+        wav.writeframes(array.array('h', samples).tobytes())
+
+    # 32 blocos de 256 amostras, reduzidos a 8 pontos
+    waveform = compute_waveform(path, points=8)
+    assert (waveform.source, waveform.sample_rate, waveform.samples_per_pixel) == ('pcm', 8000, 1024)
+    # Primeira metade: tom em escala cheia; segunda: silêncio
+    assert waveform.data == [-128, 127] * 4 + [0, 0] * 4
+
+
+def test_mp3_frame_walk(tmp_path):
+    frames = [mp3_frame(200, 200), mp3_frame(168, None), mp3_frame(None, None)]
+    # Tag ID3v2 no início, lixo entre frames e tag ID3v1 no fim
+    data = id3v2() + frames[0] + b'\0\0\0' + frames[1] + frames[2] + b'TAG' + b'\0' * 125
+    path = tmp_path / 'a.mp3'
+    path.write_bytes(data)
+
+    waveform = compute_waveform(str(path), points=100)
+    assert (waveform.source, waveform.estimated, waveform.sample_rate) == ('mp3-gain', True, 44100)
+    assert waveform.samples_per_pixel == 576
+    # 200 é o mais alto (0 dB); 168 = -48 dB, o fundo da faixa; envelope simétrico
+    assert waveform.data == [-128, 127, -128, 127, 0, 0, 0, 0, 0, 0, 0, 0]
+
+
+def test_mp3_without_frames(tmp_path):
+    path = tmp_path / 'a.mp3'
+    path.write_bytes(id3v2() + b'\0' * 100)
+    with pytest.raises(WaveformError):
+        compute_waveform(str(path))
+
+
+@pytest.mark.parametrize('fragmented', [False, True])
+def test_mp4_frame_sizes(tmp_path, fragmented):
+    path = tmp_path / 'a.m4a'
+    path.write_bytes(mp4_file([400, 200, 0, 400], fragmented=fragmented))
+
+    waveform = compute_waveform(str(path), points=100)
+    assert (waveform.source, waveform.estimated) == ('mp4-frames', True)
+    assert (waveform.sample_rate, waveform.samples_per_pixel) == (44100, 1024)
+    assert waveform.data == [-128, 127, -64, 64, 0, 0, -128, 127]
+
+
+def test_mp4_without_audio_track(tmp_path):
+    path = tmp_path / 'a.mp4'
+    path.write_bytes(box(b'ftyp', b'isom\0\0\0\0') + box(b'moov') + box(b'mdat', b'\0' * 8))
+    with pytest.raises(WaveformError):
+        compute_waveform(str(path))
+
+
+def test_unsupported_format_without_ffmpeg(tmp_path):
+    path = tmp_path / 'a.ogg'
+    path.write_bytes(b'OggS' + b'\0' * 60)
+    with pytest.raises(WaveformError):
+        compute_waveform(str(path), ffmpeg=None)
+
+
+def test_store_keeps_the_source(tmp_path):
+    store = WaveformStore(str(tmp_path / 'waveforms'))
+    store.put('a.mp3', b'payload', 'mp3-gain')
+    assert store.get('a.mp3') == (b'payload', 'mp3-gain')
+
+    # .dat gerado antes de a origem ser gravada
+    os.remove(store.path('a.mp3') + '.source')
+    assert store.get('a.mp3') == (b'payload', None)
+
+    store.delete('a.mp3')
+    assert store.get('a.mp3') is None
@@ -0,0 +1,670 @@
+"""Forma de onda pré-calculada (picos mín./máx.) para o scrubber do player
+
+Em vez de baixar e decodificar o arquivo inteiro no aparelho, o cliente
+pede `/api/midias/<id>/waveform` e recebe alguns KB: ~2000 pares de
+mínimo/máximo em 8 bits, no formato binário `.dat` (versão 1) do
+audiowaveform da BBC, que o peaks.js lê diretamente:
+
+    int32  versão (1)         uint32 flags (1 = amostras de 8 bits)
+    int32  taxa de amostragem int32  amostras por ponto
+    uint32 número de pontos   int8[2 * pontos] mín., máx., mín., máx. ...
+
+Origem dos picos, da mais precisa para a mais aproximada:
+
+- WAV PCM: lido direto com o módulo `wave`;
+- qualquer formato, se houver `ffmpeg` (WAVEFORM_FFMPEG ou no PATH):
+  decodificado para PCM mono;
+- MP3 sem ffmpeg: envelope pelo `global_gain` de cada granule (campo do
+  side info, sem decodificar o áudio);
+- MP4/M4A sem ffmpeg: envelope pelo tamanho de cada frame AAC (tabelas
+  `stsz` ou `trun`, se fragmentado), que acompanha o volume do trecho.
+
+Os arquivos ficam em WAVEFORM_FOLDER (cache derivado: pode ser apagado e
+é refeito sob demanda). Uso:
+    python waveform.py uploads/*.mp3
+    python waveform.py --backfill --db midias.db --media-folder media
+"""
+import argparse
+import array
+import json
+import math
+import os
+import shutil
+import struct
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import wave
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from database import library_stores
+from fingerprint import SequentialReader, detect_format, skip_id3v2
+from media_layout import resolve_media_path, shard_path
+from reclaim import media_filename
+
+DEFAULT_POINTS = 2000
+# Resolução intermediária antes de reduzir para `points`
+BLOCK_FRAMES = 256
+DECODE_RATE = 11025
+READ_SIZE = 256 * 1024
+HEADER = struct.Struct('<iIiiI')
+FLAG_8BIT = 1
+# Faixa dinâmica do envelope aproximado (MP3)
+GAIN_RANGE_DB = 48.0
+# Origens em que os picos são um envelope estimado, não áudio decodificado
+ESTIMATED_SOURCES = ('mp3-gain', 'mp4-frames')
+# Por quanto tempo um arquivo sem áudio reconhecível não é analisado de novo
+FAILURE_TTL = 600
+
+MP3_BITRATES = {
+    1: (0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320),
+    2: (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+}
+MP3_SAMPLE_RATES = {1: (44100, 48000, 32000), 2: (22050, 24000, 16000), 25: (11025, 12000, 8000)}
+MP3_GRANULE_SAMPLES = 576
+
+
+class WaveformError(Exception):
+    """Arquivo sem áudio reconhecível ou formato não suportado"""
+
+
+class Waveform:
+    """Pares mín./máx. (int8) com a escala de tempo
+
+    `source` diz de onde vieram os picos: 'pcm' e 'ffmpeg' são áudio
+    decodificado; 'mp3-gain' e 'mp4-frames' são envelopes estimados (simétricos)
+    a partir dos cabeçalhos, sem decodificar (ver ESTIMATED_SOURCES).
+    """
+
+    def __init__(self, sample_rate, samples_per_pixel, data, source=None):
+        self.sample_rate = sample_rate
+        self.samples_per_pixel = samples_per_pixel
+        self.data = data
+        self.source = source
+
+    @property
+    def length(self):
+        return len(self.data) // 2
+
+    def to_bytes(self):
+        header = HEADER.pack(1, FLAG_8BIT, self.sample_rate, self.samples_per_pixel, self.length)
+        return header + array.array('b', self.data).tobytes()
+
+    @property
+    def estimated(self):
+        """None quando a origem é desconhecida (.dat gerado antes de ela ser gravada)"""
+        return None if self.source is None else self.source in ESTIMATED_SOURCES
+
+    @classmethod
+    def from_bytes(cls, payload, source=None):
+        if len(payload) < HEADER.size:
+            raise WaveformError("Arquivo de forma de onda truncado")
+        version, flags, sample_rate, samples_per_pixel, length = HEADER.unpack_from(payload)
+        if version != 1 or not flags & FLAG_8BIT:
+            raise WaveformError("Versão de forma de onda não suportada")
+        data = array.array('b', payload[HEADER.size:HEADER.size + 2 * length]).tolist()
+        return cls(sample_rate, samples_per_pixel, data, source)
+
+    def to_json(self):
+        """Formato do `audiowaveform --output-format json`, mais `source` e `estimated`"""
+        return {
+            "version": 1,
+            "channels": 1,
+            "sample_rate": self.sample_rate,
+            "samples_per_pixel": self.samples_per_pixel,
+            "bits": 8,
+            "length": self.length,
+            "data": self.data,
+            "source": self.source,
+            "estimated": self.estimated,
+        }
+
+
+class PeakAccumulator:
+    """Mín./máx. por bloco de BLOCK_FRAMES frames, reduzidos no final"""
+
+    def __init__(self, sample_rate, channels=1, block_frames=BLOCK_FRAMES):
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.block_frames = block_frames
+        self.mins = array.array('h')
+        self.maxs = array.array('h')
+        self._carry = array.array('h')
+
+    def add_samples(self, samples):
+        """Amostras int16 (intercaladas, se houver mais de um canal)"""
+        if self._carry:
+            samples = self._carry + samples
+        block = self.block_frames * self.channels
+        full = len(samples) - len(samples) % block
+        for i in range(0, full, block):
+            chunk = samples[i:i + block]
+            self.mins.append(min(chunk))
+            self.maxs.append(max(chunk))
+        self._carry = samples[full:]
+
+    def add_level(self, level):
+        """Um bloco com amplitude simétrica `level` (0 a 1)"""
+        peak = int(round(max(0.0, min(level, 1.0)) * 32767))
+        self.mins.append(-peak)
+        self.maxs.append(peak)
+
+    def finish(self, points=DEFAULT_POINTS, source=None):
+        if self._carry:
+            self.mins.append(min(self._carry))
+            self.maxs.append(max(self._carry))
+            self._carry = array.array('h')
+        if not self.mins:
+            raise WaveformError("Nenhum áudio encontrado")
+        group = max(1, math.ceil(len(self.mins) / points))
+        data = []
+        for i in range(0, len(self.mins), group):
+            data.append(max(-128, min(self.mins[i:i + group]) >> 8))
+            data.append(min(127, max(self.maxs[i:i + group]) >> 8))
+        return Waveform(self.sample_rate, self.block_frames * group, data, source)
+
+
+def _to_int16(data, width):
+    """PCM little-endian de 8/16/24/32 bits -> array int16 (só os bytes altos)"""
+    if width == 2:
+        samples = array.array('h', data[:len(data) - len(data) % 2])
+    else:
+        count = len(data) // width
+        out = bytearray(count * 2)
+        if width == 1:
+            # WAV de 8 bits é sem sinal: inverte o bit mais alto
+            out[1::2] = data[:count].translate(bytes((b ^ 0x80) for b in range(256)))
+        elif width in (3, 4):
+            out[0::2] = data[width - 2:count * width:width]
+            out[1::2] = data[width - 1:count * width:width]
+        else:
+            raise WaveformError(f"PCM de {width * 8} bits não suportado")
+        samples = array.array('h', bytes(out))
+    if sys.byteorder == 'big':
+        samples.byteswap()
+    return samples
+
+
+def _wav_peaks(path, points):
+    try:
+        wav = wave.open(path, 'rb')
+    except (wave.Error, EOFError) as e:
+        raise WaveformError(f"WAV não suportado: {e}")
+    with wav:
+        channels, width, rate = wav.getnchannels(), wav.getsampwidth(), wav.getframerate()
+        acc = PeakAccumulator(rate, channels)
+        frames = max(1, READ_SIZE // (channels * width))
+        while True:
+            data = wav.readframes(frames)
+            if not data:
+                break
+            acc.add_samples(_to_int16(data, width))
+    return acc.finish(points, 'pcm')
+
+
+def find_ffmpeg():
+    return os.environ.get('WAVEFORM_FFMPEG') or shutil.which('ffmpeg')
+
+
+def _ffmpeg_peaks(ffmpeg, path, points):
+    proc = subprocess.Popen(
+        [ffmpeg, '-v', 'error', '-nostdin', '-i', path, '-vn', '-ac', '1',
+         '-ar', str(DECODE_RATE), '-f', 's16le', '-'],
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE
+    )
+    acc = PeakAccumulator(DECODE_RATE)
+    pending = b''
+    try:
+        while True:
+            data = proc.stdout.read(READ_SIZE)
+            if not data:
+                break
+            data = pending + data
+            usable = len(data) - len(data) % 2
+            acc.add_samples(_to_int16(data[:usable], 2))
+            pending = data[usable:]
+    finally:
+        proc.stdout.close()
+        stderr = proc.stderr.read()
+        proc.stderr.close()
+        proc.wait()
+    if proc.returncode != 0 and not acc.mins:
+        raise WaveformError(f"ffmpeg falhou: {stderr.decode(errors='replace').strip()[:200]}")
+    return acc.finish(points, 'ffmpeg')
+
+
+def _mp3_frame(header):
+    """(versão, taxa, bytes do frame, canais, bytes do side info) ou None"""
+    if len(header) < 4 or header[0] != 0xFF or header[1] & 0xE0 != 0xE0:
+        return None
+    version_bits = (header[1] >> 3) & 3
+    layer_bits = (header[1] >> 1) & 3
+    bitrate_index = header[2] >> 4
+    rate_index = (header[2] >> 2) & 3
+    if version_bits == 1 or layer_bits != 1 or bitrate_index in (0, 15) or rate_index == 3:
+        return None
+    version = {3: 1, 2: 2, 0: 25}[version_bits]
+    rate = MP3_SAMPLE_RATES[version][rate_index]
+    bitrate = MP3_BITRATES[1 if version == 1 else 2][bitrate_index]
+    padding = (header[2] >> 1) & 1
+    size = (144000 if version == 1 else 72000) * bitrate // rate + padding
+    channels = 1 if header[3] >> 6 == 3 else 2
+    if version == 1:
+        side_info = 17 if channels == 1 else 32
+    else:
+        side_info = 9 if channels == 1 else 17
+    return version, rate, size, channels, side_info
+
+
+def _granule_gains(version, channels, side_info):
+    """`global_gain` de cada granule (None se o granule não tem dados)"""
+    bits = int.from_bytes(side_info, 'big')
+    total = len(side_info) * 8
+
+    def field(offset, width):
+        return (bits >> (total - offset - width)) & ((1 << width) - 1)
+
+    gains = []
+    if version == 1:
+        offset = 9 + (5 if channels == 1 else 3) + 4 * channels
+        granules, granule_bits = 2, 59
+    else:
+        offset = 8 + (1 if channels == 1 else 2)
+        granules, granule_bits = 1, 63
+    for granule in range(granules):
+        gain = None
+        for channel in range(channels):
+            start = offset + (granule * channels + channel) * granule_bits
+            # part2_3_length (12 bits) = 0: granule em silêncio
+            if field(start, 12):
+                gain = max(gain or 0, field(start + 21, 8))
+        gains.append(gain)
+    return gains
+
+
+def _mp3_peaks(path, points):
+    gains = []
+    rate = None
+    with open(path, 'rb') as f:
+        reader = SequentialReader(f)
+        skip_id3v2(reader)
+        skipped = 0
+        while True:
+            header = reader.read(4)
+            frame = _mp3_frame(header)
+            if frame is None:
+                if len(header) < 4 or header[:3] == b'TAG' or skipped > 64 * 1024:
+                    break
+                # Lixo entre frames: procura o próximo sync byte a byte
+                reader.unread(header[1:])
+                skipped += 1
+                continue
+            skipped = 0
+            version, frame_rate, size, channels, side_len = frame
+            rate = rate or frame_rate
+            if not header[1] & 1:  # CRC de 16 bits antes do side info
+                reader.skip(2)
+                size -= 2
+            side_info = reader.read(side_len)
+            if len(side_info) < side_len:
+                break
+            gains.extend(_granule_gains(version, channels, side_info))
+            reader.skip(size - 4 - side_len)
+    audible = [g for g in gains if g is not None]
+    if not audible:
+        raise WaveformError("Nenhum frame MP3 encontrado")
+    # Cada passo de global_gain vale 1,5 dB; o mais alto do arquivo é 0 dB
+    loudest = max(audible)
+    acc = PeakAccumulator(rate, block_frames=MP3_GRANULE_SAMPLES)
+    for gain in gains:
+        if gain is None:
+            acc.add_level(0)
+        else:
+            db = (gain - loudest) * 1.5
+            acc.add_level(max(0.0, 1 + db / GAIN_RANGE_DB))
+    return acc.finish(points, 'mp3-gain')
+
+
+def _mp4_boxes(f, end):
+    """(tipo, início do conteúdo, fim) das caixas entre a posição atual e `end`"""
+    while f.tell() + 8 <= end:
+        start = f.tell()
+        header = f.read(8)
+        size = int.from_bytes(header[:4], 'big')
+        body = start + 8
+        if size == 1:
+            size = int.from_bytes(f.read(8), 'big')
+            body += 8
+        elif size == 0:
+            size = end - start
+        if size < body - start:
+            return
+        yield header[4:8], body, start + size
+        f.seek(start + size)
+
+
+def _mp4_child(f, start, end, path):
+    """Conteúdo (início, fim) da caixa no caminho `path` (ex.: [b'mdia', b'hdlr'])"""
+    for box_type in path:
+        f.seek(start)
+        for found, body, box_end in _mp4_boxes(f, end):
+            if found == box_type:
+                start, end = body, box_end
+                break
+        else:
+            return None
+    return start, end
+
+
+def _read_uint(f, offset, size=4):
+    f.seek(offset)
+    return int.from_bytes(f.read(size), 'big')
+
+
+def _mp4_audio_track(f, moov):
+    """(track_ID, timescale, duração de um frame, tamanhos dos frames) da trilha de áudio"""
+    f.seek(moov[0])
+    for box_type, body, box_end in list(_mp4_boxes(f, moov[1])):
+        if box_type != b'trak':
+            continue
+        hdlr = _mp4_child(f, body, box_end, [b'mdia', b'hdlr'])
+        if hdlr is None:
+            continue
+        f.seek(hdlr[0] + 8)  # versão/flags, pre_defined, handler_type
+        if f.read(4) != b'soun':
+            continue
+        tkhd = _mp4_child(f, body, box_end, [b'tkhd'])
+        mdhd = _mp4_child(f, body, box_end, [b'mdia', b'mdhd'])
+        stbl = _mp4_child(f, body, box_end, [b'mdia', b'minf', b'stbl'])
+        if not (tkhd and mdhd and stbl):
+            continue
+        # Campos de 64 bits (creation/modification) na versão 1
+        long_times = _read_uint(f, tkhd[0], 1) == 1
+        track_id = _read_uint(f, tkhd[0] + (20 if long_times else 12))
+        long_times = _read_uint(f, mdhd[0], 1) == 1
+        timescale = _read_uint(f, mdhd[0] + (20 if long_times else 12))
+
+        delta = None
+        stts = _mp4_child(f, stbl[0], stbl[1], [b'stts'])
+        if stts and _read_uint(f, stts[0] + 4):
+            delta = _read_uint(f, stts[0] + 12)
+        sizes = array.array('I')
+        stsz = _mp4_child(f, stbl[0], stbl[1], [b'stsz'])
+        if stsz and not _read_uint(f, stsz[0] + 4):  # sample_size 0: tamanhos variáveis
+            count = _read_uint(f, stsz[0] + 8)
+            sizes.frombytes(f.read(4 * count))
+            if sys.byteorder == 'little':
+                sizes.byteswap()
+        return track_id, timescale, delta, sizes
+    return None
+
+
+def _mp4_fragment_sizes(f, end, track_id, default_delta):
+    """Tamanhos dos frames de um MP4 fragmentado (moof/traf/trun)"""
+    sizes = array.array('I')
+    delta = default_delta
+    f.seek(0)
+    for box_type, body, box_end in list(_mp4_boxes(f, end)):
+        if box_type != b'moof':
+            continue
+        f.seek(body)
+        for traf_type, traf, traf_end in list(_mp4_boxes(f, box_end)):
+            if traf_type != b'traf':
+                continue
+            tfhd = _mp4_child(f, traf, traf_end, [b'tfhd'])
+            if tfhd is None or _read_uint(f, tfhd[0] + 4) != track_id:
+                continue
+            flags = _read_uint(f, tfhd[0]) & 0xFFFFFF
+            offset = tfhd[0] + 8 + (8 if flags & 0x1 else 0) + (4 if flags & 0x2 else 0)
+            default_duration = default_size = None
+            if flags & 0x8:
+                default_duration = _read_uint(f, offset)
+                offset += 4
+            if flags & 0x10:
+                default_size = _read_uint(f, offset)
+            f.seek(traf)
+            for run_type, run, _ in list(_mp4_boxes(f, traf_end)):
+                if run_type != b'trun':
+                    continue
+                flags = _read_uint(f, run) & 0xFFFFFF
+                count = _read_uint(f, run + 4)
+                offset = run + 8 + (4 if flags & 0x1 else 0) + (4 if flags & 0x4 else 0)
+                # Campos por frame: duração, tamanho, flags, offset de composição
+                fields = [bool(flags & bit) for bit in (0x100, 0x200, 0x400, 0x800)]
+                f.seek(offset)
+                entries = array.array('I', f.read(4 * sum(fields) * count))
+                if sys.byteorder == 'little':
+                    entries.byteswap()
+                step = sum(fields)
+                if fields[1]:
+                    sizes.extend(entries[fields[0]::step])
+                elif default_size:
+                    sizes.extend([default_size] * count)
+                if delta is None:
+                    delta = entries[0] if fields[0] and count else default_duration
+    return sizes, delta
+
+
+def _mp4_peaks(path, points):
+    with open(path, 'rb') as f:
+        f.seek(0, os.SEEK_END)
+        end = f.tell()
+        moov = _mp4_child(f, 0, end, [b'moov'])
+        track = _mp4_audio_track(f, moov) if moov else None
+        if track is None:
+            raise WaveformError("MP4 sem trilha de áudio")
+        track_id, timescale, delta, sizes = track
+        if not sizes:
+            sizes, delta = _mp4_fragment_sizes(f, end, track_id, delta)
+    if not sizes or not max(sizes):
+        raise WaveformError("MP4 sem tamanhos de frame de áudio")
+    loudest = max(sizes)
+    # AAC: 1024 amostras por frame quando a duração não está declarada
+    acc = PeakAccumulator(timescale, block_frames=delta or 1024)
+    for size in sizes:
+        acc.add_level(size / loudest)
+    return acc.finish(points, 'mp4-frames')
+
+
+def compute_waveform(path, points=DEFAULT_POINTS, ffmpeg=None):
+    """Calcula a forma de onda de um arquivo local"""
+    with open(path, 'rb') as f:
+        reader = SequentialReader(f)
+        first = reader.read(3)
+        reader.unread(first)
+        skip_id3v2(reader)
+        kind = detect_format(reader.read(12))
+    if kind is None and first == b'ID3':
+        kind = 'mp3'
+
+    if kind == 'wav':
+        try:
+            return _wav_peaks(path, points)
+        except WaveformError:
+            if not ffmpeg:
+                raise
+    if ffmpeg:
+        return _ffmpeg_peaks(ffmpeg, path, points)
+    if kind == 'mp3':
+        return _mp3_peaks(path, points)
+    if kind == 'mp4':
+        return _mp4_peaks(path, points)
+    raise WaveformError("Formato não suportado sem ffmpeg")
+
+
+class WaveformStore:
+    """Arquivos .dat em WAVEFORM_FOLDER/ab/cd/<filename>.dat
+
+    O .dat (versão 1) não tem onde guardar a origem dos picos; ela fica ao
+    lado, em <filename>.dat.source. Formas de onda geradas antes disso não
+    têm o arquivo e a origem fica desconhecida (None).
+    """
+
+    def __init__(self, folder):
+        self.folder = folder
+
+    def path(self, filename):
+        return shard_path(self.folder, filename + '.dat')
+
+    def get(self, filename):
+        """(payload, origem) ou None"""
+        path = self.path(filename)
+        try:
+            with open(path, 'rb') as f:
+                payload = f.read()
+        except FileNotFoundError:
+            return None
+        try:
+            with open(path + '.source', encoding='ascii') as f:
+                source = f.read().strip() or None
+        except (FileNotFoundError, UnicodeDecodeError):
+            source = None
+        return payload, source
+
+    def _write(self, path, data):
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.waveform-')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    def put(self, filename, payload, source=None):
+        path = self.path(filename)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # A origem antes do .dat: um .dat visível sempre tem a sua
+        self._write(path + '.source', (source or '').encode('ascii'))
+        self._write(path, payload)
+
+    def delete(self, filename):
+        path = self.path(filename)
+        for name in (path, path + '.source'):
+            try:
+                os.remove(name)
+            except FileNotFoundError:
+                pass
+
+
+class WaveformJobs:
+    """Fila em segundo plano que gera as formas de onda, uma vez por arquivo
+
+    `local_copy(filename)` é um context manager que entrega um caminho no
+    disco (o próprio arquivo ou uma cópia temporária do backend remoto).
+    Arquivos sem áudio reconhecível (WaveformError) ficam marcados por
+    `failure_ttl` segundos: os pedidos seguintes falham na hora, sem baixar e
+    analisar o arquivo de novo.
+    """
+
+    def __init__(self, store, local_copy, points=DEFAULT_POINTS, workers=1, failure_ttl=FAILURE_TTL):
+        self.store = store
+        self.local_copy = local_copy
+        self.points = points
+        self.failure_ttl = failure_ttl
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='waveform')
+        self._pending = {}
+        self._failures = {}  # filename -> (expira em, mensagem)
+        self._lock = threading.Lock()
+        self.stats = {"generated": 0, "failed": 0, "failures_cached": 0}
+
+    def submit(self, filename):
+        """Agenda a geração; pedidos repetidos recebem o mesmo Future"""
+        with self._lock:
+            failure = self._failures.get(filename)
+            if failure is not None:
+                if failure[0] > time.monotonic():
+                    self.stats["failures_cached"] += 1
+                    future = Future()
+                    future.set_exception(WaveformError(failure[1]))
+                    return future
+                del self._failures[filename]
+            future = self._pending.get(filename)
+            if future is None:
+                future = self._pending[filename] = self._executor.submit(self._generate, filename)
+        return future
+
+    def forget(self, filename):
+        """Descarta a falha registrada (arquivo regravado ou removido)"""
+        with self._lock:
+            self._failures.pop(filename, None)
+
+    def _generate(self, filename):
+        """(payload .dat, origem dos picos)"""
+        try:
+            stored = self.store.get(filename)
+            if stored is None:
+                with self.local_copy(filename) as path:
+                    waveform = compute_waveform(path, self.points, find_ffmpeg())
+                stored = waveform.to_bytes(), waveform.source
+                self.store.put(filename, *stored)
+                self.stats["generated"] += 1
+            return stored
+        except WaveformError as e:
+            self.stats["failed"] += 1
+            with self._lock:
+                self._failures[filename] = (time.monotonic() + self.failure_ttl, str(e))
+            raise
+        except Exception:
+            # Erros de E/S (ex.: backend remoto) podem ser passageiros: não ficam marcados
+            self.stats["failed"] += 1
+            raise
+        finally:
+            with self._lock:
+                self._pending.pop(filename, None)
+
+
+def backfill(stores, media_folder, store, points=DEFAULT_POINTS):
+    """Gera as formas de onda que faltam para as mídias locais
+
+    `stores` são os MidiaStore da biblioteca (ver `database.library_stores`).
+    """
+    report = {"generated": 0, "existing": 0, "missing": 0, "failed": 0}
+    ffmpeg = find_ffmpeg()
+    for midia_store in stores:
+        for uri in midia_store.iter_uris():
+            filename = media_filename(uri)
+            path = resolve_media_path(media_folder, filename) if filename else None
+            if not path:
+                report["missing"] += 1
+            elif os.path.exists(store.path(filename)):
+                report["existing"] += 1
+            else:
+                try:
+                    waveform = compute_waveform(path, points, ffmpeg)
+                    store.put(filename, waveform.to_bytes(), waveform.source)
+                    report["generated"] += 1
+                except (WaveformError, OSError) as e:
+                    print(f"{filename}: {e}")
+                    report["failed"] += 1
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Forma de onda (picos mín./máx.) dos arquivos de mídia")
+    parser.add_argument('files', nargs='*', help="Arquivos para calcular a forma de onda")
+    parser.add_argument('--points', type=int, default=int(os.environ.get('WAVEFORM_POINTS', DEFAULT_POINTS)))
+    parser.add_argument('--backfill', action='store_true', help="Gera as formas de onda que faltam")
+    parser.add_argument('--db', default=os.environ.get('DB_FILE', 'midias.db'))
+    parser.add_argument('--media-folder', default=os.environ.get('MEDIA_FOLDER', 'media'))
+    parser.add_argument('--device-db-folder', default=os.environ.get('DEVICE_DB_FOLDER', 'devices'))
+    parser.add_argument('--waveform-folder', default=os.environ.get('WAVEFORM_FOLDER', 'waveforms'))
+    parser.add_argument('--database-url', default=os.environ.get('DATABASE_URL', ''),
+                        help="Servidor com a tabela de mídias (como no app)")
+    args = parser.parse_args()
+
+    if args.backfill:
+        stores = library_stores(args.db, args.device_db_folder, args.database_url)
+        store = WaveformStore(args.waveform_folder)
+        print(json.dumps(backfill(stores, args.media_folder, store, args.points), indent=2))
+    for path in args.files:
+        try:
+            waveform = compute_waveform(path, args.points, find_ffmpeg())
+        except WaveformError as e:
+            print(f"{path}: {e}")
+            continue
+        seconds = waveform.length * waveform.samples_per_pixel / waveform.sample_rate
+        print(f"{path}: {waveform.length} pontos, {seconds:.1f}s, "
+              f"{len(waveform.to_bytes())} bytes ({waveform.source})")
+
+
+if __name__ == '__main__':
+    main()